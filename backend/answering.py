@@ -0,0 +1,223 @@
+## Answering Questions ###############################################################################################
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Optional
+
+from batching import grouping
+from clients import BATCH, priority
+from log import get_logger
+from metrics import RequestTrace, TraceHandler, current_trace, request_seconds, requests_total
+from semantic_cache import SemanticCache, build_semantic_cache, normalize_question
+from settings import settings
+from singleflight import SingleFlight
+from tools import RAG_CHAIN_TAG
+from workflow import workflow
+
+logger = get_logger("api")
+
+# Compile
+compiled_workflow = workflow.compile()
+
+# Answers earlier questions that were similar enough, None when disabled; see get_semantic_cache
+semantic_cache: Optional[SemanticCache] = None
+semantic_cache_loaded = False
+semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """The semantic cache, built on first use; building it blocks, see aget_semantic_cache."""
+    global semantic_cache, semantic_cache_loaded  # pylint: disable=global-statement
+    with semantic_cache_lock:
+        if not semantic_cache_loaded:
+            semantic_cache = build_semantic_cache()
+            semantic_cache_loaded = True
+    return semantic_cache
+
+
+async def aget_semantic_cache() -> Optional[SemanticCache]:
+    """The semantic cache, built off the event loop when a question comes before api.load() built it."""
+    if semantic_cache_loaded:
+        return semantic_cache
+    return await asyncio.to_thread(get_semantic_cache)
+
+
+# Questions being answered by the workflow, by normalized question
+in_flight = SingleFlight("question")
+
+# Nodes that are timed, and reported by the streaming endpoint as they start
+WORKFLOW_NODES = {
+    "route", "retrieve", "rerank", "grade_documents", "generate", "grade_generation", "transform_query",
+    "web_search", "give_up",
+}
+
+
+def finish_trace(trace: RequestTrace, endpoint: str, cached: bool):
+    requests_total.inc(endpoint=endpoint, cached=str(cached).lower())
+    request_seconds.observe(trace.elapsed(), endpoint=endpoint)
+
+
+async def answer_question(question: str, trace: RequestTrace, endpoint: str = "question") -> dict:
+    cache = await aget_semantic_cache()
+    embedding = None
+    if cache is not None:
+        cached, embedding = await cache.lookup(question)
+        if cached is not None:
+            finish_trace(trace, endpoint, True)
+            return {"question": question, "answer": cached.answer, "cached": True}
+
+    # identical questions asked while this one is answered wait for its answer, if asked at the same priority
+    # and grouping: the workflow runs in the context of the question that started it
+    led = False
+
+    def lead():
+        nonlocal led
+        led = True
+        return run_workflow(question, trace, embedding)
+
+    r = await in_flight.do(f"{priority.get()}:{grouping.get()}:{normalize_question(question)}", lead)
+    if not led:
+        # the nodes and LLM calls are in the trace of the question that ran the workflow
+        trace.coalesced = True
+        trace.nodes.append(("coalesced", trace.elapsed()))
+    finish_trace(trace, endpoint, False)
+    return {"question": question, **r}
+
+
+async def run_workflow(question: str, trace: RequestTrace, embedding) -> dict:
+    inputs = {
+        "question": question,
+        # the router need not embed the question again
+        "question_embedding": embedding,
+    }
+
+    config = {"callbacks": [TraceHandler(trace, WORKFLOW_NODES)]}
+    state = {}
+    async for output in compiled_workflow.astream(inputs, config=config):
+        for key, value in output.items():
+            logger.debug("Node '%s' done", key)
+            state.update(value or {})
+
+    answer = state["generation"]#"Sorry, I don't know the answer to that question."
+    degraded = state.get("degraded") or None
+    # degraded answers are not worth serving again
+    cache = await aget_semantic_cache()
+    if cache is not None and not degraded:
+        await cache.store(question, answer, embedding)
+    return {"answer": answer, "degraded": degraded}
+
+
+async def answer_questions(questions: list[str], concurrency: int = 0) -> AsyncIterator[dict]:
+    """
+    Answers many questions, at most concurrency of them at a time (settings.batch_concurrency when 0),
+    grouping the routing and grading calls they make at about the same time into single LLM calls
+    (see batching.py).
+
+    Args:
+        questions (list[str]): The questions
+        concurrency (int): Questions answered at once
+
+    Yields:
+        dict: As each question is answered, so not in order: {"index": ..., "question": ..., "answer": ...,
+            "cached": ..., "degraded": ...}, or {"index": ..., "question": ..., "error": ...} when it failed
+    """
+    sem = asyncio.Semaphore(concurrency or settings.batch_concurrency)
+
+    async def one(index: int, question: str) -> dict:
+        async with sem:
+            # the context of this task only
+            grouping.set(True)
+            priority.set(BATCH)
+            trace = RequestTrace()
+            current_trace.set(trace)
+            try:
+                return {"index": index, "cached": False, **await answer_question(question, trace, "batch")}
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to answer question: %s", question)
+                return {"index": index, "question": question, "error": str(ex)}
+
+    tasks = [asyncio.ensure_future(one(i, question.strip())) for i, question in enumerate(questions)]
+    try:
+        for done in asyncio.as_completed(tasks):
+            yield await done
+    finally:
+        # the client went away
+        for task in tasks:
+            task.cancel()
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_answer(question: str):
+    """
+    Runs the workflow and yields it as server-sent events:
+        node: a node started, {"node": ...}; a "generate" event also means any streamed tokens so far are discarded
+        token: a piece of the answer being generated, {"token": ...}
+        verdict: the generation was graded, {"verdict": "useful" | "not useful" | "not supported" | "unchecked"}
+        answer: the final, graded answer, {"question": ..., "answer": ..., "cached": ..., "degraded": ...}
+        trace: what answering cost, sent last, {"llm_calls": ..., ..., "nodes": [[node, seconds], ...]}
+        error: the workflow failed, {"message": ...}
+    """
+    inputs = {
+        "question": question
+    }
+    trace = RequestTrace()
+    current_trace.set(trace)
+
+    try:
+        cache = await aget_semantic_cache()
+        embedding = None
+        if cache is not None:
+            cached, embedding = await cache.lookup(question)
+            if cached is not None:
+                finish_trace(trace, "stream", True)
+                yield sse_event("answer", {"question": question, "answer": cached.answer, "cached": True})
+                yield sse_event("trace", {**trace.summary(), "nodes": trace.nodes})
+                return
+
+        inputs["question_embedding"] = embedding
+        config = {"callbacks": [TraceHandler(trace, WORKFLOW_NODES)]}
+        async for event in compiled_workflow.astream_events(inputs, config=config, version="v2"):
+            kind = event["event"]
+            name = event["name"]
+            if kind == "on_chain_start" and name in WORKFLOW_NODES:
+                yield sse_event("node", {"node": name})
+            elif kind == "on_chat_model_stream" and RAG_CHAIN_TAG in event.get("tags", []):
+                token = event["data"]["chunk"].content
+                if token:
+                    yield sse_event("token", {"token": token})
+            elif kind == "on_chain_end" and name == "grade_generation" and "verdict" in (event["data"]["output"] or {}):
+                yield sse_event("verdict", {"verdict": event["data"]["output"]["verdict"]})
+            elif kind == "on_chain_end" and not event["parent_ids"]:
+                answer = event["data"]["output"]["generation"]
+                degraded = event["data"]["output"].get("degraded") or None
+                yield sse_event(
+                    "answer", {"question": question, "answer": answer, "cached": False, "degraded": degraded}
+                )
+                if cache is not None and not degraded:
+                    await cache.store(question, answer, embedding)
+        finish_trace(trace, "stream", False)
+        yield sse_event("trace", {**trace.summary(), "nodes": trace.nodes})
+    except Exception as ex:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to answer question: %s", question)
+        yield sse_event("error", {"message": str(ex)})
+
+
+async def stream_answers(questions: list[str], concurrency: int):
+    """
+    Yields the answers of answer_questions as server-sent events:
+        answer: a question was answered, {"index": ..., "question": ..., "answer": ..., "cached": ..., "degraded": ...}
+        error: a question could not be answered, {"index": ..., "question": ..., "message": ...}
+        done: all questions were, sent last, {"answered": ..., "failed": ...}
+    """
+    answered = failed = 0
+    async for r in answer_questions(questions, concurrency):
+        if "error" in r:
+            failed += 1
+            yield sse_event("error", {"index": r["index"], "question": r["question"], "message": r["error"]})
+        else:
+            answered += 1
+            yield sse_event("answer", r)
+    yield sse_event("done", {"answered": answered, "failed": failed})
@@ -1,23 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 import http
 import os
+import time
 from logging import Logger
-from pprint import pprint
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from typing import Optional
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import BaseModel
 
 from dotenv import load_dotenv
 from misc import format_datetime
-from errs import BaseError
+from answering import answer_question, get_semantic_cache, stream_answer, stream_answers
+from clients import async_http_client
+from errs import BadRequest, BaseError, ServiceUnavailable
 from log import get_logger
-from workflow import workflow
+from metrics import RequestTrace, current_trace, render_metrics
+from settings import settings
+import tools
 
 load_dotenv(dotenv_path=os.path.join(os.getcwd(), ".env"))
 
-# Compile
-compiled_workflow = workflow.compile()
+# Startup #############################################################################################################
+### The app answers health checks right away; the index, the chains and the semantic cache are loaded
+### in the background meanwhile. Questions asked before that finished wait for it, see loaded().
+
+startup = {"ready": False, "error": None, "seconds": None}
+# the background load() started by lifespan, None when the app runs without it
+loading: Optional[asyncio.Future] = None
+logger = get_logger("api")
+
+
+async def load():
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(tools.load)
+        await asyncio.to_thread(get_semantic_cache)
+    except Exception as ex:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to start")
+        startup["error"] = str(ex)
+        return
+    startup["ready"], startup["seconds"] = True, time.perf_counter() - started
+    logger.info("Ready in %.2fs", startup["seconds"])
+
+
+async def loaded():
+    """
+    Waits for the background load, so a question never builds the index or the chains on the event loop,
+    which would stall every other request, health checks included.
+    """
+    if loading is not None:
+        await asyncio.shield(loading)
+    if startup["error"] is not None:
+        raise ServiceUnavailable(f"Failed to start: {startup['error']}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):  # pylint: disable=unused-argument
+    global loading  # pylint: disable=global-statement
+    loading = asyncio.ensure_future(load())
+    yield
+    loading.cancel()
+    await async_http_client.aclose()
 
 
 class LoggingMiddleware(BaseHTTPMiddleware):
@@ -29,7 +75,7 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         return resp
     
 
-fastapi_app = FastAPI(validate_responses=False)
+fastapi_app = FastAPI(validate_responses=False, lifespan=lifespan)
 fastapi_app.add_middleware(LoggingMiddleware)
 
 @fastapi_app.exception_handler(BaseError)
@@ -61,24 +107,73 @@ async def internal_exception_handler(request: Request, exc):
 class QuestionRequest(BaseModel):
     question: str
 
+class QuestionsRequest(BaseModel):
+    questions: list[str]
+    # questions answered at once, at most settings.batch_concurrency; that when not given
+    concurrency: Optional[int] = None
+
 class AnswerResponse(BaseModel):
     question: str
     answer: str
+    cached: bool = False
+    # the budget that ran out, see graph.budget_exhausted; the answer is then the best one found so far
+    degraded: Optional[str] = None
 
 @fastapi_app.post("/rest/v1/question", response_model=AnswerResponse)
-async def submit_question(request: QuestionRequest):
+async def submit_question(request: QuestionRequest, response: Response):
+    await loaded()
     question = request.question.strip()
-    inputs = {
-        "question": question
-    }
-
-    for output in compiled_workflow.stream(inputs):
-        for key, value in output.items():
-            # Node
-            pprint(f"Node '{key}':")
-            # Optional: print full state at each node
-            # pprint.pprint(value["keys"], indent=2, width=80, depth=None)
-        pprint("\n---\n")
-    
-    answer = value["generation"]#"Sorry, I don't know the answer to that question."
-    return {"question": question, "answer": answer}
+    trace = RequestTrace()
+    current_trace.set(trace)
+    try:
+        return await answer_question(question, trace)
+    finally:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-RAG-Trace"] = trace.header()
+
+
+@fastapi_app.post("/rest/v1/question:stream")
+async def stream_question(request: QuestionRequest):
+    await loaded()
+    question = request.question.strip()
+    return StreamingResponse(
+        stream_answer(question),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@fastapi_app.post("/rest/v1/questions:batch")
+async def batch_questions(request: QuestionsRequest):
+    if len(request.questions) > settings.batch_max_questions:
+        raise BadRequest(f"At most {settings.batch_max_questions} questions per batch")
+    concurrency = min(request.concurrency or settings.batch_concurrency, settings.batch_concurrency)
+    if concurrency < 1:
+        raise BadRequest("concurrency must be at least 1")
+    await loaded()
+    return StreamingResponse(
+        stream_answers(request.questions, concurrency),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@fastapi_app.get("/health/live")
+async def live():
+    """The process is up and its event loop responsive."""
+    return {"status": "live"}
+
+
+@fastapi_app.get("/health/ready")
+async def ready():
+    """Whether the index and the chains were loaded, so questions are answered without delay."""
+    if startup["error"] is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": startup["error"]})
+    if not startup["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready", "seconds": startup["seconds"]}
+
+
+@fastapi_app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
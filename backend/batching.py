@@ -0,0 +1,126 @@
+## Cross-question Batching ############################################################################################
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from log import get_logger
+from metrics import batch_size
+
+logger = get_logger("batching")
+
+# Set while answering the questions of a batch: only then are stage calls held back to be grouped
+grouping = ContextVar("grouping", default=False)
+
+
+@dataclass
+class CallCount:
+    """The LLM calls grouped stages made on behalf of one question, see counted_calls."""
+
+    calls: int = 0
+
+
+call_count: ContextVar[Optional[CallCount]] = ContextVar("call_count", default=None)
+
+
+@contextmanager
+def counted_calls() -> Iterator[CallCount]:
+    """Counts the LLM calls the grouped stage calls made within it cause for the current question."""
+    count = CallCount()
+    token = call_count.set(count)
+    try:
+        yield count
+    finally:
+        call_count.reset(token)
+
+
+def charge(count: Optional[CallCount], calls: int = 1):
+    if count is not None:
+        count.calls += calls
+
+
+class GroupedStage(Runnable):
+    """
+    Wraps the chain of a workflow stage that questions answered together all go through (routing,
+    grading). Outside a batch it is the chain itself. Within one, calls arriving within window
+    seconds of each other, at most max_size of them, are answered by a single call of packed: a
+    prompt holding all their inputs numbered, built by pack, whose output unpack splits into one
+    output per input again. When unpack finds the output does not fit (None), the group is run
+    through the chain one by one after all.
+
+    The grouped call runs with the config of the first call of the group, so it is counted in that
+    question's trace, and charged to that question's counted_calls.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        single: Runnable,
+        packed: Runnable,
+        pack: Callable[[list[dict]], dict],
+        unpack: Callable[[Any, int], Optional[list]],
+        window: float,
+        max_size: int,
+    ):
+        self.name = name
+        self.single = single
+        self.packed = packed
+        self.pack = pack
+        self.unpack = unpack
+        self.window = window
+        self.max_size = max_size
+        self.pending: list[tuple[dict, Optional[RunnableConfig], asyncio.Future, Optional[CallCount]]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:  # pylint: disable=redefined-builtin
+        return self.single.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:  # pylint: disable=redefined-builtin
+        if not grouping.get() or self.max_size <= 1:
+            charge(call_count.get())
+            return await self.single.ainvoke(input, config, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((input, config, future, call_count.get()))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        group, self.pending = self.pending, []
+        if group:
+            asyncio.ensure_future(self.run(group))
+
+    async def run(self, group: list[tuple[dict, Optional[RunnableConfig], asyncio.Future, Optional[CallCount]]]):
+        inputs = [input for input, _, _, _ in group]
+        batch_size.observe(len(group), stage=self.name)
+        try:
+            outputs = None
+            if len(group) > 1:
+                charge(group[0][3])
+                outputs = self.unpack(await self.packed.ainvoke(self.pack(inputs), group[0][1]), len(group))
+                if outputs is None:
+                    logger.warning(
+                        "Grouped %s returned the wrong number of outputs, running them one by one", self.name
+                    )
+            if outputs is None:
+                for _, _, _, count in group:
+                    charge(count)
+                outputs = await self.single.abatch(inputs, [config for _, config, _, _ in group])
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            for _, _, future, _ in group:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        for (_, _, future, _), output in zip(group, outputs):
+            if not future.done():
+                future.set_result(output)
@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+# fakes.py words, so questions share vocabulary with the corpus
+TOPICS = [
+    "agent memory",
+    "planning with tools",
+    "chain of thought prompts",
+    "adversarial attacks on models",
+    "retrieval of relevant context",
+    "reflection on past steps",
+    "grading document relevance",
+    "vector search over sources",
+]
+
+
+def write_corpus(path: str, documents: int, words: int = 600):
+    """Writes documents deterministic text files to path."""
+    from fakes import WORDS  # pylint: disable=import-outside-toplevel
+
+    os.makedirs(path, exist_ok=True)
+    for i in range(documents):
+        rnd = random.Random(i)
+        topic = TOPICS[i % len(TOPICS)]
+        paragraphs = []
+        for _ in range(words // 100):
+            paragraphs.append(f"On {topic}: " + " ".join(rnd.choice(WORDS) for _ in range(100)) + ".")
+        with open(os.path.join(path, f"doc_{i:04d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+
+
+def build_questions(total: int) -> list[str]:
+    return [f"What do the sources say about {TOPICS[i % len(TOPICS)]} (question {i})?" for i in range(total)]
+
+
+async def run_workflow(questions: list[str], concurrency: int) -> list[tuple[float, int]]:
+    """
+    Runs every question through compiled_workflow, with at most concurrency in flight.
+
+    Returns:
+        list[tuple[float, int]]: Latency in seconds and number of LLM calls, per question
+    """
+    from answering import WORKFLOW_NODES, compiled_workflow  # pylint: disable=import-outside-toplevel
+    from metrics import RequestTrace, TraceHandler, current_trace  # pylint: disable=import-outside-toplevel
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(question: str) -> tuple[float, int]:
+        async with sem:
+            trace = RequestTrace()
+            current_trace.set(trace)
+            await compiled_workflow.ainvoke(
+                {"question": question}, config={"callbacks": [TraceHandler(trace, WORKFLOW_NODES)]}
+            )
+            return trace.elapsed(), trace.llm_calls
+
+    return await asyncio.gather(*(one(q) for q in questions))
+
+
+async def run_api(questions: list[str], concurrency: int) -> list[tuple[float, int]]:
+    """Same as run_workflow, through the FastAPI app in-process; LLM calls are read from X-RAG-Trace."""
+    import httpx  # pylint: disable=import-outside-toplevel
+
+    from api import fastapi_app  # pylint: disable=import-outside-toplevel
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=fastapi_app), base_url="http://bench") as client:
+
+        async def one(question: str) -> tuple[float, int]:
+            async with sem:
+                started = time.perf_counter()
+                resp = await client.post("/rest/v1/question", json={"question": question}, timeout=None)
+                resp.raise_for_status()
+                trace = dict(kv.split("=", 1) for kv in resp.headers["X-RAG-Trace"].split(";"))
+                return time.perf_counter() - started, int(trace["llm_calls"])
+
+        return await asyncio.gather(*(one(q) for q in questions))
+
+
+async def run_batch(questions: list[str], concurrency: int) -> list[tuple[float, int]]:
+    """
+    Same as run_workflow, through answering.answer_questions, so routing and grading calls are grouped across questions.
+    Latency is from the start of the batch to the question's answer; LLM calls are the batch's total, spread evenly.
+    """
+    from answering import answer_questions  # pylint: disable=import-outside-toplevel
+    from metrics import llm_calls_total  # pylint: disable=import-outside-toplevel
+
+    calls_before = sum(llm_calls_total.values.values())
+    started = time.perf_counter()
+    latencies = [time.perf_counter() - started async for _ in answer_questions(questions, concurrency)]
+    calls = sum(llm_calls_total.values.values()) - calls_before
+    return [(latency, calls / len(latencies)) for latency in latencies]
+
+
+def prompt_tokens() -> float:
+    """Prompt tokens of every LLM call so far."""
+    from metrics import llm_tokens_total  # pylint: disable=import-outside-toplevel
+
+    return sum(v for (_, kind), v in llm_tokens_total.values.items() if kind == "prompt")
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def main(args) -> list[dict]:
+    from loadtest import percentile  # pylint: disable=import-outside-toplevel
+
+    runners = {"workflow": run_workflow, "api": run_api, "batch": run_batch}
+    results = []
+    print(
+        f"{'mode':>8} {'concurrency':>11} {'questions':>9} {'q/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'llm/q':>6} {'prompt tok/q':>12} {'rss MB':>7}"
+    )
+    for mode in args.mode:
+        for concurrency in args.concurrency:
+            questions = build_questions(args.requests)
+            tokens_before = prompt_tokens()
+            started = time.perf_counter()
+            # the nodes print their progress
+            with contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")):
+                samples = await runners[mode](questions, concurrency)
+            elapsed = time.perf_counter() - started
+
+            latencies = [latency for latency, _ in samples]
+            r = {
+                "mode": mode,
+                "concurrency": concurrency,
+                "questions": len(samples),
+                "throughput": len(samples) / elapsed,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "llm_calls_per_question": sum(calls for _, calls in samples) / len(samples),
+                "prompt_tokens_per_question": (prompt_tokens() - tokens_before) / len(samples),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            results.append(r)
+            print(
+                f"{mode:>8} {concurrency:>11} {r['questions']:>9} {r['throughput']:>8.2f} {r['p50_ms']:>8.0f} "
+                f"{r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['llm_calls_per_question']:>6.2f} "
+                f"{r['prompt_tokens_per_question']:>12.0f} {r['peak_rss_mb']:>7.0f}"
+            )
+    return results
+
+
+def configure(args, work_dir: str):
+    """Points the settings at the offline stand-ins; must run before any module reading settings is imported."""
+    os.environ.update(
+        {
+            "LLM_BACKEND": "fake",
+            "EMBEDDING_BACKEND": "hash",
+            "EMBEDDING_MODEL": "hashing",
+            "WEB_SEARCH_BACKEND": "fake",
+            "FAKE_LLM_LATENCY": str(args.llm_latency),
+            "FAKE_WEB_SEARCH_LATENCY": str(args.search_latency),
+            "FAKE_LLM_YES_RATE": str(args.yes_rate),
+            "FAKE_LLM_WEB_SEARCH_RATE": str(args.web_search_rate),
+            "INDEX_DIR": os.path.join(work_dir, "index"),
+            "INDEX_SOURCES": json.dumps([os.path.join(work_dir, "corpus")]),
+            "EMBEDDING_CACHE_DIR": os.path.join(work_dir, "embedding_cache"),
+            "SEMANTIC_CACHE_BACKEND": args.semantic_cache,
+            "MEMO_ENABLED": str(args.memo).lower(),
+            "MEMO_PATH": "",
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "unused"),
+            "TAVILY_API_KEY": os.environ.get("TAVILY_API_KEY", "unused"),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the workflow offline: fake LLMs with fixed latency, hashing embeddings, no network"
+    )
+    parser.add_argument(
+        "--mode",
+        type=lambda v: v.split(","),
+        default=["workflow", "api"],
+        help="comma separated: workflow (compiled_workflow directly), api (the FastAPI app in-process) and/or batch "
+        "(answering.answer_questions)",
+    )
+    parser.add_argument("--requests", type=int, default=64, help="questions per run")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda v: [int(c) for c in v.split(",")],
+        default=[1, 4, 16],
+        help="comma separated concurrency levels to sweep",
+    )
+    parser.add_argument("--documents", type=int, default=40, help="documents in the generated corpus")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="seconds per fake web search")
+    parser.add_argument("--yes-rate", type=float, default=1.0, help="share of fake grades that are 'yes'")
+    parser.add_argument("--web-search-rate", type=float, default=0.25, help="share of questions routed to web search")
+    parser.add_argument("--semantic-cache", default="none", choices=["none", "memory", "sqlite"])
+    parser.add_argument("--memo", action="store_true", help="memoize LLM calls, off so every question pays for them")
+    parser.add_argument("--json", help="also write the results to this file, e.g. for CI to compare")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as work_dir:
+        configure(args, work_dir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+        from indexing import build_index  # pylint: disable=wrong-import-position
+
+        write_corpus(os.path.join(work_dir, "corpus"), args.documents)
+        started = time.perf_counter()
+        manifest = build_index()
+        print(f"Indexed {len(manifest.sources)} documents in {time.perf_counter() - started:.2f}s")
+
+        results = asyncio.run(main(args))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
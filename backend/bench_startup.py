@@ -0,0 +1,66 @@
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench  # pylint: disable=wrong-import-position
+
+# Run in a fresh interpreter each time, so nothing is imported already
+PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter() - started
+asyncio.run(api.load())
+print(json.dumps({"import_s": imported, "ready_s": api.startup["seconds"], "error": api.startup["error"]}))
+"""
+
+
+def probe() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how long importing api.py takes, and then loading the index and chains, offline"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--documents", type=int, default=40, help="documents in the generated corpus")
+    parser.add_argument("--max-import-seconds", type=float, help="exit with 1 when the median import took longer")
+    args = parser.parse_args()
+    # what bench.configure expects besides
+    args.llm_latency = args.search_latency = 0.0
+    args.yes_rate, args.web_search_rate = 1.0, 0.0
+    args.semantic_cache, args.memo = "memory", True
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-startup-") as work_dir:
+        bench.configure(args, work_dir)
+        from indexing import build_index  # pylint: disable=wrong-import-position
+
+        bench.write_corpus(os.path.join(work_dir, "corpus"), args.documents)
+        with contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")):
+            build_index()
+
+        results = [probe() for _ in range(args.runs)]
+        errors = [r["error"] for r in results if r["error"]]
+        if errors:
+            sys.exit(f"Failed to load: {errors[0]}")
+
+        import_s = statistics.median(r["import_s"] for r in results)
+        ready_s = statistics.median(r["ready_s"] for r in results)
+        print(f"{args.runs} runs, median: import api {import_s * 1000:.0f} ms, then ready {ready_s * 1000:.0f} ms")
+        if args.max_import_seconds is not None and import_s > args.max_import_seconds:
+            sys.exit(f"Importing api took {import_s:.2f}s, over the {args.max_import_seconds:.2f}s budget")
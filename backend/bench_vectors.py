@@ -0,0 +1,172 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.embeddings import Embeddings  # pylint: disable=wrong-import-position
+
+from flat_index import FlatVectorStore, normalize_rows, top_k  # pylint: disable=wrong-import-position
+from ivf_index import IVFVectorStore  # pylint: disable=wrong-import-position
+from loadtest import percentile  # pylint: disable=wrong-import-position
+
+
+class LookupEmbeddings(Embeddings):
+    """Embeds "<i>" as the i-th of a precomputed set of vectors, so stores can be filled and queried without a model."""
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.vectors[[int(t) for t in texts]].tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.vectors[int(text)].tolist()
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors scattered around random cluster centres, closer to real embeddings than uniform noise."""
+    rnd = np.random.default_rng(seed)
+    centres = rnd.standard_normal((clusters, dim)).astype(np.float32)
+    noise = 0.6 * rnd.standard_normal((n, dim)).astype(np.float32)
+    return normalize_rows(centres[rnd.integers(0, clusters, n)] + noise)
+
+
+def open_store(backend: str, path: str, embeddings: Embeddings, args):
+    """A store of backend: chroma, flat or ivf, the last two optionally quantized, as in flat+int8 or ivf+pq."""
+    backend, _, quantization = backend.partition("+")
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma  # pylint: disable=import-outside-toplevel
+
+        return Chroma(collection_name="bench", embedding_function=embeddings, persist_directory=path)
+    quantization = {"quantization": quantization or "none", "rescore": args.rescore, "pq_subspaces": args.pq_subspaces}
+    if backend == "ivf":
+        return IVFVectorStore(path, embeddings, nlist=args.nlist, **quantization)
+    return FlatVectorStore(path, embeddings, **quantization)
+
+
+def bytes_per_vector(store, dim: int) -> float:
+    """Memory a vector takes while searched: its codes when quantized, else the float32 vector (or unknown)."""
+    if not isinstance(store, FlatVectorStore):
+        return float("nan")
+    if store.codes is not None:
+        return store.codes.nbytes / len(store.codes)
+    return 4 * dim
+
+
+def build(backend: str, path: str, corpus: np.ndarray, args):
+    """Fills a store of the backend with corpus; returns it as a worker would open it, and the build time."""
+    embeddings = LookupEmbeddings(corpus)
+    store = open_store(backend, path, embeddings, args)
+    started = time.perf_counter()
+    for i in range(0, len(corpus), 4096):
+        ids = [str(j) for j in range(i, min(i + 4096, len(corpus)))]
+        store.add_texts(ids, ids=ids)
+    if isinstance(store, FlatVectorStore):
+        store.persist()
+        # what a worker does: memory-map the persisted index
+        store = open_store(backend, path, embeddings, args)
+    return store, time.perf_counter() - started
+
+
+def evaluate(name: str, store, build_s: float, queries: np.ndarray, exact: np.ndarray, args) -> dict:
+    k = args.k
+    query_vectors = queries.tolist()
+    found, latencies = [], []
+    for q in query_vectors:
+        started = time.perf_counter()
+        docs = store.similarity_search_by_vector(q, k=k)
+        latencies.append(time.perf_counter() - started)
+        found.append([int(d.page_content) for d in docs])
+
+    batched = None
+    if isinstance(store, FlatVectorStore):
+        started = time.perf_counter()
+        for i in range(0, len(query_vectors), args.batch):
+            store.search_by_vectors(query_vectors[i : i + args.batch], k)
+        batched = len(query_vectors) / (time.perf_counter() - started)
+
+    return {
+        "backend": name,
+        "build_s": build_s,
+        "bytes": bytes_per_vector(store, queries.shape[1]),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "qps": len(latencies) / sum(latencies),
+        "batched_qps": batched,
+        "recall": float(np.mean([len(set(f).intersection(e)) / k for f, e in zip(found, exact.T.tolist())])),
+    }
+
+
+def bench(backend: str, corpus: np.ndarray, queries: np.ndarray, exact: np.ndarray, args) -> list[dict]:
+    with tempfile.TemporaryDirectory(prefix=f"bench-{backend}-") as path:
+        store, build_s = build(backend, path, corpus, args)
+        if not backend.startswith("ivf"):
+            return [evaluate(backend, store, build_s, queries, exact, args)]
+        # one build, queried at every recall/latency tradeoff
+        r = []
+        for nprobe in args.nprobe:
+            store.nprobe = nprobe
+            r.append(evaluate(f"{backend}/{nprobe}", store, build_s, queries, exact, args))
+        return r
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vector store backends on synthetic embeddings")
+    parser.add_argument(
+        "--backends",
+        type=lambda v: v.split(","),
+        default=["chroma", "flat", "flat+int8", "flat+pq", "ivf", "ivf+int8"],
+        help="comma separated; flat and ivf quantized as in flat+int8 or ivf+pq",
+    )
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536, help="1536 like text-embedding-ada-002")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=32, help="queries per batched search")
+    parser.add_argument("--nlist", type=int, default=0, help="ivf lists, 0 for about 4 * sqrt(vectors)")
+    parser.add_argument(
+        "--nprobe",
+        type=lambda v: [int(p) for p in v.split(",")],
+        default=[1, 4, 16, 64],
+        help="comma separated ivf lists to probe per query, one result row each",
+    )
+    parser.add_argument("--rescore", type=int, default=50, help="quantized: candidates rescored exactly, times k")
+    parser.add_argument("--pq-subspaces", type=int, default=0, help="pq bytes per vector, 0 for dimensions / 8")
+    args = parser.parse_args()
+
+    data = synthetic_vectors(args.vectors + args.queries, args.dim, args.clusters)
+    corpus, queries = data[: args.vectors], data[args.vectors :]
+    # ground truth for recall@k: exact top k by brute force
+    exact = top_k(corpus @ queries.T, args.k)
+
+    print(
+        f"{args.vectors} vectors of {args.dim} dimensions, {args.queries} queries, "
+        f"recall@{args.k} against exact search"
+    )
+    print("B/vec: memory per vector searched; loss: recall lost to quantization, against the same backend unquantized")
+    print(
+        f"{'backend':>14} {'build s':>8} {'B/vec':>7} {'p50 ms':>8} {'p99 ms':>8} {'q/s':>8} {'batch q/s':>10} "
+        f"{'recall':>7} {'loss':>7}"
+    )
+    full_precision = {}
+    for backend in args.backends:
+        for r in bench(backend, corpus, queries, exact, args):
+            base, _, quantization = r["backend"].partition("+")
+            if not quantization:
+                full_precision[base] = r["recall"]
+            # ivf+int8/16 compares to ivf/16
+            base += quantization.partition("/")[1] + quantization.partition("/")[2]
+            loss = f"{'-':>7}"
+            if quantization and base in full_precision:
+                loss = f"{full_precision[base] - r['recall']:>7.3f}"
+            batched = f"{r['batched_qps']:>10.0f}" if r["batched_qps"] else f"{'-':>10}"
+            print(
+                f"{r['backend']:>14} {r['build_s']:>8.2f} {r['bytes']:>7.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['qps']:>8.0f} {batched} {r['recall']:>7.3f} {loss}"
+            )
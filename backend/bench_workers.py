@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench  # pylint: disable=wrong-import-position
+
+# A worker: loads the index and chains like the app does, searches the whole index, reports its memory
+# and then stays alive until told to exit, so the pages it maps are counted as shared with the others
+PROBE = """
+import asyncio, json, sys
+import api, tools
+asyncio.run(api.load())
+for q in ["agent memory", "prompt engineering", "adversarial attacks", "planning and tool use"]:
+    tools.retriever.invoke(q)
+memory = {}
+with open("/proc/self/smaps_rollup", encoding="utf-8") as f:
+    for line in f:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            memory[parts[0].rstrip(":")] = int(parts[1]) * 1024
+print(json.dumps(memory), flush=True)
+sys.stdin.read()
+"""
+
+
+def run_workers(workers: int, env: dict[str, str]) -> list[dict]:
+    """Memory of workers processes running at the same time, each as a dict of its smaps_rollup."""
+    processes = [
+        subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-c", PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        for _ in range(workers)
+    ]
+    try:
+        return [json.loads(p.stdout.readline()) for p in processes]
+    finally:
+        for p in processes:
+            p.stdin.close()
+            p.wait()
+
+
+def private(memory: dict) -> int:
+    return memory["Private_Clean"] + memory["Private_Dirty"]
+
+
+def mb(n: float) -> str:
+    return f"{n / 2**20:.1f}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the memory of worker processes serving one index, against workers serving an "
+        "almost empty one, offline (Linux only, reads /proc/self/smaps_rollup)"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--documents", type=int, default=2000, help="documents in the generated corpus")
+    parser.add_argument("--vector-backend", choices=["flat", "ivf"], default="flat")
+    parser.add_argument("--max-private-mb", type=float, help="exit with 1 when the index costs a worker more")
+    args = parser.parse_args()
+    # what bench.configure expects besides
+    args.llm_latency = args.search_latency = 0.0
+    args.yes_rate, args.web_search_rate = 1.0, 0.0
+    args.semantic_cache, args.memo = "memory", True
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-workers-") as work_dir:
+        rows = []
+        for name, documents in (("baseline", 1), ("index", args.documents)):
+            os.environ["VECTOR_BACKEND"] = args.vector_backend
+            bench.configure(args, os.path.join(work_dir, name))
+            bench.write_corpus(os.path.join(work_dir, name, "corpus"), documents)
+            # each in a process of its own, the settings are read once per process
+            subprocess.run(
+                [sys.executable, "-c", "from indexing import build_index; build_index()"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=dict(os.environ),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            index_dir = os.path.join(work_dir, name, "index")
+            size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(index_dir) for f in files)
+            rows.append((name, size, run_workers(args.workers, dict(os.environ))))
+
+        print(f"{args.workers} workers, {args.vector_backend} backend, MB per worker (median)")
+        print(f"{'':>10} {'index':>8} {'rss':>8} {'pss':>8} {'private':>8} {'shared':>8}")
+        medians = {}
+        for name, size, memory in rows:
+            mid = sorted(memory, key=private)[len(memory) // 2]
+            medians[name] = private(mid)
+            shared = mid["Shared_Clean"] + mid["Shared_Dirty"]
+            print(
+                f"{name:>10} {mb(size):>8} {mb(mid['Rss']):>8} {mb(mid['Pss']):>8} {mb(private(mid)):>8} "
+                f"{mb(shared):>8}"
+            )
+        extra = medians["index"] - medians["baseline"]
+        print(f"the index costs each worker {mb(extra)} MB of private memory")
+        if args.max_private_mb is not None and extra > args.max_private_mb * 2**20:
+            sys.exit(f"The index costs each worker {mb(extra)} MB, over the {args.max_private_mb:.1f} MB budget")
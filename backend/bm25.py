@@ -0,0 +1,188 @@
+## BM25 Keyword Index #################################################################################################
+import bisect
+import math
+import os
+import re
+from array import array
+from typing import Iterable, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from columns import ColumnWriter, JSONColumn, StringColumn, save_array
+
+ARRAYS = ("indptr", "docs", "tfs", "doc_len")
+
+# common words that would only add noise to keyword scores
+STOPWORDS = set(
+    "a an and are as at be by can do does for from how i in is it of on or that the this to was what when where "
+    "which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+
+class Postings:
+    """
+    The postings of documents added one at a time, kept as flat arrays of 4-byte (term, doc, tf)
+    entries in the order the documents came, until csr() sorts them by term.
+    """
+
+    def __init__(self):
+        # token -> term id, in order of first use
+        self.vocabulary: dict[str, int] = {}
+        self.term_ids = array("i")
+        self.docs = array("i")
+        self.tfs = array("f")
+        self.doc_len = array("i")
+
+    def add(self, text: str):
+        counts: dict[str, int] = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        doc = len(self.doc_len)
+        for token, tf in counts.items():
+            self.term_ids.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+            self.docs.append(doc)
+            self.tfs.append(tf)
+        self.doc_len.append(sum(counts.values()))
+
+    def csr(self) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """The sorted terms, and the indptr, docs, tfs and doc_len arrays of BM25Index."""
+        terms = sorted(self.vocabulary)
+        rank = np.zeros(len(terms), dtype=np.int64)
+        rank[[self.vocabulary[t] for t in terms]] = np.arange(len(terms))
+        term_ranks = rank[np.frombuffer(self.term_ids, dtype=np.int32)]
+        # stable, so the postings of a term stay in the order of the docs
+        order = np.argsort(term_ranks, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ranks, minlength=len(terms)), out=indptr[1:])
+        return (
+            terms,
+            indptr,
+            np.frombuffer(self.docs, dtype=np.int32)[order],
+            np.frombuffer(self.tfs, dtype=np.float32)[order],
+            np.frombuffer(self.doc_len, dtype=np.int32).copy(),
+        )
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks, scored with Okapi BM25. Postings are kept in CSR form: the
+    postings of term t are docs[indptr[t]:indptr[t + 1]] with term frequencies tfs[...], so the whole
+    index is a handful of flat arrays, cheap to hold in memory and to persist.
+
+    Persisted in a directory as those arrays and string columns of the sorted terms and of the ids,
+    texts and metadata of the chunks (see columns.py), all memory-mapped read-only when loaded, so
+    worker processes serving the same index share them. Terms are looked up by binary search.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        texts: Sequence[str],
+        metadatas: Sequence[dict],
+        terms: Sequence[str],
+        indptr: np.ndarray,
+        docs: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.terms = terms
+        self.indptr = indptr
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    @classmethod
+    def build(cls, ids: list[str], documents: list[Document]) -> "BM25Index":
+        postings = Postings()
+        for doc in documents:
+            postings.add(doc.page_content)
+        return cls(ids, [doc.page_content for doc in documents], [doc.metadata for doc in documents], *postings.csr())
+
+    @classmethod
+    def write(cls, path: str, batches: Iterable[list[Document]]):
+        """
+        Builds the index of the documents of batches, by their ids, straight into the directory path, as
+        save() would write it. Texts and metadata are written as they come; only the postings and the
+        vocabulary are held in memory, so a batch at a time is all there is of the texts.
+        """
+        os.makedirs(path, exist_ok=True)
+        ids = ColumnWriter(StringColumn, path, "ids")
+        texts = ColumnWriter(StringColumn, path, "texts")
+        metadatas = ColumnWriter(JSONColumn, path, "metadatas")
+        postings = Postings()
+        for batch in batches:
+            for doc in batch:
+                ids.append(doc.id)
+                texts.append(doc.page_content)
+                metadatas.append(doc.metadata)
+                postings.add(doc.page_content)
+        for column in (ids, texts, metadatas):
+            column.close()
+
+        terms, *arrays = postings.csr()
+        StringColumn.save(path, "terms", terms)
+        for name, a in zip(ARRAYS, arrays):
+            save_array(os.path.join(path, name + ".npy"), a)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def term(self, token: str) -> int | None:
+        t = bisect.bisect_left(self.terms, token)
+        return t if t < len(self.terms) and self.terms[t] == token else None
+
+    def document(self, i: int) -> Document:
+        return Document(id=self.ids[i], page_content=self.texts[i], metadata=self.metadatas[i])
+
+    def search(self, query: str, k: int) -> list[tuple[Document, float]]:
+        """The k best scoring chunks for query, best first; chunks sharing no term with it are left out."""
+        n = len(self.ids)
+        scores = np.zeros(n, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avg_len, 1e-9))
+        for token in set(tokenize(query)):
+            t = self.term(token)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs, tfs = self.docs[start:end], self.tfs[start:end]
+            df = end - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k)[:k]]
+        hits = hits[np.argsort(-scores[hits])]
+        return [(self.document(i), float(scores[i])) for i in hits]
+
+    def save(self, path: str):
+        # each file by write-then-rename; a build writes a new directory, see indexing.py
+        os.makedirs(path, exist_ok=True)
+        StringColumn.save(path, "ids", self.ids)
+        StringColumn.save(path, "texts", self.texts)
+        JSONColumn.save(path, "metadatas", self.metadatas)
+        StringColumn.save(path, "terms", self.terms)
+        for name in ARRAYS:
+            save_array(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index | None":
+        ids = StringColumn.load(path, "ids")
+        if ids is None:
+            return None
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS]
+        texts, metadatas = StringColumn.load(path, "texts"), JSONColumn.load(path, "metadatas")
+        return cls(ids, texts, metadatas, StringColumn.load(path, "terms"), *arrays)
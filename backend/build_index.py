@@ -0,0 +1,21 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+from log import LogConfig, init_loggers
+from settings import settings
+
+load_dotenv(dotenv_path=os.path.join(os.getcwd(), ".env"))
+
+from indexing import build_index  # pylint: disable=wrong-import-position
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the persistent retrieval index")
+    parser.add_argument("--index-dir", default=settings.index_dir, help="where to write the index")
+    parser.add_argument("sources", nargs="*", help="URLs, files or directories to index, defaults to INDEX_SOURCES")
+    args = parser.parse_args()
+
+    init_loggers(LogConfig(level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    manifest = build_index(args.index_dir, args.sources or None)
+    print(f"Indexed {len(manifest.sources)} source(s) into {args.index_dir}")
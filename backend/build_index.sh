@@ -0,0 +1,10 @@
+#!/bin/bash
+
+source .env
+
+export OPENAI_API_KEY
+export OPENAI_PROXY_URL
+export HTTPS_PROXY
+export HTTP_PROXY
+
+python build_index.py "$@"
@@ -0,0 +1,222 @@
+## Shared HTTP Clients ################################################################################################
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import httpx
+
+from log import get_logger
+from metrics import rate_limit_queue_depth, rate_limit_wait_seconds, rate_limited_total
+from settings import settings
+
+logger = get_logger("clients")
+
+# Scheduling classes, served in this order
+INTERACTIVE, BATCH = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Class of the requests made on behalf of the question being answered; batches set BATCH
+priority: ContextVar[int] = ContextVar("priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 a second, holding at most burst_seconds worth. 0 per minute: no limit."""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken; amounts over the capacity wait for a full bucket."""
+        if self.rate == 0:
+            return 0
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        if self.rate:
+            self.level -= amount
+
+    def clamp(self, remaining: float):
+        """The provider reported remaining only left: never assume more."""
+        if self.rate:
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    Schedules requests within a requests-per-minute and a tokens-per-minute budget, each a token bucket.
+    Requests that cannot go right away queue, by priority and then in order of arrival, so interactive
+    questions overtake batches. The budgets are kept in line with the provider's own view, the
+    remaining requests and tokens it reports, and everything stops for a while after it answered 429.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, burst_seconds: float):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.paused_until = 0.0
+        # (priority, arrival, tokens, future), a heap
+        self.queue: list[tuple[int, int, float, asyncio.Future]] = []
+        self.arrivals = itertools.count()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.pump_task: Optional[asyncio.Task] = None
+
+    def wait(self, tokens: float, now: float) -> float:
+        return max(self.paused_until - now, self.requests.wait(1, now), self.tokens.wait(tokens, now))
+
+    def take(self, tokens: float):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    async def acquire(self, tokens: float, prio: int = INTERACTIVE):
+        """Returns once a request estimated at tokens may be sent."""
+        if not self.queue and self.wait(tokens, time.monotonic()) == 0:
+            self.take(tokens)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (prio, next(self.arrivals), tokens, future))
+        self.update_depth()
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        # a more urgent request may have to go first
+        self.wakeup.set()
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.ensure_future(self.pump())
+        try:
+            await future
+        finally:
+            if not future.done():
+                future.cancel()
+            self.update_depth()
+
+    async def pump(self):
+        while self.queue:
+            _, _, tokens, future = self.queue[0]
+            if future.done():
+                # the caller went away
+                heapq.heappop(self.queue)
+                continue
+            wait = self.wait(tokens, time.monotonic())
+            if wait > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.queue)
+            self.take(tokens)
+            future.set_result(None)
+
+    def observe(self, response: httpx.Response):
+        """Takes in what the response says about the provider's rate limits."""
+        remaining = response.headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.isdigit():
+            self.requests.clamp(float(remaining))
+        remaining = response.headers.get("x-ratelimit-remaining-tokens")
+        if remaining is not None and remaining.isdigit():
+            self.tokens.clamp(float(remaining))
+        if response.status_code == 429:
+            rate_limited_total.inc(limiter=self.name)
+            seconds = retry_after(response)
+            logger.warning("%s rate limited, pausing for %.1fs", self.name, seconds)
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_depth(self):
+        depths = {name: 0 for name in PRIORITY_NAMES.values()}
+        for prio, _, _, future in self.queue:
+            if not future.done():
+                depths[PRIORITY_NAMES[prio]] += 1
+        for name, depth in depths.items():
+            rate_limit_queue_depth.set(depth, limiter=self.name, priority=name)
+
+
+def retry_after(response: httpx.Response, default: float = 1.0) -> float:
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(response.headers[header]) * scale
+        except (KeyError, ValueError):
+            continue
+    return default
+
+
+def estimate_tokens(request: httpx.Request) -> float:
+    """Tokens a chat completion or embeddings request will use, from its body at about 4 characters a token."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return 0
+    chars = 0
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        chars += len(content if isinstance(content, str) else json.dumps(content))
+    inputs = body.get("input", [])
+    for i in inputs if isinstance(inputs, list) else [inputs]:
+        # OpenAIEmbeddings sends token ids
+        chars += len(i) * 4 if isinstance(i, list) else len(str(i))
+    return chars / 4 + (body.get("max_tokens") or body.get("max_completion_tokens") or 0)
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """Sends the requests to hosts through limiter, at the priority of the question they are made for."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: RateLimiter, hosts: set[str]):
+        self.transport = transport
+        self.limiter = limiter
+        self.hosts = hosts
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host not in self.hosts:
+            return await self.transport.handle_async_request(request)
+        prio = priority.get()
+        started = time.perf_counter()
+        await self.limiter.acquire(estimate_tokens(request), prio)
+        rate_limit_wait_seconds.observe(
+            time.perf_counter() - started, limiter=self.limiter.name, priority=PRIORITY_NAMES[prio]
+        )
+        response = await self.transport.handle_async_request(request)
+        self.limiter.observe(response)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+    )
+
+
+# every worker process has a limiter of its own, with its share of the budgets
+openai_limiter = RateLimiter(
+    "openai",
+    settings.openai_requests_per_minute // max(1, settings.workers),
+    settings.openai_tokens_per_minute // max(1, settings.workers),
+    settings.rate_limit_burst_seconds,
+)
+
+# One connection pool each for the synchronous and the asynchronous calls of every chat model, the
+# embeddings and the web search. Only the asynchronous calls, those of the workflow, are rate limited;
+# the synchronous ones are build_index's, which has its own concurrency limits.
+http_client = httpx.Client(limits=build_limits(), timeout=settings.http_timeout)
+async_http_client = httpx.AsyncClient(
+    transport=RateLimitedTransport(
+        httpx.AsyncHTTPTransport(limits=build_limits()), openai_limiter, set(settings.openai_rate_limited_hosts)
+    ),
+    timeout=settings.http_timeout,
+)
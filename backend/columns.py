@@ -0,0 +1,103 @@
+## Memory-mapped String Columns #######################################################################################
+import json
+import os
+from typing import Any, Iterator, Sequence
+
+import numpy as np
+
+
+def save_array(path: str, a: np.ndarray):
+    # write-then-rename, so a reader never sees a half written file
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, a)
+    os.replace(path + ".tmp", path)
+
+
+class StringColumn(Sequence):
+    """
+    Strings stored as one UTF-8 blob, name.npy, and the offsets of each string in it, name.offsets.npy.
+    Both are memory-mapped read-only when loaded, so the processes serving the same index share their
+    pages instead of each holding its own copy, and a string is only decoded when it is read.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.decode(self.blob[self.offsets[i] : self.offsets[i + 1]].tobytes().decode("utf-8"))
+
+    def __iter__(self) -> Iterator:
+        for i in range(len(self)):
+            yield self[i]
+
+    def decode(self, s: str) -> Any:
+        return s
+
+    @classmethod
+    def encode(cls, value: Any) -> str:
+        return value
+
+    @classmethod
+    def load(cls, path: str, name: str) -> "StringColumn | None":
+        p = os.path.join(path, name)
+        if not os.path.exists(p + ".npy"):
+            return None
+        return cls(np.load(p + ".npy", mmap_mode="r"), np.load(p + ".offsets.npy", mmap_mode="r"))
+
+    @classmethod
+    def save(cls, path: str, name: str, values: Sequence):
+        encoded = [cls.encode(v).encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        p = os.path.join(path, name)
+        save_array(p + ".offsets.npy", offsets)
+        save_array(p + ".npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+class ColumnWriter:
+    """
+    Writes a column of the type column value by value, as column.save would write them all at once, so
+    the values never all have to be in memory: their bytes go to a temporary file, which is copied into
+    name.npy on close; only the offsets, 8 bytes a value, are held.
+    """
+
+    def __init__(self, column: type[StringColumn], path: str, name: str):
+        self.column = column
+        self.path = os.path.join(path, name)
+        self.blob = open(self.path + ".blob.tmp", "wb")  # pylint: disable=consider-using-with
+        self.offsets = [0]
+
+    def append(self, value: Any):
+        b = self.column.encode(value).encode("utf-8")
+        self.blob.write(b)
+        self.offsets.append(self.offsets[-1] + len(b))
+
+    def close(self):
+        self.blob.close()
+        save_array(self.path + ".offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+        # written from the pages of the temporary file, not a copy in memory
+        blob = np.memmap(self.blob.name, dtype=np.uint8, mode="r") if self.offsets[-1] else np.zeros(0, np.uint8)
+        save_array(self.path + ".npy", blob)
+        del blob
+        os.remove(self.blob.name)
+
+
+class JSONColumn(StringColumn):
+    """A StringColumn of JSON values, metadata dicts say."""
+
+    def decode(self, s: str) -> Any:
+        return json.loads(s)
+
+    @classmethod
+    def encode(cls, value: Any) -> str:
+        return json.dumps(value)
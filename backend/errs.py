@@ -45,3 +45,8 @@ class NotFound(BaseError):
 class Conflict(BaseError):
     def __init__(self, detail: str, code: ErrorCode = ErrorCode.NONE):
         super().__init__(409, detail, code)
+
+
+class ServiceUnavailable(BaseError):
+    def __init__(self, detail: str, code: ErrorCode = ErrorCode.NONE):
+        super().__init__(503, detail, code)
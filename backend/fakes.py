@@ -0,0 +1,198 @@
+## Offline Stand-ins ##################################################################################################
+### Local, deterministic replacements for the OpenAI chat models and embeddings and the Tavily search, selected by
+### settings.llm_backend, settings.embedding_backend and settings.web_search_backend. They make the workflow run
+### with no network and no API keys, which is what bench.py measures it with.
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel
+
+WORDS = (
+    "agent memory planning tool reflection prompt chain thought attack model token context retrieval answer "
+    "document question vector search graph loop grade score relevant source task step system user"
+).split()
+
+
+def fraction(text: str, salt: str) -> float:
+    """A number in [0, 1) that only depends on text and salt."""
+    digest = hashlib.sha256(f"{salt}\n{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that answers after latency seconds with text derived from a hash of the prompt, so the
+    same prompt always gets the same answer. Structured outputs are the graders' and router's data
+    models: a share yes_rate of binary scores are 'yes', and a share web_search_rate of questions are
+    routed to web search.
+    """
+
+    model_name: str = "fake"
+    latency: float = 0.05
+    yes_rate: float = 1.0
+    web_search_rate: float = 0.0
+    answer_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def with_structured_output(self, schema: type[BaseModel], **kwargs: Any) -> Runnable:  # pylint: disable=arguments-differ
+        return self.bind(schema=schema) | RunnableLambda(lambda message: schema.model_validate_json(message.content))
+
+    def respond(self, messages: list[BaseMessage], schema: Optional[type[BaseModel]] = None) -> AIMessage:
+        prompt = "\n".join(str(m.content) for m in messages)
+        if schema is None:
+            content = " ".join(
+                WORDS[int(fraction(prompt, str(i)) * len(WORDS))] for i in range(self.answer_words)
+            )
+        else:
+            content = self.structured(prompt, schema).model_dump_json()
+        return AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": len(prompt.split()),
+                "output_tokens": len(content.split()),
+                "total_tokens": len(prompt.split()) + len(content.split()),
+            },
+        )
+
+    def structured(self, prompt: str, schema: type[BaseModel]) -> BaseModel:
+        values = {}
+        for name in schema.model_fields:
+            if name == "datasource":
+                values[name] = "web_search" if fraction(prompt, name) < self.web_search_rate else "vectorstore"
+            elif name == "datasources":
+                # the grouped router is handed questions numbered "Question 1:", "Question 2:", ...
+                count = len(re.findall(r"Question \d+:", prompt))
+                values[name] = [
+                    "web_search" if fraction(prompt, f"{name}{i}") < self.web_search_rate else "vectorstore"
+                    for i in range(count)
+                ]
+            elif name == "queries":
+                # the query expander is told "Number of queries: n"
+                count = int((re.findall(r"Number of queries: (\d+)", prompt) or ["1"])[-1])
+                values[name] = [
+                    " ".join(WORDS[int(fraction(prompt, f"{name}{i}.{j}") * len(WORDS))] for j in range(6))
+                    for i in range(count)
+                ]
+            elif name == "binary_scores":
+                # the batch grader is handed documents numbered "Document 1:", "Document 2:", ...
+                count = len(re.findall(r"Document \d+:", prompt))
+                values[name] = [self.grade(prompt, f"{name}{i}") for i in range(count)]
+            else:
+                values[name] = self.grade(prompt, name)
+        return schema(**values)
+
+    def grade(self, prompt: str, salt: str) -> str:
+        return "yes" if fraction(prompt, salt) < self.yes_rate else "no"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages, kwargs.get("schema")))])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages, kwargs.get("schema")))])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        yield from self.chunks(self.respond(messages, kwargs.get("schema")))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for chunk in self.chunks(self.respond(messages, kwargs.get("schema"))):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def chunks(message: AIMessage) -> Iterator[ChatGenerationChunk]:
+        """The message a word at a time, the last chunk carrying the usage."""
+        words = re.findall(r"\S+\s*", message.content) or [""]
+        for i, word in enumerate(words):
+            usage = message.usage_metadata if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word, usage_metadata=usage))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Bag-of-words feature hashing into dim dimensions, unit length. Deterministic and free, and texts
+    sharing words get similar embeddings, so retrieval, the semantic cache and the local router still
+    behave sensibly.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed(self, text: str) -> list[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+            v[h % self.dim] += 1.0 if h >> 63 else -1.0
+        norm = np.linalg.norm(v)
+        return (v / norm if norm else v).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return self.embed_query(text)
+
+
+def build_fake_web_search(latency: float, k: int = 3) -> Runnable:
+    """Stands in for TavilySearchResults: k results made up from the query, after latency seconds."""
+
+    async def search(input: dict) -> list[dict]:  # pylint: disable=redefined-builtin
+        await asyncio.sleep(latency)
+        query = input["query"]
+        return [
+            {
+                "url": f"https://example.com/{int(fraction(query, str(i)) * 10**9)}",
+                "content": f"Result {i + 1} for {query}: "
+                + " ".join(WORDS[int(fraction(query, f"{i}.{j}") * len(WORDS))] for j in range(30)),
+            }
+            for i in range(k)
+        ]
+
+    return RunnableLambda(search, name="fake_web_search")
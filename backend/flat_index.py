@@ -0,0 +1,298 @@
+## Flat NumPy Vector Store ############################################################################################
+import asyncio
+import json
+import os
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from columns import JSONColumn, StringColumn, save_array
+from quantization import Codec, build_codec, load_codes, save_codes
+
+VECTORS_FILE = "vectors.npy"
+# columns of the rows, see columns.py
+IDS, TEXTS, METADATAS = "ids", "texts", "metadatas"
+# what the rows were persisted as before, still read
+DOCS_FILE = "docs.json"
+
+
+def normalize_rows(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return m / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores of every column of scores, best first; shape (k, columns)."""
+    if scores.shape[0] > k:
+        idx = np.argpartition(-scores, k - 1, axis=0)[:k]
+    else:
+        idx = np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=0), axis=0)
+    return np.take_along_axis(idx, order, axis=0)
+
+
+def query_and_k(args: tuple, kwargs: dict) -> tuple[str, int]:
+    """The query and k of a call passing them as to VectorStore.similarity_search, positionally or by keyword."""
+    return (args[0] if args else kwargs["query"]), (args[1] if len(args) > 1 else kwargs.get("k", 4))
+
+
+class FlatVectorStore(VectorStore):
+    """
+    Exact search over unit-length float32 vectors held in one contiguous matrix, so a query is a single
+    matrix-vector product plus argpartition, and a batch of queries a single matrix product.
+
+    Persisted in a directory as vectors.npy and the ids, texts and metadata of the rows as string
+    columns (see columns.py), all memory-mapped read-only when opened, so worker processes serving the
+    same index share the pages. Adds and deletes happen in memory, on copies, and are written by
+    persist(); build_index is the only writer. Readers load again when they see persist() replaced
+    the vectors.
+
+    With a quantization ("int8" or "pq", see quantization.py) persist() also writes compressed codes of
+    the vectors, memory-mapped as well, which are scanned instead of the matrix; only the best
+    rescore * k candidates of a query are then scored exactly, so of the memory-mapped vectors only
+    those rows are read.
+    """
+
+    def __init__(
+        self, path: str, embedding: Embeddings, quantization: str = "none", rescore: int = 50, pq_subspaces: int = 0
+    ):
+        self.path = path
+        self.embedding = embedding
+        self.codec: Codec | None = build_codec(quantization, pq_subspaces)
+        self.rescore = rescore
+        # codes of the rows, None while they were not persisted for the current rows
+        self.codes: np.ndarray | None = None
+        # lists once written to, read-only columns as loaded
+        self.ids: Sequence[str] = []
+        self.texts: Sequence[str] = []
+        self.metadatas: Sequence[dict] = []
+        self._row_of: dict[str, int] | None = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.loaded_mtime = 0
+        self.refresh()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @property
+    def row_of(self) -> dict[str, int]:
+        # only lookups by id need it, searches do not, so it is built on first use
+        if self._row_of is None:
+            self._row_of = {i: row for row, i in enumerate(self.ids)}
+        return self._row_of
+
+    # Persistence #####################################################################################################
+
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, VECTORS_FILE)
+
+    def refresh(self):
+        """Loads the persisted store if it was replaced since it was last loaded."""
+        try:
+            mtime = os.stat(self.vectors_path()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.loaded_mtime:
+            return
+
+        ids = StringColumn.load(self.path, IDS)
+        if ids is not None:
+            texts, metadatas = StringColumn.load(self.path, TEXTS), JSONColumn.load(self.path, METADATAS)
+        else:
+            with open(os.path.join(self.path, DOCS_FILE), "r", encoding="utf-8") as f:
+                docs = json.load(f)
+            ids, texts, metadatas = docs["ids"], docs["texts"], docs["metadatas"]
+        matrix = np.load(self.vectors_path(), mmap_mode="r")
+        if not len(ids) == len(texts) == len(metadatas) == matrix.shape[0]:
+            # caught between the files of a persist(), the next call loads them all
+            return
+        self.ids, self.texts, self.metadatas = ids, texts, metadatas
+        self._row_of = None
+        self.matrix = matrix
+        self.codes = None
+        if self.codec is not None:
+            codes = load_codes(self.path, self.codec)
+            if codes is not None and len(codes) == len(self.ids):
+                self.codes = codes
+        self.loaded_mtime = mtime
+        self.on_loaded()
+
+    def on_loaded(self):
+        """Called once the rows were loaded; for subclasses keeping structures derived from them."""
+
+    def persist(self):
+        # columns and codes first, and each file by write-then-rename; readers go by the vectors file, written last
+        os.makedirs(self.path, exist_ok=True)
+        if self.codec is not None and self.ids:
+            n = len(self.ids)
+            # like the ivf centroids, trained again once the store grew 4 times
+            if self.codec.trained_n == 0 or n >= 4 * self.codec.trained_n:
+                self.codec.train(self.matrix)
+                self.codec.trained_n = n
+            self.codes = self.codec.encode(self.matrix)
+            save_codes(self.path, self.codec, self.codes)
+
+        StringColumn.save(self.path, IDS, self.ids)
+        StringColumn.save(self.path, TEXTS, self.texts)
+        JSONColumn.save(self.path, METADATAS, self.metadatas)
+
+        save_array(self.vectors_path(), np.ascontiguousarray(self.matrix, dtype=np.float32))
+        self.loaded_mtime = os.stat(self.vectors_path()).st_mtime_ns
+
+    # Writes ##########################################################################################################
+
+    def add_texts(
+        self, texts: Iterable[str], metadatas: list[dict] | None = None, ids: list[str] | None = None, **kwargs: Any
+    ) -> list[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(len(self.ids) + i) for i in range(len(texts))]
+        vectors = normalize_rows(self.embedding.embed_documents(texts))
+        self.add_vectors(ids, texts, metadatas, vectors)
+        return ids
+
+    def add_vectors(self, ids: list[str], texts: list[str], metadatas: list[dict], vectors: np.ndarray):
+        """Adds (or replaces, by id) rows whose unit-length vectors were computed already."""
+        self.delete([i for i in ids if i in self.row_of])
+        if not isinstance(self.ids, list):
+            # the loaded columns are read-only
+            self.ids, self.texts, self.metadatas = list(self.ids), list(self.texts), list(self.metadatas)
+        matrix = np.asarray(self.matrix)
+        self.matrix = vectors if matrix.size == 0 else np.concatenate([matrix, vectors])
+        self.codes = None
+        for i, text, metadata in zip(ids, texts, metadatas):
+            self.row_of[i] = len(self.ids)
+            self.ids.append(i)
+            self.texts.append(text)
+            self.metadatas.append(metadata)
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        rows = {self.row_of[i] for i in ids or [] if i in self.row_of}
+        if not rows:
+            return True
+        keep = np.array([row not in rows for row in range(len(self.ids))], dtype=bool)
+        self.matrix = np.asarray(self.matrix)[keep]
+        self.codes = None
+        self.ids = [i for i, k in zip(self.ids, keep) if k]
+        self.texts = [t for t, k in zip(self.texts, keep) if k]
+        self.metadatas = [m for m, k in zip(self.metadatas, keep) if k]
+        self._row_of = {i: row for row, i in enumerate(self.ids)}
+        return True
+
+    def get(self, ids: Optional[list[str]] = None, include: Optional[list[str]] = None) -> dict[str, list]:
+        """Rows by id (all of them when ids is None), shaped like Chroma.get for build_index."""
+        include = ["documents", "metadatas"] if include is None else include
+        rows = list(range(len(self.ids))) if ids is None else [self.row_of[i] for i in ids if i in self.row_of]
+        r: dict[str, list] = {"ids": [self.ids[row] for row in rows]}
+        if "embeddings" in include:
+            r["embeddings"] = np.asarray(self.matrix[rows]).tolist() if rows else []
+        if "documents" in include:
+            r["documents"] = [self.texts[row] for row in rows]
+        if "metadatas" in include:
+            r["metadatas"] = [self.metadatas[row] for row in rows]
+        return r
+
+    # Search ##########################################################################################################
+
+    def search_rows(self, queries: np.ndarray, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Args:
+            queries (np.ndarray): Unit-length query vectors, shape (queries, dim)
+            k (int): Rows wanted per query
+
+        Returns:
+            list: Per query, the rows of its k nearest vectors, nearest first, and their cosine similarities
+        """
+        if self.codes is not None:
+            approx = self.codec.scores(self.codes, queries)
+            return [self.rank(q, k, approx=approx[:, j]) for j, q in enumerate(queries)]
+        scores = self.matrix @ queries.T
+        idx = top_k(scores, k)
+        return [(idx[:, j], scores[idx[:, j], j]) for j in range(len(queries))]
+
+    def rank(
+        self, query: np.ndarray, k: int, rows: np.ndarray | None = None, approx: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The k nearest of rows (all of them when None) to query, nearest first, and their cosine similarities;
+        through the codes and an exact rescoring of the best rescore * k of them, when there are codes.
+        approx are the scores of rows through the codes, when they were computed already.
+        """
+        if self.codes is not None:
+            if approx is None:
+                approx = self.codec.scores(self.codes if rows is None else self.codes[rows], query[None])[:, 0]
+            # in row order, so the reads from the memory-mapped matrix go forward
+            shortlist = np.sort(top_k(approx[:, None], min(len(approx), self.rescore * k))[:, 0])
+            rows = shortlist if rows is None else rows[shortlist]
+        scores = np.asarray(self.matrix if rows is None else self.matrix[rows]) @ query
+        best = top_k(scores[:, None], min(k, len(scores)))[:, 0]
+        return (best if rows is None else rows[best]), scores[best]
+
+    def search_by_vectors(self, embeddings: list[list[float]], k: int = 4) -> list[list[tuple[Document, float]]]:
+        """Batched search: the k nearest documents and their cosine similarities, for each of embeddings."""
+        self.refresh()
+        if not self.ids or not embeddings:
+            return [[] for _ in embeddings]
+        queries = normalize_rows(embeddings)
+        return [
+            [(self.document(int(row)), float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in self.search_rows(queries, min(k, len(self.ids)))
+        ]
+
+    def document(self, row: int) -> Document:
+        return Document(id=self.ids[row], page_content=self.texts[row], metadata=self.metadatas[row])
+
+    def similarity_search_with_score(self, *args: Any, **kwargs: Any) -> list[tuple[Document, float]]:
+        query, k = query_and_k(args, kwargs)
+        return self.search_by_vectors([self.embedding.embed_query(query)], k)[0]
+
+    async def asimilarity_search_with_score(self, *args: Any, **kwargs: Any) -> list[tuple[Document, float]]:
+        query, k = query_and_k(args, kwargs)
+        embedding = await self.embedding.aembed_query(query)
+        # the matrix product, and with codes the reads of the rescored rows, in a thread, off the event loop
+        return (await asyncio.to_thread(self.search_by_vectors, [embedding], k))[0]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k)]
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.search_by_vectors([embedding], k)[0]]
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding: list[float], k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs: Any
+    ) -> list[Document]:
+        self.refresh()
+        if not self.ids:
+            return []
+        rows, _ = self.search_rows(normalize_rows([embedding]), min(fetch_k, len(self.ids)))[0]
+        picked = maximal_marginal_relevance(np.asarray(embedding), np.asarray(self.matrix[rows]), lambda_mult, k)
+        return [self.document(int(rows[i])) for i in picked]
+
+    def max_marginal_relevance_search(
+        self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5, **kwargs: Any
+    ) -> list[Document]:
+        return self.max_marginal_relevance_search_by_vector(self.embedding.embed_query(query), k, fetch_k, lambda_mult)
+
+    def _select_relevance_score_fn(self):
+        return lambda similarity: similarity
+
+    @classmethod
+    def from_texts(
+        cls, texts: list[str], embedding: Embeddings, metadatas: list[dict] | None = None, **kwargs: Any
+    ) -> "FlatVectorStore":
+        # persisted when given a path
+        store = cls(kwargs.get("path", ""), embedding)
+        store.add_texts(texts, metadatas, kwargs.get("ids"))
+        if store.path:
+            store.persist()
+        return store
@@ -1,13 +1,16 @@
 ## Construct the Graph ################################################################################################
 from pprint import pprint
-from langchain.schema import Document
 
 ### from langchain_cohere import CohereEmbeddings
 
-from typing import List
+from typing import Any, List
 
 from typing_extensions import TypedDict
-from tools import question_router, retriever, rag_chain, hallucination_grader, answer_grader, question_rewriter, web_search_tool, retrieval_grader
+import tools
+from graph_budget import VERDICT_RANKS, budget_exhausted
+from graph_routing import choose_datasource, search_web
+from memo import bypassed
+from packing import pack_context
 
 
 
@@ -20,17 +23,44 @@ class GraphState(TypedDict):
 
     Attributes:
         question: question
+        question_embedding: unit-length embedding of the question as asked, if the semantic cache computed it
         generation: LLM generation
         documents: list of documents
+        context: the documents packed for the last generation, which it is graded against
+        datasource: datasource the question was routed to, when routed speculatively
+        prefetched_question: question that prefetched_documents were fetched for, if any
+        prefetched_documents: documents fetched while the question was being routed
+        scores: reranker score of each of documents, best first, until they are graded
+        started_at: time.monotonic() when the workflow started
+        iterations: times the self-correcting loops went round, re-generating or re-writing the question
+        llm_calls: LLM calls made so far
+        verdict: grade of the last generation, "useful", "not useful", "not supported" or "unchecked"
+        best_generation: best graded generation so far, returned when the budget runs out
+        best_rank: rank of best_generation's verdict, see VERDICT_RANKS
+        degraded: the budget that ran out, "iterations", "llm_calls" or "deadline"; empty if none did. Set as
+            soon as the deadline passes while a node runs, see with_deadline
     """
 
     question: str
+    question_embedding: Any
     generation: str
     documents: List[str]
+    context: str
+    datasource: str
+    prefetched_question: str
+    prefetched_documents: List[str]
+    scores: List[float]
+    started_at: float
+    iterations: int
+    llm_calls: int
+    verdict: str
+    best_generation: str
+    best_rank: int
+    degraded: str
 
 ### Define Graph Flow ##################################################################################################
 
-def retrieve(state):
+async def retrieve(state):
     """
     Retrieve documents
 
@@ -43,12 +73,17 @@ def retrieve(state):
     print("---RETRIEVE---")
     question = state["question"]
 
+    # Retrieved while routing already?
+    if state.get("prefetched_question") == question:
+        print("---RETRIEVE: USE PREFETCHED DOCUMENTS---")
+        return {"documents": state["prefetched_documents"], "question": question, "prefetched_question": ""}
+
     # Retrieval
-    documents = retriever.invoke(question)
+    documents = await tools.retriever.ainvoke(question)
     return {"documents": documents, "question": question}
 
 
-def generate(state):
+async def generate(state):
     """
     Generate answer
 
@@ -62,43 +97,28 @@ def generate(state):
     question = state["question"]
     documents = state["documents"]
 
-    # RAG generation
-    generation = rag_chain.invoke({"context": documents, "question": question})
-    return {"documents": documents, "question": question, "generation": generation}
-
-
-def grade_documents(state):
-    """
-    Determines whether the retrieved documents are relevant to the question.
-
-    Args:
-        state (dict): The current graph state
-
-    Returns:
-        state (dict): Updates documents key with only filtered relevant documents
-    """
-
-    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
-    question = state["question"]
-    documents = state["documents"]
-
-    # Score each doc
-    filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke(
-            {"question": question, "document": d.page_content}
-        )
-        grade = score.binary_score
-        if grade == "yes":
-            print("---GRADE: DOCUMENT RELEVANT---")
-            filtered_docs.append(d)
-        else:
-            print("---GRADE: DOCUMENT NOT RELEVANT---")
-            continue
-    return {"documents": filtered_docs, "question": question}
-
-
-def transform_query(state):
+    # Re-generating an answer that was not supported?
+    iterations = state.get("iterations", 0)
+    retry = state.get("verdict") == "not supported"
+    if retry:
+        iterations += 1
+
+    # RAG generation, from as much of the documents as fits the context budget; a retry is sent the same
+    # prompt, so it must not be answered with the memoized generation that was just rejected
+    context = pack_context(question, documents)
+    with bypassed(retry):
+        generation = await tools.rag_chain.ainvoke({"context": context, "question": question})
+    return {
+        "documents": documents,
+        "context": context,
+        "question": question,
+        "generation": generation,
+        "iterations": iterations,
+        "llm_calls": state.get("llm_calls", 0) + 1,
+    }
+
+
+async def transform_query(state):
     """
     Transform the query to produce a better question.
 
@@ -114,11 +134,16 @@ def transform_query(state):
     documents = state["documents"]
 
     # Re-write question
-    better_question = question_rewriter.invoke({"question": question})
-    return {"documents": documents, "question": better_question}
+    better_question = await tools.question_rewriter.ainvoke({"question": question})
+    return {
+        "documents": documents,
+        "question": better_question,
+        "iterations": state.get("iterations", 0) + 1,
+        "llm_calls": state.get("llm_calls", 0) + 1,
+    }
 
 
-def web_search(state):
+async def web_search(state):
     """
     Web search based on the re-phrased question.
 
@@ -132,18 +157,17 @@ def web_search(state):
     print("---WEB SEARCH---")
     question = state["question"]
 
-    # Web search
-    docs = web_search_tool.invoke({"query": question})
-    web_results = "\n".join([d["content"] for d in docs])
-    web_results = Document(page_content=web_results)
-
-    return {"documents": web_results, "question": question}
+    # Searched while routing already?
+    if state.get("prefetched_question") == question:
+        print("---WEB SEARCH: USE PREFETCHED RESULTS---")
+        return {"documents": state["prefetched_documents"], "question": question, "prefetched_question": ""}
 
-
-### Edges ###
+    # Web search
+    web_results, llm_calls = await search_web(question)
+    return {"documents": web_results, "question": question, "llm_calls": state.get("llm_calls", 0) + llm_calls}
 
 
-def route_question(state):
+async def route_question(state):
     """
     Route question to web search or RAG.
 
@@ -151,18 +175,16 @@ def route_question(state):
         state (dict): The current graph state
 
     Returns:
-        str: Next node to call
+        state (dict): New key added to state, datasource, the next node to call
     """
 
     print("---ROUTE QUESTION---")
     question = state["question"]
-    source = question_router.invoke({"question": question})
-    if source.datasource == "web_search":
-        print("---ROUTE QUESTION TO WEB SEARCH---")
-        return "web_search"
-    elif source.datasource == "vectorstore":
-        print("---ROUTE QUESTION TO RAG---")
-        return "vectorstore"
+    datasource, llm_calls = await choose_datasource(question, state.get("question_embedding"))
+    return {"datasource": datasource, "llm_calls": state.get("llm_calls", 0) + llm_calls}
+
+
+### Edges ###
 
 
 def decide_to_generate(state):
@@ -177,9 +199,17 @@ def decide_to_generate(state):
     """
 
     print("---ASSESS GRADED DOCUMENTS---")
-    state["question"]
     filtered_documents = state["documents"]
 
+    if state.get("degraded"):
+        print("---DECISION: DEADLINE PASSED, GIVE UP---")
+        return "give_up"
+
+    # Out of budget: stop, unless there is nothing to return yet and documents to generate from
+    if budget_exhausted(state) and (state.get("best_generation") or not filtered_documents):
+        print("---DECISION: BUDGET EXHAUSTED, GIVE UP---")
+        return "give_up"
+
     if not filtered_documents:
         # All documents have been filtered check_relevance
         # We will re-generate a new query
@@ -193,40 +223,63 @@ def decide_to_generate(state):
         return "generate"
 
 
-def grade_generation_v_documents_and_question(state):
+async def grade_generation_v_documents_and_question(state):
     """
-    Determines whether the generation is grounded in the document and answers question.
+    Determines whether the generation is grounded in the context it was made from and answers question. Left unchecked
+    when the budget has run out already.
 
     Args:
         state (dict): The current graph state
 
     Returns:
-        str: Decision for next node to call
+        state (dict): New key added to state, verdict, and the best generation so far updated
     """
 
-    print("---CHECK HALLUCINATIONS---")
     question = state["question"]
-    documents = state["documents"]
+    context = state["context"]
     generation = state["generation"]
+    llm_calls = state.get("llm_calls", 0)
 
-    score = hallucination_grader.invoke(
-        {"documents": documents, "generation": generation}
-    )
+    if budget_exhausted(state):
+        print("---BUDGET EXHAUSTED, GENERATION NOT CHECKED---")
+        return unchecked(state)
+
+    print("---CHECK HALLUCINATIONS---")
+    # a re-generated answer is graded afresh, even if it came out the same as the rejected one
+    with bypassed(state.get("verdict") == "not supported"):
+        score = await tools.hallucination_grader.ainvoke(
+            {"documents": context, "generation": generation}
+        )
     grade = score.binary_score
+    llm_calls += 1
 
     # Check hallucination
     if grade == "yes":
         print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
         # Check question-answering
         print("---GRADE GENERATION vs QUESTION---")
-        score = answer_grader.invoke({"question": question, "generation": generation})
+        score = await tools.answer_grader.ainvoke({"question": question, "generation": generation})
         grade = score.binary_score
+        llm_calls += 1
         if grade == "yes":
             print("---DECISION: GENERATION ADDRESSES QUESTION---")
-            return "useful"
+            verdict = "useful"
         else:
             print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
-            return "not useful"
+            verdict = "not useful"
     else:
         pprint("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
-        return "not supported"
\ No newline at end of file
+        verdict = "not supported"
+
+    r = {"verdict": verdict, "llm_calls": llm_calls}
+    if VERDICT_RANKS[verdict] >= state.get("best_rank", -1):
+        r.update(best_generation=generation, best_rank=VERDICT_RANKS[verdict])
+    return r
+
+
+def unchecked(state):
+    """The generation left ungraded, once the budget has run out: still better than nothing."""
+    r = {"verdict": "unchecked"}
+    if VERDICT_RANKS["unchecked"] >= state.get("best_rank", -1):
+        r.update(best_generation=state["generation"], best_rank=VERDICT_RANKS["unchecked"])
+    return r
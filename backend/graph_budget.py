@@ -0,0 +1,119 @@
+## Question Budget ###################################################################################################
+import asyncio
+import functools
+import time
+
+from metrics import degraded_total
+from settings import settings
+
+# Returned when the budget runs out before anything was generated
+FALLBACK_ANSWER = "Sorry, I don't know the answer to that question."
+
+# How good a generation is by its verdict; "unchecked" ones were not graded, the budget having run out
+VERDICT_RANKS = {"useful": 3, "not useful": 2, "unchecked": 1, "not supported": 0}
+
+
+def budget_exhausted(state):
+    """
+    Checks the per-question budget, see settings.budget_*.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        str: The budget that ran out, "iterations", "llm_calls" or "deadline"; empty if none did
+    """
+    if state.get("iterations", 0) >= settings.budget_max_iterations:
+        return "iterations"
+    if state.get("llm_calls", 0) >= settings.budget_max_llm_calls:
+        return "llm_calls"
+    if time.monotonic() - state.get("started_at", time.monotonic()) >= settings.budget_deadline:
+        return "deadline"
+    return ""
+
+
+def remaining_seconds(state) -> float:
+    """Seconds left until the deadline of the question, see settings.budget_deadline."""
+    return settings.budget_deadline - (time.monotonic() - state.get("started_at", time.monotonic()))
+
+
+def cut_short(state):  # pylint: disable=unused-argument
+    return {"degraded": "deadline"}
+
+
+def with_deadline(node, on_deadline=cut_short):
+    """
+    node, cancelled when the deadline of the question passes while it runs, rather than only checked
+    for between nodes. Its update is then on_deadline's; by default the question is marked as degraded,
+    the nodes after it do nothing and the next decision gives up. Once degraded, node is not run.
+    """
+
+    @functools.wraps(node)
+    async def run(state):
+        if state.get("degraded"):
+            return {}
+        remaining = remaining_seconds(state)
+        if remaining <= 0:
+            return on_deadline(state)
+        timeout = asyncio.timeout(remaining)
+        try:
+            async with timeout:
+                return await node(state)
+        except TimeoutError:
+            if not timeout.expired():
+                raise
+            print(f"---DEADLINE PASSED IN {node.__name__.upper()}---")
+            return on_deadline(state)
+
+    return run
+
+
+def start(state):
+    """
+    Starts the budget of the question
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Budget keys reset, started_at set to now
+    """
+    return {"started_at": time.monotonic(), "iterations": 0, "llm_calls": 0, "best_rank": -1, "degraded": ""}
+
+
+def decide_after_grading(state):
+    """
+    Follows the verdict on the generation, unless the budget has run out.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        str: Decision for next node to call
+    """
+
+    if state.get("degraded"):
+        print("---DECISION: DEADLINE PASSED, GIVE UP---")
+        return "give_up"
+    verdict = state["verdict"]
+    if verdict != "useful" and budget_exhausted(state):
+        print("---DECISION: BUDGET EXHAUSTED, GIVE UP---")
+        return "give_up"
+    return verdict
+
+
+def give_up(state):
+    """
+    Ends the workflow once the budget has run out, with the best generation so far.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Updates generation key with the best generation, and sets degraded
+    """
+
+    reason = state.get("degraded") or budget_exhausted(state)
+    print(f"---GIVE UP: {reason.upper()} BUDGET EXHAUSTED---")
+    degraded_total.inc(reason=reason)
+    return {"generation": state.get("best_generation") or FALLBACK_ANSWER, "degraded": reason}
@@ -0,0 +1,104 @@
+## Document Reranking and Grading ####################################################################################
+import tools
+from batching import counted_calls, grouping
+from metrics import rerank_decisions_total
+from settings import settings
+
+
+async def rerank(state):
+    """
+    Scores the retrieved documents with the local reranker, orders them best first and drops the
+    ones scoring below settings.rerank_reject.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Updates documents key with the ranked documents, and adds their scores
+    """
+
+    print("---RERANK---")
+    question = state["question"]
+    documents = state["documents"]
+
+    scores = await tools.reranker.ascore(question, documents)
+    ranked = sorted(zip(scores, documents), key=lambda r: r[0], reverse=True)
+    kept = [(score, d) for score, d in ranked if score >= settings.rerank_reject]
+    rerank_decisions_total.inc(len(documents) - len(kept), decision="reject")
+    return {"documents": [d for _, d in kept], "question": question, "scores": [score for score, _ in kept]}
+
+
+async def grade_documents(state):
+    """
+    Determines whether the retrieved documents are relevant to the question. Documents the reranker
+    scored at least settings.rerank_accept are taken as relevant without asking the LLM.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): Updates documents key with only filtered relevant documents
+    """
+
+    print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
+    question = state["question"]
+    documents = state["documents"]
+
+    # Accepted by the reranker already?
+    accepted = [False] * len(documents)
+    rerank_scores = state.get("scores")
+    if rerank_scores is not None and len(rerank_scores) == len(documents):
+        accepted = [score >= settings.rerank_accept for score in rerank_scores]
+        rerank_decisions_total.inc(sum(accepted), decision="accept")
+        rerank_decisions_total.inc(len(documents) - sum(accepted), decision="borderline")
+    borderline = [d for d, a in zip(documents, accepted) if not a]
+
+    # Score the docs
+    grades = None
+    llm_calls = state.get("llm_calls", 0)
+    if settings.grade_mode == "single_call" and borderline:
+        grades = await grade_documents_in_one_call(question, borderline)
+        llm_calls += 1
+    if grades is None:
+        with counted_calls() as count:
+            scores = await tools.retrieval_grader.abatch(
+                [{"question": question, "document": d.page_content} for d in borderline],
+                config={"max_concurrency": settings.grade_concurrency},
+            )
+        grades = [score.binary_score for score in scores]
+        # within a batch the documents are graded in calls shared with other questions, see batching.py
+        llm_calls += count.calls if grouping.get() else len(borderline)
+
+    # merge the LLM grades back in, keeping the order
+    borderline_grades = iter(grades)
+    grades = ["yes" if a else next(borderline_grades) for a in accepted]
+
+    filtered_docs = []
+    for d, grade in zip(documents, grades):
+        if grade == "yes":
+            print("---GRADE: DOCUMENT RELEVANT---")
+            filtered_docs.append(d)
+        else:
+            print("---GRADE: DOCUMENT NOT RELEVANT---")
+            continue
+    return {"documents": filtered_docs, "question": question, "llm_calls": llm_calls, "scores": None}
+
+
+async def grade_documents_in_one_call(question, documents):
+    """
+    Grades all documents with a single structured-output call.
+
+    Args:
+        question (str): The user question
+        documents (list): The retrieved documents
+
+    Returns:
+        list: One 'yes' / 'no' grade per document, or None if the grader did not return one per document
+    """
+    numbered = "\n\n".join(f"Document {i + 1}:\n{d.page_content}" for i, d in enumerate(documents))
+    score = await tools.batch_retrieval_grader.ainvoke({"question": question, "documents": numbered})
+    grades = [grade.strip().lower() for grade in score.binary_scores]
+    if len(grades) != len(documents):
+        print("---GRADE: SINGLE CALL GRADING RETURNED WRONG NUMBER OF SCORES, GRADE ONE BY ONE---")
+        return None
+    return grades
@@ -0,0 +1,131 @@
+## Speculative Routing ###############################################################################################
+import asyncio
+
+import tools
+from batching import counted_calls, grouping
+from metrics import route_decisions_total
+from semantic_cache import normalize_question
+from settings import settings
+from web_search import merge_results, to_documents
+
+
+async def choose_datasource(question, embedding=None):
+    """
+    Args:
+        question (str): The question
+        embedding (np.ndarray): Its embedding, if the semantic cache computed it already
+
+    Returns:
+        tuple: The datasource, "web_search" or "vectorstore", and the number of LLM calls made to choose it
+    """
+    if tools.local_router is not None:
+        datasource = await tools.local_router.route(question, embedding)
+        if datasource is not None:
+            print(f"---ROUTE QUESTION LOCALLY TO {datasource.upper()}---")
+            route_decisions_total.inc(router="local", datasource=datasource)
+            return datasource, 0
+
+    with counted_calls() as count:
+        source = await tools.question_router.ainvoke({"question": question})
+    # within a batch the question is routed in a call shared with other questions, see batching.py
+    llm_calls = count.calls if grouping.get() else 1
+    if source.datasource == "vectorstore":
+        print("---ROUTE QUESTION TO RAG---")
+        route_decisions_total.inc(router="llm", datasource="vectorstore")
+        return "vectorstore", llm_calls
+    # the router's "web_search", and anything else it might answer: the web can take any question
+    print("---ROUTE QUESTION TO WEB SEARCH---")
+    route_decisions_total.inc(router="llm", datasource="web_search")
+    return "web_search", llm_calls
+
+
+async def speculative_route(state):
+    """
+    Routes the question while speculatively running vector retrieval (and, if enabled, the web search)
+    at the same time; the branch that was not chosen is cancelled and thrown away.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New keys added to state: datasource, plus the prefetched documents of the chosen branch
+    """
+
+    print("---ROUTE QUESTION SPECULATIVELY---")
+    question = state["question"]
+
+    branches = {"vectorstore": asyncio.ensure_future(tools.retriever.ainvoke(question))}
+    if settings.speculative_web_search:
+        branches["web_search"] = asyncio.ensure_future(search_web(question))
+
+    try:
+        datasource, llm_calls = await choose_datasource(question, state.get("question_embedding"))
+        llm_calls += state.get("llm_calls", 0)
+        for name, task in branches.items():
+            if name != datasource:
+                task.cancel()
+
+        if datasource not in branches:
+            return {"datasource": datasource, "question": question, "llm_calls": llm_calls}
+        documents = await branches[datasource]
+        if datasource == "web_search":
+            documents, calls = documents
+            llm_calls += calls
+        return {
+            "datasource": datasource,
+            "question": question,
+            "prefetched_question": question,
+            "prefetched_documents": documents,
+            "llm_calls": llm_calls,
+        }
+    except BaseException:
+        for task in branches.values():
+            task.cancel()
+        raise
+
+
+def decide_route(state):
+    """
+    Follows the routing decision speculative_route or route_question made, unless the deadline passed.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        str: Next node to call
+    """
+
+    if state.get("degraded"):
+        print("---DECISION: DEADLINE PASSED, GIVE UP---")
+        return "give_up"
+    return state["datasource"]
+
+
+async def search_web(question):
+    """
+    Searches the web for the question, and with settings.web_search_queries > 1 for rewrites of it as
+    well, all at once, and merges the results.
+
+    Returns:
+        tuple: The results, a document each, and the number of LLM calls made to rewrite the question
+    """
+    searches = [asyncio.ensure_future(tools.web_search_tool.ainvoke({"query": question}))]
+    llm_calls = 0
+    try:
+        if settings.web_search_queries > 1:
+            # searching for the question already while it is rewritten
+            n = settings.web_search_queries - 1
+            expanded = await tools.query_expander.ainvoke({"question": question, "n": n})
+            llm_calls += 1
+            queries = {normalize_question(question)}
+            for query in expanded.queries[:n]:
+                if normalize_question(query) not in queries:
+                    queries.add(normalize_question(query))
+                    searches.append(asyncio.ensure_future(tools.web_search_tool.ainvoke({"query": query})))
+        results = await asyncio.gather(*searches)
+    except BaseException:
+        for search in searches:
+            search.cancel()
+        raise
+    merged = merge_results(results, settings.web_search_max_documents)
+    return to_documents(merged, settings.web_search_max_chars), llm_calls
@@ -0,0 +1,116 @@
+## Grouped and Batch Chains ##########################################################################################
+### Chains answering several inputs in a single call: the routing and grading of the questions of a group
+### (see batching.py), and the grading of all documents retrieved for a question (see settings.grade_mode).
+from typing import Literal
+
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+
+from llms import build_llm
+from memo import memoize
+
+
+# Data model
+class RouteQueries(BaseModel):
+    """Route each of a numbered list of user queries to the most relevant datasource."""
+
+    datasources: list[Literal["vectorstore", "web_search"]] = Field(
+        description="One per question, in the order given: route it to web search or a vectorstore.",
+    )
+
+
+def build_batch_question_router():
+    """Routes the questions of a group in a single call, see batching.py."""
+    # LLM with function call
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_router = memoize(
+        llm.with_structured_output(RouteQueries), "batch_question_router", llm.model_name
+    )
+
+    # Prompt
+    system = """You are an expert at routing each of a numbered list of user questions to a vectorstore or web search.
+    The vectorstore contains documents related to agents, prompt engineering, and adversarial attacks.
+    Use the vectorstore for questions on these topics. Otherwise, use web-search.
+    Give one datasource for every question, in the same order as the questions are numbered."""
+    route_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "{questions}"),
+        ]
+    )
+
+    return route_prompt | structured_llm_router
+
+
+def pack_questions(inputs: list[dict]) -> dict:
+    return {"questions": "\n\n".join(f"Question {i + 1}: {input['question']}" for i, input in enumerate(inputs))}
+
+
+# Data model
+class GradeDocumentsBatch(BaseModel):
+    """Binary scores for relevance check on a numbered list of retrieved documents."""
+
+    binary_scores: list[str] = Field(
+        description=(
+            "One score per document, in the order given: 'yes' if the document is relevant to the question, else 'no'"
+        )
+    )
+
+
+def build_batch_retrieval_grader():
+    """Grades all retrieved documents in a single call, see settings.grade_mode."""
+    # LLM with function call
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_grader = memoize(
+        llm.with_structured_output(GradeDocumentsBatch), "batch_retrieval_grader", llm.model_name
+    )
+
+    # Prompt
+    system = """You are a grader assessing relevance of each of a numbered list of retrieved documents
+        to a user question. \n
+        If a document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+        It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
+        Give a binary score 'yes' or 'no' for every document, in the same order as the documents are numbered."""
+    grade_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "Retrieved documents: \n\n {documents} \n\n User question: {question}"),
+        ]
+    )
+
+    batch_retrieval_grader = grade_prompt | structured_llm_grader
+
+    return batch_retrieval_grader
+
+
+def build_grouped_retrieval_grader():
+    """Grades the question / document pairs of a group in a single call, see batching.py."""
+    # LLM with function call
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_grader = memoize(
+        llm.with_structured_output(GradeDocumentsBatch), "grouped_retrieval_grader", llm.model_name
+    )
+
+    # Prompt
+    system = """You are a grader assessing relevance of retrieved documents to user questions. \n
+        You are given a numbered list of documents, each with the question it was retrieved for. \n
+        If a document contains keyword(s) or semantic meaning related to its question, grade it as relevant. \n
+        It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
+        Give a binary score 'yes' or 'no' for every document, in the same order as the documents are numbered."""
+    grade_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "{pairs}"),
+        ]
+    )
+
+    return grade_prompt | structured_llm_grader
+
+
+def pack_documents(inputs: list[dict]) -> dict:
+    return {
+        "pairs": "\n\n".join(
+            f"Document {i + 1}:\n{input['document']}\nUser question: {input['question']}"
+            for i, input in enumerate(inputs)
+        )
+    }
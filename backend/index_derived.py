@@ -0,0 +1,40 @@
+## Keyword Index ######################################################################################################
+### Derived from the chunks of every build, next to its vectors: the BM25 keyword index, for hybrid retrieval.
+import os
+from typing import Iterator
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from bm25 import BM25Index
+from index_manifest import SourceEntry
+
+BM25_DIR = "bm25"
+
+
+def unit_vector(embedding: list[float]) -> np.ndarray:
+    v = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+def stored_documents(vectorstore: VectorStore, ids: list[str], batch_size: int) -> Iterator[list[Document]]:
+    """The chunks of ids, with their ids, read back from vectorstore batch_size at a time, in the order of ids."""
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start : start + batch_size]
+        r = vectorstore.get(ids=batch, include=["documents", "metadatas"])
+        found = {i: (text, metadata) for i, text, metadata in zip(r["ids"], r["documents"], r["metadatas"])}
+        yield [
+            Document(id=i, page_content=found[i][0], metadata=found[i][1] or {}) for i in batch if i in found
+        ]
+
+
+def update_bm25(new_dir: str, vectorstore: VectorStore, sources: dict[str, SourceEntry], batch_size: int):
+    """
+    Rebuilds the keyword index over the chunks of sources, for hybrid retrieval (see retrieval.py). The
+    texts are streamed from vectorstore, which has every chunk of the build by now, batch_size at a time
+    and straight into the index files, so the texts of the corpus are never all in memory.
+    """
+    ids = [i for entry in sources.values() for i in entry.chunk_ids]
+    BM25Index.write(os.path.join(new_dir, BM25_DIR), stored_documents(vectorstore, ids, batch_size))
@@ -0,0 +1,141 @@
+## Index Manifest ####################################################################################################
+import hashlib
+import os
+import shutil
+from typing import Callable
+
+from pydantic import BaseModel
+
+from log import get_logger
+from settings import settings
+
+MANIFEST_FILE = "manifest.json"
+# every build writes its files into a directory of its own under here, named by its version
+BUILDS_DIR = "builds"
+
+logger = get_logger("index")
+
+
+class SourceEntry(BaseModel):
+    """
+    What was indexed for one source: the hash of its content and the ids of its chunks. Chunk ids are
+    derived from the chunk text, so an unchanged chunk keeps its id across builds.
+    """
+
+    content_hash: str
+    chunk_ids: list[str]
+
+
+class IndexManifest(BaseModel):
+    """
+    Describes a built index. Sources are keyed by URL; a source whose content hash did not change
+    is left as it is by the next build.
+    """
+
+    collection: str
+    embedding_model: str
+    vector_backend: str = "chroma"
+    built_at: str
+    # changes with every build, so whatever was derived from an older build can tell it is stale
+    version: str = ""
+    # the build directory under builds/ with the files of this build; "" for an index published before
+    # builds had directories of their own, with its files in index_dir itself
+    build: str = ""
+    sources: dict[str, SourceEntry] = {}
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def manifest_path(index_dir: str) -> str:
+    return os.path.join(index_dir, MANIFEST_FILE)
+
+
+def build_dir(index_dir: str, build: str) -> str:
+    return os.path.join(index_dir, BUILDS_DIR, build) if build else index_dir
+
+
+def published_dir(index_dir: str) -> str:
+    """The directory with the files of the build currently published in index_dir."""
+    manifest = load_manifest(index_dir)
+    return build_dir(index_dir, manifest.build if manifest is not None else "")
+
+
+def load_manifest(index_dir: str) -> IndexManifest | None:
+    p = manifest_path(index_dir)
+    if not os.path.exists(p):
+        return None
+    with open(p, "r", encoding="utf-8") as f:
+        return IndexManifest.model_validate_json(f.read())
+
+
+def save_manifest(index_dir: str, manifest: IndexManifest):
+    # write-then-rename, so a reader never sees a half written manifest
+    p = manifest_path(index_dir)
+    tmp = p + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(manifest.model_dump_json(indent=2))
+    os.replace(tmp, p)
+
+
+# called with the new manifest whenever this process (re)built the index, or noticed another one did
+_index_listeners: list[Callable[[IndexManifest], None]] = []
+# index_dir -> (manifest mtime, manifest version)
+_index_versions: dict[str, tuple[int, str]] = {}
+
+
+def add_index_listener(listener: Callable[[IndexManifest], None]):
+    _index_listeners.append(listener)
+
+
+def notify_index_listeners(manifest: IndexManifest):
+    for listener in _index_listeners:
+        listener(manifest)
+
+
+def index_version(index_dir: str | None = None) -> str:
+    """
+    Version of the index currently published in index_dir; cheap enough to call per request, the
+    manifest is only read again when its mtime changed. When it changed, the index listeners are
+    notified, so a build published by another process (build_index.py) is noticed too.
+    """
+    index_dir = index_dir or settings.index_dir
+    p = manifest_path(index_dir)
+    try:
+        mtime = os.stat(p).st_mtime_ns
+    except FileNotFoundError:
+        return ""
+
+    known = _index_versions.get(index_dir)
+    if known is not None and known[0] == mtime:
+        return known[1]
+
+    manifest = load_manifest(index_dir)
+    _index_versions[index_dir] = (mtime, manifest.version)
+    if known is not None and known[1] != manifest.version:
+        notify_index_listeners(manifest)
+    return manifest.version
+
+
+def publish(index_dir: str, manifest: IndexManifest):
+    """
+    Publishes the build manifest describes, by replacing the manifest in index_dir, and notifies the
+    index listeners of this process; other processes notice through index_version().
+    """
+    save_manifest(index_dir, manifest)
+    _index_versions[index_dir] = (os.stat(manifest_path(index_dir)).st_mtime_ns, manifest.version)
+    notify_index_listeners(manifest)
+
+
+def remove_old_builds(index_dir: str, recent: list[str]):
+    """
+    Removes the build directories but the settings.index_keep_builds most recent ones, recent first.
+    Processes still reading a removed build keep its memory-mapped files until they switch.
+    """
+    keep = set(recent[: max(1, settings.index_keep_builds)])
+    builds = os.path.join(index_dir, BUILDS_DIR)
+    for build in os.listdir(builds) if os.path.isdir(builds) else []:
+        if build not in keep:
+            shutil.rmtree(os.path.join(builds, build), ignore_errors=True)
+            logger.info("Removed build %s", build)
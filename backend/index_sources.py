@@ -0,0 +1,107 @@
+## Index Sources #####################################################################################################
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterator
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from index_manifest import content_hash
+from log import get_logger
+from settings import settings
+
+# files picked up when a local directory is given as a source
+LOCAL_SUFFIXES = {".txt", ".md", ".html", ".htm"}
+
+logger = get_logger("index")
+
+
+def chunk_ids_of(source: str, chunks: list[Document]) -> list[str]:
+    ids = []
+    seen: dict[str, int] = {}
+    for chunk in chunks:
+        # the occurrence number keeps repeated chunks of the same source apart
+        key = content_hash(chunk.page_content)
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        ids.append(content_hash(f"{source}\n{key}\n{n}")[:32])
+    return ids
+
+
+def build_text_splitter() -> RecursiveCharacterTextSplitter:
+    if settings.embedding_backend == "hash":
+        # offline: about 4 characters per token
+        return RecursiveCharacterTextSplitter(
+            chunk_size=settings.index_chunk_size * 4, chunk_overlap=settings.index_chunk_overlap * 4
+        )
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=settings.index_chunk_size, chunk_overlap=settings.index_chunk_overlap
+    )
+
+
+def is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def expand_sources(sources: list[str]) -> list[str]:
+    """
+    Replace every local directory in sources with the files under it, so each file is indexed
+    (and hashed) as a source of its own.
+    """
+    r = []
+    for source in sources:
+        if is_url(source) or not os.path.isdir(source):
+            r.append(source)
+            continue
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in LOCAL_SUFFIXES:
+                    r.append(os.path.join(root, name))
+    return r
+
+
+def load_source(source: str) -> list[Document]:
+    # imported here, as only building the index needs them
+    from langchain_community.document_loaders import (  # pylint: disable=import-outside-toplevel
+        BSHTMLLoader,
+        TextLoader,
+        WebBaseLoader,
+    )
+
+    if is_url(source):
+        return WebBaseLoader(source).load()
+    if source.lower().endswith((".html", ".htm")):
+        return BSHTMLLoader(source, bs_kwargs={"features": "html.parser"}).load()
+    return TextLoader(source, autodetect_encoding=True).load()
+
+
+def fetch_sources(sources: list[str], concurrency: int) -> Iterator[tuple[str, list[Document] | None]]:
+    """
+    Load sources on a bounded worker pool and yield (source, docs) as each one completes; docs is None
+    when loading failed. A new fetch is only started when a finished one was handed out, so no more
+    than `concurrency` documents are ever held here.
+    """
+    pending_sources = iter(sources)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight: dict[Future, str] = {}
+
+        def submit_next():
+            source = next(pending_sources, None)
+            if source is not None:
+                in_flight[pool.submit(load_source, source)] = source
+
+        for _ in range(concurrency):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for f in done:
+                source = in_flight.pop(f)
+                submit_next()
+                try:
+                    docs = f.result()
+                except Exception as ex:  # pylint: disable=broad-exception-caught
+                    logger.error("Failed to load %s: %s", source, ex)
+                    docs = None
+                yield source, docs
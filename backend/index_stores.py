@@ -0,0 +1,160 @@
+## Index Vector Stores ###############################################################################################
+import os
+import shutil
+from queue import Empty, Full, Queue
+from threading import Thread
+
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from clients import async_http_client, http_client
+from fakes import HashingEmbeddings
+from flat_index import FlatVectorStore
+from index_manifest import build_dir
+from ivf_index import IVFVectorStore
+from settings import settings
+
+CHROMA_DIR = "chroma"
+FLAT_DIR = "flat"
+IVF_DIR = "ivf"
+
+
+def build_embeddings() -> Embeddings:
+    if settings.embedding_backend == "hash":
+        return HashingEmbeddings(settings.fake_embedding_dim)
+    from langchain_openai import OpenAIEmbeddings  # pylint: disable=import-outside-toplevel
+
+    return OpenAIEmbeddings(
+        model=settings.embedding_model, http_client=http_client, http_async_client=async_http_client
+    )
+
+
+def embedding_namespace() -> str:
+    """What embeddings are cached under: the backend and the model, or for hash the dimension, making them."""
+    if settings.embedding_backend == "hash":
+        return f"hash-{settings.fake_embedding_dim}"
+    return f"{settings.embedding_backend}-{settings.embedding_model}"
+
+
+def build_cached_embeddings() -> Embeddings:
+    """
+    Document embeddings cached on local disk, keyed by embedding_namespace() plus a hash of the chunk
+    text, so re-indexing never pays twice for the same chunk.
+    """
+    return CacheBackedEmbeddings.from_bytes_store(
+        build_embeddings(),
+        LocalFileStore(settings.embedding_cache_dir),
+        namespace=embedding_namespace(),
+    )
+
+
+def open_vectorstore(index_dir: str, embeddings: Embeddings | None = None, build: str = "") -> VectorStore:
+    """
+    The vector store of the given build of the index, of the kind settings.vector_backend selects.
+    """
+    quantization = {
+        "quantization": settings.vector_quantization,
+        "rescore": settings.quantization_rescore,
+        "pq_subspaces": settings.pq_subspaces,
+    }
+    if settings.vector_backend == "flat":
+        return FlatVectorStore(
+            os.path.join(build_dir(index_dir, build), FLAT_DIR), embeddings or build_embeddings(), **quantization
+        )
+    if settings.vector_backend == "ivf":
+        return IVFVectorStore(
+            os.path.join(build_dir(index_dir, build), IVF_DIR),
+            embeddings or build_embeddings(),
+            nlist=settings.ivf_nlist,
+            nprobe=settings.ivf_nprobe,
+            iterations=settings.ivf_train_iterations,
+            **quantization,
+        )
+    # imported here, as it takes a while and the other backends do without
+    from langchain_community.vectorstores import Chroma  # pylint: disable=import-outside-toplevel
+
+    return Chroma(
+        collection_name=settings.index_collection,
+        embedding_function=embeddings or build_embeddings(),
+        persist_directory=os.path.join(build_dir(index_dir, build), CHROMA_DIR),
+    )
+
+
+def copy_chroma(old_dir: str, new_dir: str):
+    """Copies the Chroma collection of the build in old_dir, if it has one, into new_dir."""
+    old = os.path.join(old_dir, CHROMA_DIR)
+    if os.path.isdir(old):
+        shutil.copytree(old, os.path.join(new_dir, CHROMA_DIR))
+
+
+class BatchWriter:
+    """
+    Embeds and inserts chunks into the vectorstore in fixed-size batches on a background thread.
+    The queue in front of it is bounded, so a producer that outruns the embedding API blocks
+    instead of piling up chunks in memory.
+    """
+
+    def __init__(self, vectorstore: VectorStore, batch_size: int, max_pending_batches: int):
+        self.vectorstore = vectorstore
+        self.batch_size = batch_size
+        self.queue: Queue = Queue(maxsize=max_pending_batches)
+        self.error: Exception | None = None
+        self._ids: list[str] = []
+        self._docs: list[Document] = []
+        self._thread = Thread(target=self._run, name="index-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, ids: list[str], docs: list[Document]):
+        self._ids.extend(ids)
+        self._docs.extend(docs)
+        while len(self._ids) >= self.batch_size:
+            self._put(("add", self._ids[: self.batch_size], self._docs[: self.batch_size]))
+            self._ids = self._ids[self.batch_size :]
+            self._docs = self._docs[self.batch_size :]
+
+    def delete(self, ids: list[str]):
+        if ids:
+            self._put(("delete", ids, None))
+
+    def close(self):
+        if self._ids:
+            self._put(("add", self._ids, self._docs))
+            self._ids, self._docs = [], []
+        self._put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining, so the producer notices the error instead of blocking on a full queue
+                continue
+
+            op, ids, docs = item
+            try:
+                if op == "add":
+                    self.vectorstore.add_documents(docs, ids=ids)
+                else:
+                    self.vectorstore.delete(ids=ids)
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                self.error = ex
@@ -0,0 +1,258 @@
+## Persistent Index ###################################################################################################
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from langchain_core.documents import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from langchain.text_splitter import TextSplitter
+from pydantic import ConfigDict, PrivateAttr
+
+from flat_index import FlatVectorStore
+from index_derived import BM25_DIR, update_bm25
+from index_manifest import (
+    IndexManifest,
+    SourceEntry,
+    build_dir,
+    content_hash,
+    index_version,
+    load_manifest,
+    publish,
+    remove_old_builds,
+)
+from index_sources import build_text_splitter, chunk_ids_of, expand_sources, fetch_sources
+from index_stores import BatchWriter, build_cached_embeddings, copy_chroma, open_vectorstore
+from log import get_logger
+from misc import format_datetime
+from retrieval import HybridRetriever
+from settings import settings
+
+logger = get_logger("index")
+
+
+def build_index(index_dir: str | None = None, sources: list[str] | None = None) -> IndexManifest:
+    """
+    Build or refresh the persistent index incrementally. Only sources that are new or whose content
+    changed get split again, and of their chunks only the ones that are new get embedded and added;
+    chunks that disappeared, and sources that are no longer listed, are deleted from the index.
+
+    Ingestion is streamed: sources are fetched concurrently, each one is split as soon as it arrives,
+    and chunks are embedded and inserted in fixed-size batches behind a bounded queue; the keyword index
+    is then written from texts read back from the store batch by batch. Memory use therefore depends on
+    the concurrency and batch settings, not on the size of the corpus, but for the chunk ids and the
+    keyword index postings, a few bytes per chunk and per distinct term in it.
+
+    The files of the new build are written into a directory of their own, builds/<version>, and the
+    build is published all at once by replacing the manifest that points to it, so processes serving
+    the index switch from the previous build to this one between two queries (see PublishedRetriever).
+    Only the settings.index_keep_builds most recent build directories are kept.
+
+    Args:
+        index_dir (str): Where the index lives, defaults to settings.index_dir
+        sources (list[str]): URLs, local files or directories to index, defaults to settings.index_sources
+
+    Returns:
+        IndexManifest: The manifest of the index that was written
+    """
+    index_dir = index_dir or settings.index_dir
+    sources = expand_sources(sources or settings.index_sources)
+    os.makedirs(index_dir, exist_ok=True)
+
+    old = load_manifest(index_dir)
+    if old is not None and old.embedding_model != settings.embedding_model:
+        raise ValueError(
+            f"Index in {index_dir} was built with {old.embedding_model}, not {settings.embedding_model}; "
+            "remove it to rebuild from scratch"
+        )
+    version = uuid.uuid4().hex
+    new_dir = build_dir(index_dir, version)
+
+    vectorstore = open_build_vectorstore(index_dir, old, version)
+    old_sources = old.sources if old is not None else {}
+    if old is not None and old.vector_backend != settings.vector_backend:
+        # everything goes into the other store again, embeddings come from the cache
+        logger.info(
+            "Vector backend changed from %s to %s, re-adding all chunks", old.vector_backend, settings.vector_backend
+        )
+        old_sources = {}
+        leftover = vectorstore.get(include=[])["ids"]
+        if leftover:
+            vectorstore.delete(ids=leftover)
+
+    new_sources = update_sources(vectorstore, sources, old_sources)
+    if isinstance(vectorstore, FlatVectorStore):
+        # loaded from the previous build, which stays as it is for whoever still reads it
+        vectorstore.path = os.path.join(new_dir, os.path.basename(vectorstore.path))
+        vectorstore.persist()
+
+    update_bm25(new_dir, vectorstore, new_sources, settings.index_batch_size)
+
+    manifest = IndexManifest(
+        collection=settings.index_collection,
+        embedding_model=settings.embedding_model,
+        vector_backend=settings.vector_backend,
+        built_at=format_datetime(datetime.now(timezone.utc)),
+        version=version,
+        build=version,
+        sources=new_sources,
+    )
+    publish(index_dir, manifest)
+    remove_old_builds(index_dir, [version] + ([old.build] if old is not None and old.build else []))
+    return manifest
+
+
+def open_build_vectorstore(index_dir: str, old: IndexManifest | None, version: str) -> VectorStore:
+    """The vectorstore the build of version is written to, holding the chunks of the old build to begin with."""
+    if settings.vector_backend == "chroma":
+        # Chroma writes in place: the build updates a copy of the previous build's collection
+        copy_chroma(build_dir(index_dir, old.build if old is not None else ""), build_dir(index_dir, version))
+        return open_vectorstore(index_dir, build_cached_embeddings(), version)
+    return open_vectorstore(index_dir, build_cached_embeddings(), old.build if old is not None else "")
+
+
+def update_sources(
+    vectorstore: VectorStore, sources: list[str], old_sources: dict[str, SourceEntry]
+) -> dict[str, SourceEntry]:
+    """
+    Brings the chunks in vectorstore in line with sources, fetched and split as they arrive, and written
+    in batches; the chunks of sources no longer listed are deleted.
+
+    Returns:
+        dict: The entries of the indexed sources, by source
+    """
+    text_splitter = build_text_splitter()
+    writer = BatchWriter(vectorstore, settings.index_batch_size, settings.index_max_pending_batches)
+
+    new_sources: dict[str, SourceEntry] = {}
+    for source, docs in fetch_sources(sources, settings.index_fetch_concurrency):
+        entry = old_sources.get(source)
+        if docs is None:
+            # keep what was indexed before, the next build retries
+            if entry is not None:
+                new_sources[source] = entry
+            continue
+        new_sources[source] = update_source(writer, text_splitter, source, docs, entry)
+
+    for source, entry in old_sources.items():
+        if source not in new_sources:
+            writer.delete(entry.chunk_ids)
+            logger.info("Removed: %s", source)
+    writer.close()
+    return new_sources
+
+
+def update_source(
+    writer: BatchWriter, text_splitter: TextSplitter, source: str, docs: list[Document], entry: SourceEntry | None
+) -> SourceEntry:
+    """
+    Splits docs, the content of source, and writes the chunks that are new and deletes the ones that are
+    gone since entry, what was indexed of source before.
+
+    Returns:
+        SourceEntry: What is indexed of source now, entry itself when its content did not change
+    """
+    h = content_hash("".join(doc.page_content for doc in docs))
+    if entry is not None and entry.content_hash == h:
+        logger.info("Unchanged: %s", source)
+        return entry
+
+    doc_splits = text_splitter.split_documents(docs)
+    chunk_ids = chunk_ids_of(source, doc_splits)
+
+    old_ids = set(entry.chunk_ids) if entry is not None else set()
+    stale_ids = old_ids.difference(chunk_ids)
+    writer.delete(list(stale_ids))
+
+    added = [(i, d) for i, d in zip(chunk_ids, doc_splits) if i not in old_ids]
+    writer.add([i for i, _ in added], [d for _, d in added])
+
+    logger.info("Indexed: %s (%d chunks, %d added, %d deleted)", source, len(chunk_ids), len(added), len(stale_ids))
+    return SourceEntry(content_hash=h, chunk_ids=chunk_ids)
+
+
+def open_index(index_dir: str | None = None) -> BaseRetriever:
+    """
+    Open the index published by build_index. Nothing is fetched or embedded here, unless no index
+    was built yet, settings.index_build_if_missing is on and this is the only worker; several workers
+    would build it at the same time, main.py builds it before starting them instead.
+
+    Args:
+        index_dir (str): Where the index lives, defaults to settings.index_dir
+
+    Returns:
+        BaseRetriever: Retriever over the persisted collection, hybrid when settings.retrieval_mode is "hybrid"
+    """
+    index_dir = index_dir or settings.index_dir
+
+    manifest = load_manifest(index_dir)
+    if manifest is None:
+        if not settings.index_build_if_missing or settings.workers > 1:
+            raise FileNotFoundError(f"No index found in {index_dir}, run build_index.py first")
+        logger.warning("No index found in %s, building it now", index_dir)
+        manifest = build_index(index_dir)
+
+    missing = [source for source in expand_sources(settings.index_sources) if source not in manifest.sources]
+    if missing:
+        logger.warning("Index in %s is stale, not indexed yet: %s", index_dir, json.dumps(missing))
+
+    if not manifest.build:
+        logger.warning("Index in %s was built before builds had directories of their own, rebuild it", index_dir)
+    retriever = PublishedRetriever(index_dir=index_dir)
+    retriever.published()
+    return retriever
+
+
+def open_build(index_dir: str, manifest: IndexManifest) -> BaseRetriever:
+    """Retriever over the build manifest describes."""
+    if settings.retrieval_mode == "vector":
+        return open_vectorstore(index_dir, build=manifest.build).as_retriever(search_kwargs={"k": settings.retrieval_k})
+    return HybridRetriever(
+        vector_retriever=open_vectorstore(index_dir, build=manifest.build).as_retriever(
+            search_kwargs={"k": settings.retrieval_fetch_k}
+        ),
+        bm25_path=os.path.join(build_dir(index_dir, manifest.build), BM25_DIR),
+        k=settings.retrieval_k,
+        fetch_k=settings.retrieval_fetch_k,
+        rrf_k=settings.retrieval_rrf_k,
+    )
+
+
+class PublishedRetriever(BaseRetriever):
+    """
+    Retrieves from whichever build is published in index_dir. When index_version() tells another build
+    was published, a retriever over it is opened and swapped in for the previous one as a whole, so a
+    query sees either build, never a mix of the two, and queries already running finish on theirs.
+    Opening a build is cheap, its files are memory-mapped.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index_dir: str
+    current: BaseRetriever | None = None
+    version: str = ""
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def published(self) -> BaseRetriever:
+        version = index_version(self.index_dir)
+        if self.current is not None and version == self.version:
+            return self.current
+        with self._lock:
+            if self.current is None or version != self.version:
+                manifest = load_manifest(self.index_dir)
+                if self.current is not None:
+                    logger.info("Switching to build %s of %s", manifest.version, self.index_dir)
+                self.current = open_build(self.index_dir, manifest)
+                self.version = manifest.version
+            return self.current
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.published().invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return await self.published().ainvoke(query, config={"callbacks": run_manager.get_child()})
@@ -0,0 +1,158 @@
+## IVF Approximate Vector Store #######################################################################################
+import math
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from flat_index import FlatVectorStore, normalize_rows, top_k
+
+IVF_FILE = "ivf.npz"
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, batch: int = 16384) -> np.ndarray:
+    """The nearest centroid of every vector."""
+    r = np.empty(len(vectors), dtype=np.int32)
+    for i in range(0, len(vectors), batch):
+        r[i : i + batch] = np.argmax(np.asarray(vectors[i : i + batch]) @ centroids.T, axis=1)
+    return r
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: nlist unit-length centroids of vectors."""
+    rnd = np.random.default_rng(seed)
+    centroids = np.asarray(vectors[np.sort(rnd.choice(len(vectors), nlist, replace=False))], dtype=np.float32)
+    for _ in range(iterations):
+        assign = assign_lists(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        lists, starts = np.unique(assign[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[lists] = np.add.reduceat(np.asarray(vectors)[order], starts, axis=0)
+        # lists that lost all their vectors start over from a random one
+        empty = np.setdiff1d(np.arange(nlist), lists)
+        sums[empty] = np.asarray(vectors[rnd.choice(len(vectors), len(empty), replace=False)])
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFVectorStore(FlatVectorStore):
+    """
+    Inverted-file index on top of the flat store: vectors are clustered into nlist lists around k-means
+    centroids, and a query is scored exactly against the vectors of the nprobe lists whose centroids
+    are nearest to it only. More probes trade latency for recall; nprobe = nlist is exact search.
+
+    Vectors added after training go to the list of their nearest centroid, so adds are incremental;
+    the centroids are trained again once the store grew retrain_factor times since they were.
+    Centroids and list assignments are persisted next to the vectors, in ivf.npz.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding: Embeddings,
+        nlist: int = 0,
+        nprobe: int = 8,
+        iterations: int = 10,
+        retrain_factor: float = 4.0,
+        **kwargs,
+    ):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.retrain_factor = retrain_factor
+        self.centroids: np.ndarray | None = None
+        self.trained_n = 0
+        # list of every row, -1 until assigned; rows of list l are order[offsets[l]:offsets[l + 1]]
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.order = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        super().__init__(path, embedding, **kwargs)
+
+    def target_nlist(self, n: int) -> int:
+        nlist = self.nlist or int(4 * math.sqrt(n))
+        return max(1, min(nlist, n))
+
+    # Persistence #####################################################################################################
+
+    def on_loaded(self):
+        p = os.path.join(self.path, IVF_FILE)
+        self.centroids, self.trained_n = None, 0
+        self.assign = np.full(len(self.ids), -1, dtype=np.int32)
+        if os.path.exists(p):
+            with np.load(p) as f:
+                if len(f["assign"]) == len(self.ids):
+                    self.centroids, self.assign, self.trained_n = f["centroids"], f["assign"], int(f["trained_n"])
+        self.build_lists()
+
+    def build_lists(self):
+        nlist = 0 if self.centroids is None else len(self.centroids)
+        self.order = np.argsort(self.assign, kind="stable")
+        self.offsets = np.searchsorted(self.assign[self.order], np.arange(-1, nlist + 1))[1:]
+
+    def train(self):
+        n = len(self.ids)
+        if n == 0:
+            return
+        if self.centroids is None or n >= self.retrain_factor * self.trained_n:
+            nlist = self.target_nlist(n)
+            # k-means on a sample is as good, and much cheaper
+            sample = np.random.default_rng(0).choice(n, min(n, 64 * nlist), replace=False)
+            self.centroids = train_centroids(np.asarray(self.matrix)[np.sort(sample)], nlist, self.iterations)
+            self.trained_n = n
+            self.assign = assign_lists(self.matrix, self.centroids)
+        else:
+            new = np.flatnonzero(self.assign < 0)
+            self.assign[new] = assign_lists(np.asarray(self.matrix)[new], self.centroids)
+        self.build_lists()
+
+    def persist(self):
+        self.train()
+        os.makedirs(self.path, exist_ok=True)
+        p = os.path.join(self.path, IVF_FILE)
+        with open(p + ".tmp", "wb") as f:
+            np.savez(f, centroids=self.centroids, assign=self.assign, trained_n=self.trained_n)
+        os.replace(p + ".tmp", p)
+        super().persist()
+
+    # Writes ##########################################################################################################
+
+    def add_vectors(self, ids: list[str], texts: list[str], metadatas: list[dict], vectors: np.ndarray):
+        super().add_vectors(ids, texts, metadatas, vectors)
+        if self.centroids is None:
+            # unassigned rows are searched with every query until persist() trains the centroids
+            assign = np.full(len(vectors), -1, dtype=np.int32)
+        else:
+            assign = assign_lists(vectors, self.centroids)
+        self.assign = np.concatenate([self.assign, assign])
+        self.build_lists()
+
+    def delete(self, ids=None, **kwargs):
+        rows = {self.row_of[i] for i in ids or [] if i in self.row_of}
+        if not rows:
+            return True
+        keep = np.array([row not in rows for row in range(len(self.ids))], dtype=bool)
+        self.assign = self.assign[keep]
+        r = super().delete(ids, **kwargs)
+        # rows after the deleted ones moved up
+        self.build_lists()
+        return r
+
+    # Search ##########################################################################################################
+
+    def search_rows(self, queries: np.ndarray, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        if self.centroids is None:
+            return super().search_rows(queries, k)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = top_k(self.centroids @ queries.T, nprobe)
+        unassigned = self.order[: self.offsets[0]]
+        r = []
+        for j, q in enumerate(queries):
+            lists = [self.order[self.offsets[l] : self.offsets[l + 1]] for l in probes[:, j]]
+            # in row order, so the reads from the memory-mapped matrix go forward
+            rows = np.sort(np.concatenate([unassigned] + lists))
+            if len(rows) == 0:
+                r.append((rows, np.zeros(0, dtype=np.float32)))
+                continue
+            r.append(self.rank(q, k, rows))
+        return r
@@ -0,0 +1,35 @@
+## Lazily Built Module Attributes ####################################################################################
+import threading
+from typing import Any, Callable
+
+
+class LazyAttributes:
+    """
+    Attributes of a module built the first time they are looked up. The module makes get its __getattr__,
+    so module.<name> is the output of the builder registered under name; it is then kept in namespace,
+    the module's globals(), and later lookups find it without calling get again.
+    """
+
+    def __init__(self, namespace: dict[str, Any]):
+        self.namespace = namespace
+        # name -> function building it
+        self.builders: dict[str, Callable[[], Any]] = {}
+        self.lock = threading.RLock()
+
+    def register(self, name: str, builder: Callable[[], Any]):
+        """Makes module.<name> the output of builder, called the first time it is looked up."""
+        self.builders[name] = builder
+
+    def get(self, name: str) -> Any:
+        builder = self.builders.get(name)
+        if builder is None:
+            raise AttributeError(f"module {self.namespace['__name__']!r} has no attribute {name!r}")
+        with self.lock:
+            if name not in self.namespace:
+                self.namespace[name] = builder()
+        return self.namespace[name]
+
+    def load(self):
+        """Builds everything not built yet."""
+        for name in self.builders:
+            self.get(name)
@@ -0,0 +1,23 @@
+## LLMs ##############################################################################################################
+from langchain_core.language_models import BaseChatModel
+
+from clients import async_http_client, http_client
+from fakes import FakeChatModel
+from settings import settings
+
+
+def build_llm(model: str, **kwargs) -> BaseChatModel:
+    """The chat model behind a chain, or its local stand-in when settings.llm_backend is "fake"."""
+    if settings.llm_backend == "fake":
+        return FakeChatModel(
+            model_name=model,
+            latency=settings.fake_llm_latency,
+            yes_rate=settings.fake_llm_yes_rate,
+            web_search_rate=settings.fake_llm_web_search_rate,
+        )
+    from langchain_openai import ChatOpenAI  # pylint: disable=import-outside-toplevel
+
+    # all on the one shared, rate limited connection pool
+    return ChatOpenAI(
+        model=model, temperature=0, http_client=http_client, http_async_client=async_http_client, **kwargs
+    )
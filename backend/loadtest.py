@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+from bench import TOPICS
+
+
+def build_questions(total: int, run_id: str) -> list[str]:
+    """
+    Distinct questions, also across runs, so that none is answered from the semantic cache, the memoized
+    LLM calls or another request's workflow run, and the load test measures the workflow itself.
+    """
+    return [
+        f"What do the sources say about {TOPICS[i % len(TOPICS)]} (run {run_id}, question {i})?" for i in range(total)
+    ]
+
+
+async def run(url: str, questions: list[str], concurrency: int, timeout: float) -> list[float]:
+    """
+    Posts `questions` to the question endpoint, with at most `concurrency` in flight.
+
+    Returns:
+        list[float]: Latency of every request, in seconds
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+
+        async def one(i: int) -> float:
+            async with sem:
+                started = time.perf_counter()
+                resp = await client.post(url, json={"question": questions[i]})
+                resp.raise_for_status()
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(one(i) for i in range(len(questions))))
+
+
+def percentile(latencies: list[float], p: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method="inclusive")[p - 1]
+
+
+async def main(args):
+    print(f"{'concurrency':>11} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        started = time.perf_counter()
+        questions = build_questions(args.requests, f"{uuid.uuid4().hex[:8]}-{concurrency}")
+        latencies = await run(args.url, questions, concurrency, args.timeout)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{concurrency:>11} {len(latencies):>8} {len(latencies) / elapsed:>8.2f} "
+            f"{percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 95) * 1000:>8.0f} "
+            f"{percentile(latencies, 99) * 1000:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the question endpoint; throughput should grow with concurrency on a single worker"
+    )
+    parser.add_argument("--url", default="http://localhost:4080/rest/v1/question")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda v: [int(c) for c in v.split(",")],
+        default=[1, 2, 4, 8],
+        help="comma separated concurrency levels to sweep",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,20 @@
 import uvicorn
 
-from api import fastapi_app
+from log import get_logger
+from settings import settings
+
+logger = get_logger("main")
 
 if __name__ == "__main__":
-    uvicorn.run(fastapi_app, host="0.0.0.0", port=4080)
\ No newline at end of file
+    if settings.workers > 1 and settings.vector_backend == "chroma":
+        logger.warning("Every worker loads the Chroma collection on its own; the flat and ivf backends share one copy")
+    if settings.index_build_if_missing:
+        # here, once, rather than in every worker at the same time
+        from index_manifest import load_manifest  # pylint: disable=import-outside-toplevel
+        from indexing import build_index  # pylint: disable=import-outside-toplevel
+
+        if load_manifest(settings.index_dir) is None:
+            logger.warning("No index found in %s, building it now", settings.index_dir)
+            build_index(settings.index_dir)
+    # by import string, so that each of the worker processes imports the app itself
+    uvicorn.run("api:fastapi_app", host=settings.host, port=settings.port, workers=settings.workers)
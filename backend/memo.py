@@ -0,0 +1,185 @@
+## LLM Memoization ####################################################################################################
+import asyncio
+import hashlib
+import os
+import pickle
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from log import get_logger
+from metrics import record_cache
+from settings import settings
+from sqlite_table import connect
+
+logger = get_logger("memo")
+
+_MISSING = object()
+
+# set while a step is re-done because its output was rejected, when the memoized output would only be
+# the rejected one again: memoized steps then call the model, and replace what they had memoized
+bypass: ContextVar[bool] = ContextVar("memo_bypass", default=False)
+
+
+@contextmanager
+def bypassed(enabled: bool = True) -> Iterator[None]:
+    token = bypass.set(enabled)
+    try:
+        yield
+    finally:
+        bypass.reset(token)
+
+
+def normalize_prompt(prompt: Any) -> str:
+    """The prompt as text with whitespace runs collapsed, so formatting-only differences share one entry."""
+    if isinstance(prompt, PromptValue):
+        text = "\n".join(f"{m.type}: {m.content}" for m in prompt.to_messages())
+    else:
+        text = str(prompt)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class MemoStore:
+    """
+    LRU over at most max_entries outputs in memory, optionally backed by a SQLite file so entries
+    survive restarts. Values must be picklable to be persisted.
+    """
+
+    def __init__(self, max_entries: int, path: str = ""):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries: OrderedDict[str, Any] = OrderedDict()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with connect(self.path) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value BLOB)")
+
+    def get(self, key: str) -> Any:
+        value = self.entries.get(key, _MISSING)
+        if value is not _MISSING:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def load(self, key: str) -> Any:
+        """Reads an entry persisted on disk, and keeps it in memory when found."""
+        if not self.path:
+            return _MISSING
+        with connect(self.path) as conn:
+            row = conn.execute("SELECT value FROM memo WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return _MISSING
+        try:
+            value = pickle.loads(row[0])
+        except (pickle.UnpicklingError, AttributeError, ImportError) as ex:
+            # persisted by an older version, whose classes were since moved or changed
+            logger.warning("Not loading stale memoized output: %s", ex)
+            return _MISSING
+        self.put(key, value)
+        return value
+
+    def save(self, key: str, value: Any):
+        if not self.path:
+            return
+        try:
+            blob = pickle.dumps(value)
+        except (pickle.PicklingError, AttributeError, TypeError) as ex:
+            logger.warning("Not persisting unpicklable %s: %s", type(value).__name__, ex)
+            return
+        with connect(self.path) as conn:
+            conn.execute("INSERT OR REPLACE INTO memo VALUES (?, ?)", (key, blob))
+
+
+class MemoizedRunnable(Runnable):
+    """
+    Wraps the model step of a chain. All chains run at temperature 0, so the same prompt to the same
+    model gives the same output, and the retry loops of the workflow often send exactly that. Keyed
+    by chain name, model name and the normalized prompt; counts hits and misses per chain.
+    """
+
+    def __init__(self, bound: Runnable, name: str, model: str, store: MemoStore):
+        self.bound = bound
+        self.name = name
+        self.model = model
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def key_of(self, prompt: Any) -> str:
+        return hashlib.sha256(f"{self.name}\n{self.model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:  # pylint: disable=redefined-builtin
+        key = self.key_of(input)
+        value = _MISSING if bypass.get() else self.store.get(key)
+        if value is _MISSING and not bypass.get():
+            value = self.store.load(key)
+        if value is not _MISSING:
+            self.hits += 1
+            record_cache("memo", self.name, True)
+            return value
+
+        self.misses += 1
+        record_cache("memo", self.name, False)
+        value = self.bound.invoke(input, config, **kwargs)
+        self.store.put(key, value)
+        self.store.save(key, value)
+        return value
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:  # pylint: disable=redefined-builtin
+        key = self.key_of(input)
+        value = _MISSING if bypass.get() else self.store.get(key)
+        if value is _MISSING and self.store.path and not bypass.get():
+            value = await asyncio.to_thread(self.store.load, key)
+        if value is not _MISSING:
+            self.hits += 1
+            record_cache("memo", self.name, True)
+            return value
+
+        self.misses += 1
+        record_cache("memo", self.name, False)
+        value = await self.bound.ainvoke(input, config, **kwargs)
+        self.store.put(key, value)
+        if self.store.path:
+            await asyncio.to_thread(self.store.save, key, value)
+        return value
+
+
+# one store for all chains, so settings.memo_max_entries bounds the total
+memo_store = MemoStore(settings.memo_max_entries, settings.memo_path)
+memoized: dict[str, MemoizedRunnable] = {}
+
+
+def memoize(bound: Runnable, name: str, model: str) -> Runnable:
+    """
+    Memoizes the model step of the chain called name, unless memoization is disabled. Either way the
+    step gets the chain name as "chain" metadata, that metrics.TraceHandler attributes LLM calls by.
+
+    Args:
+        bound (Runnable): The model step, taking the rendered prompt
+        name (str): Name of the chain, that hits and misses are counted under
+        model (str): Name of the model behind the step
+
+    Returns:
+        Runnable: The memoized step, or bound itself
+    """
+    bound = bound.with_config(metadata={"chain": name})
+    if not settings.memo_enabled:
+        return bound
+    r = MemoizedRunnable(bound, name, model, memo_store)
+    memoized[name] = r
+    return r
+
+
+def memo_stats() -> dict[str, dict[str, int]]:
+    return {name: {"hits": r.hits, "misses": r.misses} for name, r in memoized.items()}
@@ -0,0 +1,282 @@
+## Metrics and Tracing ################################################################################################
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.lock = Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        pass
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            return [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # labels -> (count per bucket, sum, count)
+        self.values: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total, n = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, n + 1)
+
+    def samples(self) -> list[str]:
+        r = []
+        with self.lock:
+            for key, (counts, total, n) in self.values.items():
+                for bound, c in zip(self.buckets, counts):
+                    le = 'le="' + str(bound) + '"'
+                    r.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {c}")
+                le = 'le="+Inf"'
+                r.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {n}")
+                r.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+                r.append(f"{self.name}_count{_labels(self.labels, key)} {n}")
+        return r
+
+
+REGISTRY: list[Metric] = []
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+requests_total = Counter("rag_requests_total", "Questions answered", ("endpoint", "cached"))
+request_seconds = Histogram("rag_request_seconds", "Wall time to answer a question", ("endpoint",))
+node_seconds = Histogram("rag_node_seconds", "Wall time of a workflow node", ("node",))
+llm_calls_total = Counter("rag_llm_calls_total", "LLM calls made", ("chain",))
+llm_seconds = Histogram("rag_llm_seconds", "Wall time of an LLM call", ("chain",))
+llm_tokens_total = Counter("rag_llm_tokens_total", "LLM tokens used", ("chain", "kind"))
+loop_iterations_total = Counter("rag_loop_iterations_total", "Iterations of the self-correcting loops", ("loop",))
+cache_hits_total = Counter("rag_cache_hits_total", "Cache hits", ("cache", "name"))
+cache_misses_total = Counter("rag_cache_misses_total", "Cache misses", ("cache", "name"))
+route_decisions_total = Counter("rag_route_decisions_total", "Routing decisions", ("router", "datasource"))
+router_fast_path_rate = Gauge(
+    "rag_router_fast_path_rate", "Share of the questions the local router routed without falling back to the LLM"
+)
+rerank_decisions_total = Counter(
+    "rag_rerank_decisions_total", "Retrieved documents by reranker decision", ("decision",)
+)
+batch_size = Histogram(
+    "rag_batch_size",
+    "Calls of a workflow stage grouped into one LLM call",
+    ("stage",),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+rate_limit_queue_depth = Gauge(
+    "rag_rate_limit_queue_depth", "Requests waiting for the rate limit budget", ("limiter", "priority")
+)
+rate_limit_wait_seconds = Histogram(
+    "rag_rate_limit_wait_seconds", "Time a request waited for the rate limit budget", ("limiter", "priority")
+)
+rate_limited_total = Counter("rag_rate_limited_total", "Requests the provider answered 429", ("limiter",))
+context_tokens = Histogram(
+    "rag_context_tokens",
+    "Tokens of the context packed for a generation",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 8000),
+)
+context_documents_total = Counter(
+    "rag_context_documents_total", "Documents offered for the context, by packing decision", ("decision",)
+)
+degraded_total = Counter(
+    "rag_degraded_total", "Questions answered with the best answer so far, out of budget", ("reason",)
+)
+
+
+@dataclass
+class RequestTrace:  # pylint: disable=too-many-instance-attributes
+    """What answering one question cost."""
+
+    started: float = field(default_factory=time.perf_counter)
+    nodes: list[tuple[str, float]] = field(default_factory=list)  # (node, seconds), in the order they ended
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    iterations: int = 0
+    cache_hits: int = 0
+    # waited for the workflow run of an identical question instead, see answering.answer_question
+    coalesced: bool = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """The nodes and total time as a Server-Timing header value."""
+        entries = [f"{node};dur={seconds * 1000:.1f}" for node, seconds in self.nodes]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "iterations": self.iterations,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+        }
+
+    def header(self) -> str:
+        """The summary as an X-RAG-Trace header value."""
+        return ";".join(f"{k}={v}" for k, v in self.summary().items())
+
+
+# trace of the request being handled, if any
+current_trace: ContextVar[RequestTrace | None] = ContextVar("current_trace", default=None)
+
+
+def record_cache(cache: str, name: str, hit: bool):
+    if hit:
+        cache_hits_total.inc(cache=cache, name=name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.cache_hits += 1
+    else:
+        cache_misses_total.inc(cache=cache, name=name)
+
+
+class TraceHandler(AsyncCallbackHandler):  # pylint: disable=too-many-ancestors
+    """
+    Times workflow nodes and LLM calls of one request, counts tokens and loop iterations, and records
+    them both in trace and in the process-wide metrics. LLM calls are attributed to the chain named
+    by the "chain" metadata that memo.memoize puts on every chain's model step.
+    """
+
+    def __init__(self, trace: RequestTrace, nodes: set[str]):
+        self.trace = trace
+        self.nodes = nodes
+        self.node_runs: dict[UUID, tuple[str, float]] = {}
+        self.llm_runs: dict[UUID, tuple[str, float]] = {}
+
+    async def on_chain_start(  # pylint: disable=too-many-arguments
+        self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs
+    ):
+        name = kwargs.get("name")
+        if name not in self.nodes:
+            return
+        # one per retry edge, as the graph counts them in its iterations state: re-writing the question, or
+        # re-generating an answer that was not supported; the generate after a re-write is not another one
+        state = inputs if isinstance(inputs, dict) else {}
+        if name == "transform_query" or (name == "generate" and state.get("verdict") == "not supported"):
+            self.trace.iterations += 1
+            loop_iterations_total.inc(loop=name)
+        self.node_runs[run_id] = (name, time.perf_counter())
+
+    async def on_chain_end(self, outputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._end_node(run_id)
+
+    async def on_chain_error(self, error, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._end_node(run_id)
+
+    def _end_node(self, run_id: UUID):
+        run = self.node_runs.pop(run_id, None)
+        if run is None:
+            return
+        name, started = run
+        seconds = time.perf_counter() - started
+        self.trace.nodes.append((name, seconds))
+        node_seconds.observe(seconds, node=name)
+
+    async def on_chat_model_start(  # pylint: disable=too-many-arguments
+        self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs
+    ):
+        chain = (metadata or {}).get("chain", "unknown")
+        self.trace.llm_calls += 1
+        llm_calls_total.inc(chain=chain)
+        self.llm_runs[run_id] = (chain, time.perf_counter())
+
+    async def on_llm_end(self, response: LLMResult, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        run = self.llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        chain, started = run
+        llm_seconds.observe(time.perf_counter() - started, chain=chain)
+
+        prompt_tokens, completion_tokens = token_usage(response)
+        self.trace.prompt_tokens += prompt_tokens
+        self.trace.completion_tokens += completion_tokens
+        llm_tokens_total.inc(prompt_tokens, chain=chain, kind="prompt")
+        llm_tokens_total.inc(completion_tokens, chain=chain, kind="completion")
+
+    async def on_llm_error(self, error, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self.llm_runs.pop(run_id, None)
+
+
+def token_usage(response: LLMResult) -> tuple[int, int]:
+    """(prompt tokens, completion tokens) of an LLM call, from the message usage or the provider output."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
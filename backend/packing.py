@@ -0,0 +1,96 @@
+## Context Packing ####################################################################################################
+from functools import lru_cache
+
+from langchain_core.documents import Document
+
+from bm25 import tokenize
+from metrics import context_documents_total, context_tokens
+from rerank import LexicalReranker
+from retrieval import reciprocal_rank_fusion
+from settings import settings
+
+# what the generator and the graders are prompted with, see tools.py
+CONTEXT_MODEL = "gpt-3.5-turbo"
+SEPARATOR = "\n\n"
+
+
+@lru_cache(maxsize=1)
+def encoding():
+    # imported here, and the encoding loaded once: it takes a while, and is downloaded on first use
+    import tiktoken  # pylint: disable=import-outside-toplevel
+
+    return tiktoken.encoding_for_model(CONTEXT_MODEL)
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Tokens of text; chunks come up again and again, so counts are cached."""
+    if settings.llm_backend == "fake":
+        # offline: about 4 characters per token, like the text splitter's
+        return (len(text) + 3) // 4
+    return len(encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    if settings.llm_backend == "fake":
+        return text[: max_tokens * 4]
+    return encoding().decode(encoding().encode(text, disallowed_special=())[:max_tokens])
+
+
+def shingles(text: str, n: int = 3) -> set[tuple[str, ...]]:
+    words = tokenize(text)
+    return {tuple(words[i : i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def similarity(a: set, b: set) -> float:
+    """Jaccard similarity of two shingle sets."""
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def pack_context(question: str, documents: list[Document], max_tokens: int | None = None) -> str:
+    """
+    The context a generation, and the grading of it, is prompted with: of documents, those that are not
+    near duplicates of a more relevant one, most relevant first, as many as fit in max_tokens
+    (settings.context_max_tokens). Relevance fuses the order documents come in, retrieval's or the
+    reranker's, with how many of the question's terms they contain. Documents that do not fit are
+    left out, but a smaller less relevant one may still fit; the most relevant one is cut to fit.
+
+    Returns:
+        str: The texts of the packed documents, separated by blank lines
+    """
+    max_tokens = settings.context_max_tokens if max_tokens is None else max_tokens
+    if not documents:
+        return ""
+
+    scores = LexicalReranker().score(question, documents)
+    lexical = [d for _, d in sorted(zip(scores, documents), key=lambda r: r[0], reverse=True)]
+    # identical texts are merged by the fusion already
+    ranked = reciprocal_rank_fusion([documents, lexical], len(documents))
+    context_documents_total.inc(len(documents) - len(ranked), decision="duplicate")
+
+    kept: list[set] = []
+    texts: list[str] = []
+    used = 0
+    for doc in ranked:
+        s = shingles(doc.page_content)
+        if any(similarity(s, other) >= settings.context_dedupe_threshold for other in kept):
+            context_documents_total.inc(decision="duplicate")
+            continue
+        kept.append(s)
+
+        cost = count_tokens(doc.page_content) + (count_tokens(SEPARATOR) if texts else 0)
+        if used + cost <= max_tokens:
+            texts.append(doc.page_content)
+            used += cost
+        elif not texts:
+            texts.append(truncate_tokens(doc.page_content, max_tokens))
+            used = count_tokens(texts[0])
+        else:
+            context_documents_total.inc(decision="over_budget")
+            continue
+        context_documents_total.inc(decision="packed")
+
+    context_tokens.observe(used)
+    return SEPARATOR.join(texts)
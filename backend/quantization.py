@@ -0,0 +1,171 @@
+## Quantized Vectors ##################################################################################################
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+CODEC_FILE = "codec.npz"
+CODES_FILE = "codes.npy"
+
+
+class Codec(ABC):
+    """Compresses unit-length vectors into codes that approximate their dot product with a query."""
+
+    kind = ""
+    # vectors the codec was trained on
+    trained_n = 0
+
+    def train(self, vectors: np.ndarray):
+        pass
+
+    @abstractmethod
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """
+        Approximate dot products of queries, shape (queries, dim), with the vectors behind
+        codes; shape (codes, queries).
+        """
+
+    @abstractmethod
+    def state(self) -> dict[str, np.ndarray]:
+        pass
+
+    @abstractmethod
+    def load_state(self, state: dict[str, np.ndarray]):
+        pass
+
+
+class Int8Codec(Codec):
+    """Scalar quantization: every dimension scaled by its largest magnitude into an int8, 1 byte per dimension."""
+
+    kind = "int8"
+
+    def __init__(self, block: int = 16384):
+        self.block = block
+        self.scale = np.zeros(0, dtype=np.float32)
+
+    def train(self, vectors: np.ndarray):
+        self.scale = np.maximum(np.abs(np.asarray(vectors)).max(axis=0), 1e-12).astype(np.float32) / 127
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(np.asarray(vectors) / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        q = (queries * self.scale).T
+        r = np.empty((len(codes), len(queries)), dtype=np.float32)
+        # in blocks, so the float copy of the codes stays small
+        for i in range(0, len(codes), self.block):
+            r[i : i + self.block] = codes[i : i + self.block].astype(np.float32) @ q
+        return r
+
+    def state(self) -> dict[str, np.ndarray]:
+        return {"scale": self.scale}
+
+    def load_state(self, state: dict[str, np.ndarray]):
+        self.scale = state["scale"]
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int, rnd: np.random.Generator) -> np.ndarray:
+    centroids = vectors[rnd.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        filled, starts, counts = np.unique(assign[order], return_index=True, return_counts=True)
+        # clusters that lost all their vectors keep their centroid
+        centroids[filled] = np.add.reduceat(vectors[order], starts, axis=0) / counts[:, None]
+    return centroids
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin |v - c|^2 = argmax v.c - |c|^2 / 2
+    return np.argmax(vectors @ centroids.T - 0.5 * (centroids**2).sum(axis=1), axis=1)
+
+
+class PQCodec(Codec):
+    """
+    Product quantization: the dimensions are split into subspaces, and in each the slice of a vector
+    is replaced by the nearest of 256 centroids learned by k-means, 1 byte per subspace. A query is
+    scored through one lookup table of dot products per subspace.
+    """
+
+    kind = "pq"
+
+    def __init__(self, subspaces: int = 0, iterations: int = 10, block: int = 65536):
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.block = block
+        self.centroids = np.zeros((0, 256, 0), dtype=np.float32)  # (subspaces, 256, dimensions per subspace)
+
+    def split(self, vectors: np.ndarray) -> np.ndarray:
+        """vectors reshaped to (vectors, subspaces, dimensions per subspace)."""
+        m = len(self.centroids)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), m, -1)
+
+    def train(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        m = self.subspaces or max(1, dim // 8)
+        while dim % m:
+            m -= 1
+        rnd = np.random.default_rng(0)
+        sample = vectors[rnd.choice(len(vectors), min(len(vectors), 256 * 32), replace=False)]
+        k = min(256, len(sample))
+        self.centroids = np.stack(
+            [kmeans(s, k, self.iterations, rnd) for s in np.split(sample, m, axis=1)]
+        ).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self.split(vectors)
+        return np.stack([nearest(parts[:, j], self.centroids[j]) for j in range(len(self.centroids))], axis=1).astype(
+            np.uint8
+        )
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        m = len(self.centroids)
+        r = np.empty((len(codes), len(queries)), dtype=np.float32)
+        for j, table in enumerate(np.einsum("mkd,qmd->qmk", self.centroids, self.split(queries))):  # (subspaces, 256)
+            for i in range(0, len(codes), self.block):
+                r[i : i + self.block, j] = table[np.arange(m), codes[i : i + self.block]].sum(axis=1)
+        return r
+
+    def state(self) -> dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def load_state(self, state: dict[str, np.ndarray]):
+        self.centroids = state["centroids"]
+
+
+def build_codec(kind: str, pq_subspaces: int = 0) -> Codec | None:
+    if kind == "int8":
+        return Int8Codec()
+    if kind == "pq":
+        return PQCodec(pq_subspaces)
+    return None
+
+
+def save_codes(path: str, codec: Codec, codes: np.ndarray):
+    # write-then-rename, like the vectors
+    p = os.path.join(path, CODEC_FILE)
+    with open(p + ".tmp", "wb") as f:
+        np.savez(f, kind=codec.kind, trained_n=codec.trained_n, **codec.state())
+    os.replace(p + ".tmp", p)
+    p = os.path.join(path, CODES_FILE)
+    with open(p + ".tmp", "wb") as f:
+        np.save(f, codes)
+    os.replace(p + ".tmp", p)
+
+
+def load_codes(path: str, codec: Codec) -> np.ndarray | None:
+    """The persisted codes, with codec's state loaded; None when there are none of codec's kind."""
+    p = os.path.join(path, CODEC_FILE)
+    if not os.path.exists(p):
+        return None
+    with np.load(p) as f:
+        if str(f["kind"]) != codec.kind:
+            return None
+        codec.trained_n = int(f["trained_n"])
+        codec.load_state({name: f[name] for name in f.files if name not in ("kind", "trained_n")})
+    return np.load(os.path.join(path, CODES_FILE), mmap_mode="r")
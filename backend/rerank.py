@@ -0,0 +1,69 @@
+## Local Reranking ####################################################################################################
+import asyncio
+import math
+from abc import ABC, abstractmethod
+
+from langchain_core.documents import Document
+
+from bm25 import tokenize
+from log import get_logger
+from settings import settings
+
+logger = get_logger("rerank")
+
+
+class Reranker(ABC):
+    """Scores how relevant documents are to a question, locally, in [0, 1]."""
+
+    # whether scoring is CPU heavy, and so should be moved off the event loop
+    blocking = False
+
+    @abstractmethod
+    def score(self, question: str, documents: list[Document]) -> list[float]:
+        """One score per document, in order."""
+
+    async def ascore(self, question: str, documents: list[Document]) -> list[float]:
+        if self.blocking:
+            return await asyncio.to_thread(self.score, question, documents)
+        return self.score(question, documents)
+
+
+class LexicalReranker(Reranker):
+    """Share of the question's terms (stopwords aside) that occur in the document."""
+
+    def score(self, question: str, documents: list[Document]) -> list[float]:
+        terms = set(tokenize(question))
+        if not terms:
+            return [0.0] * len(documents)
+        return [len(terms.intersection(tokenize(doc.page_content))) / len(terms) for doc in documents]
+
+
+class CrossEncoderReranker(Reranker):
+    """A small cross-encoder run on the CPU, its logits squashed into [0, 1]. Needs sentence-transformers."""
+
+    blocking = True
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise ImportError(
+                "RERANK_MODE=cross_encoder needs sentence-transformers: pip install sentence-transformers"
+            ) from ex
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, question: str, documents: list[Document]) -> list[float]:
+        if not documents:
+            return []
+        logits = self.model.predict([(question, doc.page_content) for doc in documents])
+        return [1 / (1 + math.exp(-float(logit))) for logit in logits]
+
+
+def build_reranker() -> Reranker | None:
+    """The reranker selected by settings.rerank_mode, None when reranking is off."""
+    if settings.rerank_mode == "lexical":
+        return LexicalReranker()
+    if settings.rerank_mode == "cross_encoder":
+        logger.info("Loading cross-encoder %s", settings.rerank_model)
+        return CrossEncoderReranker(settings.rerank_model)
+    return None
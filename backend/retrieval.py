@@ -0,0 +1,72 @@
+## Hybrid Retrieval ###################################################################################################
+import asyncio
+from typing import Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+from pydantic import ConfigDict
+
+from bm25 import BM25Index
+
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int, rrf_k: int = 60) -> list[Document]:
+    """
+    Fuses rankings by summing 1 / (rrf_k + rank) over the rankings a document appears in; only ranks
+    count, so scores of different scales (distances, BM25) need no calibration.
+
+    Returns:
+        list[Document]: The k best documents, best first
+    """
+    scores: dict[str, float] = {}
+    docs: dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Vector similarity search fused with BM25 keyword search (see bm25.py), so questions that hinge on
+    exact terms are not left to embeddings alone. The keyword index is loaded from bm25_path when
+    first needed; builds are published into new directories, with a new retriever (see indexing.py).
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_retriever: VectorStoreRetriever
+    bm25_path: str
+    # documents returned, and candidates taken from each search before fusing
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    bm25: Optional[BM25Index] = None
+
+    def keyword_index(self) -> BM25Index | None:
+        if self.bm25 is None:
+            self.bm25 = BM25Index.load(self.bm25_path)
+        return self.bm25
+
+    def keyword_search(self, query: str) -> list[Document]:
+        bm25 = self.keyword_index()
+        if bm25 is None:
+            return []
+        return [doc for doc, _ in bm25.search(query, self.fetch_k)]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        vector_docs = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return reciprocal_rank_fusion([vector_docs, self.keyword_search(query)], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        vector_docs = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        # the BM25 scoring (and the first load of the index) in a thread, off the event loop
+        keyword_docs = await asyncio.to_thread(self.keyword_search, query)
+        return reciprocal_rank_fusion([vector_docs, keyword_docs], self.k, self.rrf_k)
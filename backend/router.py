@@ -0,0 +1,69 @@
+## Local Question Router ##############################################################################################
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from index_derived import unit_vector
+from index_stores import build_cached_embeddings, build_embeddings
+from metrics import router_fast_path_rate
+from settings import settings
+
+
+class LocalRouter:
+    """
+    Routes a question without an LLM call, by comparing its embedding with the embeddings of example
+    questions of each datasource (settings.router_vectorstore_examples and router_web_search_examples).
+    A datasource scores the cosine similarity of its nearest example; both scores are of the same kind,
+    question against question, so they can be compared with a fixed margin. It only decides when one
+    datasource wins by at least margin, and otherwise leaves the question to the LLM router.
+    """
+
+    def __init__(self, embeddings: Embeddings, examples: dict[str, np.ndarray], margin: float):
+        self.embeddings = embeddings
+        # datasource -> unit-length embeddings of its example questions, one per row
+        self.examples = examples
+        self.margin = margin
+        self.local = 0
+        self.fallback = 0
+
+    async def route(self, question: str, embedding: np.ndarray | None = None) -> str | None:
+        """
+        Args:
+            question (str): The question
+            embedding (np.ndarray): Its unit-length embedding by build_embeddings(), if computed already
+
+        Returns:
+            str: "vectorstore" or "web_search", or None when not confident enough
+        """
+        q = embedding if embedding is not None else unit_vector(await self.embeddings.aembed_query(question))
+        vectorstore = float(np.max(self.examples["vectorstore"] @ q))
+        web_search = float(np.max(self.examples["web_search"] @ q))
+
+        if abs(vectorstore - web_search) < self.margin:
+            self.fallback += 1
+            router_fast_path_rate.set(self.stats()["fast_path_rate"])
+            return None
+        self.local += 1
+        router_fast_path_rate.set(self.stats()["fast_path_rate"])
+        return "vectorstore" if vectorstore > web_search else "web_search"
+
+    def stats(self) -> dict[str, float]:
+        total = self.local + self.fallback
+        return {"local": self.local, "fallback": self.fallback, "fast_path_rate": self.local / total if total else 0.0}
+
+
+def build_local_router() -> LocalRouter | None:
+    """The local router when settings.router_mode is "local", else None."""
+    if settings.router_mode != "local":
+        return None
+
+    # cached on disk like the chunk embeddings, so only the first start pays for these
+    embeddings = build_cached_embeddings()
+    examples = {
+        "vectorstore": settings.router_vectorstore_examples,
+        "web_search": settings.router_web_search_examples,
+    }
+    vectors = {
+        datasource: np.stack([unit_vector(e) for e in embeddings.embed_documents(questions)])
+        for datasource, questions in examples.items()
+    }
+    return LocalRouter(build_embeddings(), vectors, settings.router_local_margin)
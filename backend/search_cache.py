@@ -0,0 +1,133 @@
+## Web Search Cache ###################################################################################################
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from metrics import record_cache
+from semantic_cache import normalize_question
+from settings import settings
+from singleflight import SingleFlight
+from sqlite_table import SqliteTable
+
+
+class SearchCacheBackend(ABC):
+    """Stores the results of web searches, as [{"url": ..., "content": ...}, ...], by normalized query."""
+
+    # whether calls do I/O, and so should be moved off the event loop
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> list[dict] | None:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, results: list[dict]):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class InMemorySearchCacheBackend(SearchCacheBackend):
+    """Per-process backend: LRU over at most max_entries queries, each living for ttl seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (results, expires_at), least recently used first
+        self.entries: OrderedDict[str, tuple[list[dict], float]] = OrderedDict()
+
+    def get(self, key: str) -> list[dict] | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, results: list[dict]):
+        self.entries[key] = (results, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SqliteSearchCacheBackend(SearchCacheBackend):
+    """
+    Backend in a SQLite file, shared by every worker process on the host. Same LRU/TTL bounds as the
+    in-memory backend, enforced on write.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.table = SqliteTable(path, "results", ["results TEXT"], max_entries, ttl)
+
+    def get(self, key: str) -> list[dict] | None:
+        row = self.table.get("results", "key = ?", (key,))
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key: str, results: list[dict]):
+        self.table.put(key, (json.dumps(results),))
+
+    def clear(self):
+        self.table.clear()
+
+
+class SearchCache:
+    """
+    Answers web searches for the same query, up to case and whitespace, from the results of an earlier
+    one; searches for a query already being searched wait for that search instead of making their own.
+    """
+
+    def __init__(self, backend: SearchCacheBackend):
+        self.backend = backend
+        self.in_flight = SingleFlight("web_search")
+
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def search(self, search: Runnable, query: str) -> list[dict]:
+        key = normalize_question(query)
+        results = await self._call(self.backend.get, key)
+        record_cache("web_search", "results", results is not None)
+        if results is None:
+            results = await self.in_flight.do(key, lambda: self.fetch(search, query, key))
+        return results
+
+    async def fetch(self, search: Runnable, query: str, key: str) -> list[dict]:
+        results = await search.ainvoke({"query": query})
+        await self._call(self.backend.put, key, results)
+        return results
+
+    def wrap(self, search: Runnable) -> Runnable:
+        """search, taking {"query": ...}, with its results cached."""
+
+        async def cached_search(input: dict) -> list[dict]:  # pylint: disable=redefined-builtin
+            return await self.search(search, input["query"])
+
+        return RunnableLambda(cached_search, name="cached_web_search")
+
+
+def build_search_cache() -> SearchCache | None:
+    if settings.web_search_cache_backend == "none":
+        return None
+    if settings.web_search_cache_backend == "sqlite":
+        backend = SqliteSearchCacheBackend(
+            settings.web_search_cache_path, settings.web_search_cache_max_entries, settings.web_search_cache_ttl
+        )
+    else:
+        backend = InMemorySearchCacheBackend(settings.web_search_cache_max_entries, settings.web_search_cache_ttl)
+    return SearchCache(backend)
@@ -0,0 +1,240 @@
+## Semantic Answer Cache ##############################################################################################
+import asyncio
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel
+
+from index_derived import unit_vector
+from index_manifest import IndexManifest, add_index_listener, index_version
+from index_stores import build_embeddings
+from log import get_logger
+from metrics import record_cache
+from settings import settings
+from sqlite_table import SqliteTable
+
+logger = get_logger("semantic_cache")
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+
+class CachedAnswer(BaseModel):
+    question: str
+    answer: str
+    similarity: float
+
+
+class SemanticCacheBackend(ABC):
+    """
+    Stores graded answers by question. Embeddings handed in are unit length, so their dot product is
+    the cosine similarity. Entries are tagged with the index version they were answered from, and
+    only match lookups for that same version.
+    """
+
+    # whether calls do I/O, and so should be moved off the event loop
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str, version: str) -> CachedAnswer | None:
+        """Exact lookup by normalized question."""
+
+    @abstractmethod
+    def search(self, embedding: np.ndarray, threshold: float, version: str) -> CachedAnswer | None:
+        """The most similar question, if its similarity reaches threshold."""
+
+    @abstractmethod
+    def put(self, key: str, question: str, answer: str, embedding: np.ndarray, version: str):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class InMemorySemanticCacheBackend(SemanticCacheBackend):
+    """
+    Per-process backend: LRU over at most max_entries answers, each living for ttl seconds. Embeddings
+    are kept in one preallocated matrix, so a search is a single matrix-vector product.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.slots: OrderedDict[str, int] = OrderedDict()  # key -> row, least recently used first
+        # question, answer, version, expires_at
+        self.rows: list[tuple[str, str, str, float] | None] = [None] * max_entries
+        # version and expires_at of every row again, for searches to mask rows by
+        self.versions = np.full(max_entries, None, dtype=object)
+        self.expires = np.zeros(max_entries)
+        self.free = list(range(max_entries - 1, -1, -1))
+        self.matrix: np.ndarray | None = None
+
+    def get(self, key: str, version: str) -> CachedAnswer | None:
+        slot = self.slots.get(key)
+        if slot is None:
+            return None
+        return self._hit(key, slot, 1.0, version)
+
+    def search(self, embedding: np.ndarray, threshold: float, version: str) -> CachedAnswer | None:
+        if self.matrix is None or not self.slots:
+            return None
+        slots = np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))
+        # expired rows and rows of other versions must not hide a match behind them
+        live = (self.versions[slots] == version) & (self.expires[slots] >= time.monotonic())
+        if not live.any():
+            return None
+        sims = np.where(live, self.matrix[slots] @ embedding, -np.inf)
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+        slot = int(slots[best])
+        question = self.rows[slot][0]
+        return self._hit(normalize_question(question), slot, float(sims[best]), version)
+
+    def put(self, key: str, question: str, answer: str, embedding: np.ndarray, version: str):
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            if not self.free:
+                _, evicted = self.slots.popitem(last=False)
+                self._release(evicted)
+            slot = self.free.pop()
+        self.slots[key] = slot
+        self.rows[slot] = (question, answer, version, time.monotonic() + self.ttl)
+        self.versions[slot], self.expires[slot] = version, self.rows[slot][3]
+        self.matrix[slot] = embedding
+
+    def clear(self):
+        for slot in self.slots.values():
+            self._release(slot)
+        self.slots.clear()
+
+    def _hit(self, key: str, slot: int, similarity: float, version: str) -> CachedAnswer | None:
+        question, answer, entry_version, expires_at = self.rows[slot]
+        if entry_version != version or expires_at < time.monotonic():
+            del self.slots[key]
+            self._release(slot)
+            return None
+        self.slots.move_to_end(key)
+        return CachedAnswer(question=question, answer=answer, similarity=similarity)
+
+    def _release(self, slot: int):
+        self.rows[slot] = None
+        self.versions[slot] = None
+        self.free.append(slot)
+
+
+class SqliteSemanticCacheBackend(SemanticCacheBackend):
+    """
+    Backend in a SQLite file, shared by every worker process on the host. Same LRU/TTL bounds as the
+    in-memory backend, enforced on write.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.table = SqliteTable(
+            path, "answers", ["question TEXT", "answer TEXT", "embedding BLOB", "version TEXT"], max_entries, ttl
+        )
+
+    def get(self, key: str, version: str) -> CachedAnswer | None:
+        row = self.table.get("question, answer", "key = ? AND version = ?", (key, version))
+        if row is None:
+            return None
+        return CachedAnswer(question=row[0], answer=row[1], similarity=1.0)
+
+    def search(self, embedding: np.ndarray, threshold: float, version: str) -> CachedAnswer | None:
+        # only live rows of this version are searched, so no other row can hide a match behind it
+        rows = self.table.live("key, question, answer, embedding", "version = ?", (version,))
+        if not rows:
+            return None
+        matrix = np.frombuffer(b"".join(row[3] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        sims = matrix @ embedding
+        best = int(np.argmax(sims))
+        if sims[best] < threshold:
+            return None
+        key, question, answer, _ = rows[best]
+        self.table.use(key)
+        return CachedAnswer(question=question, answer=answer, similarity=float(sims[best]))
+
+    def put(self, key: str, question: str, answer: str, embedding: np.ndarray, version: str):
+        blob = embedding.astype(np.float32).tobytes()
+        self.table.put(key, (question, answer, blob, version), "version != ?", (version,))
+
+    def clear(self):
+        self.table.clear()
+
+
+class SemanticCache:
+    """
+    Answers a question from an earlier, graded answer to the same or a similar enough question.
+    Cleared whenever the index is rebuilt.
+    """
+
+    def __init__(self, backend: SemanticCacheBackend, embeddings: Embeddings, threshold: float):
+        self.backend = backend
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        add_index_listener(self.on_index_rebuilt)
+
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def lookup(self, question: str) -> tuple[CachedAnswer | None, np.ndarray | None]:
+        """
+        Returns:
+            tuple: The cached answer (None on a miss), and the question embedding if it was computed,
+                to be handed back to store()
+        """
+        version = index_version()
+        key = normalize_question(question)
+
+        r = await self._call(self.backend.get, key, version)
+        embedding = None
+        if r is None:
+            embedding = unit_vector(await self.embeddings.aembed_query(question))
+            r = await self._call(self.backend.search, embedding, self.threshold, version)
+
+        record_cache("semantic", "answer", r is not None)
+        if r is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.info("Answered from cache (similarity %.3f): %s", r.similarity, question)
+        return r, embedding
+
+    async def store(self, question: str, answer: str, embedding: np.ndarray | None = None):
+        if embedding is None:
+            embedding = unit_vector(await self.embeddings.aembed_query(question))
+        await self._call(self.backend.put, normalize_question(question), question, answer, embedding, index_version())
+
+    def invalidate(self):
+        self.backend.clear()
+
+    def on_index_rebuilt(self, manifest: IndexManifest):
+        logger.info("Index rebuilt (version %s), clearing the semantic cache", manifest.version)
+        self.invalidate()
+
+
+def build_semantic_cache() -> SemanticCache | None:
+    if settings.semantic_cache_backend == "none":
+        return None
+    if settings.semantic_cache_backend == "sqlite":
+        backend = SqliteSemanticCacheBackend(
+            settings.semantic_cache_path, settings.semantic_cache_max_entries, settings.semantic_cache_ttl
+        )
+    else:
+        backend = InMemorySemanticCacheBackend(settings.semantic_cache_max_entries, settings.semantic_cache_ttl)
+    return SemanticCache(backend, build_embeddings(), settings.semantic_cache_threshold)
@@ -0,0 +1,202 @@
+from typing import Literal
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """
+    Runtime settings, read from environment variables (or the .env file in the working directory).
+    """
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Index ###########################################################################################################
+    index_dir: str = "data/index"
+    index_collection: str = "rag-chroma"
+    index_sources: list[str] = [
+        "https://lilianweng.github.io/posts/2023-06-23-agent/",
+        "https://lilianweng.github.io/posts/2023-03-15-prompt-engineering/",
+        "https://lilianweng.github.io/posts/2023-10-25-adv-attack-llm/",
+    ]
+    index_chunk_size: int = 500
+    index_chunk_overlap: int = 0
+    # ingestion: sources fetched at once, chunks per embedding batch, batches queued before the loader blocks
+    index_fetch_concurrency: int = 8
+    index_batch_size: int = 64
+    index_max_pending_batches: int = 4
+    # build the index when none was published yet, instead of failing readiness; main.py does so once, before
+    # starting the workers, so they never build it at the same time
+    index_build_if_missing: bool = False
+    # build directories kept, the published one included; servers still on an older build switch at their next query
+    index_keep_builds: int = 2
+
+    # Server ##########################################################################################################
+    host: str = "0.0.0.0"
+    port: int = 4080
+    # processes serving requests; they memory-map the same flat or ivf index, so an extra one costs about an
+    # interpreter with the libraries loaded, not another copy of the index
+    workers: int = 1
+
+    # Vector store ####################################################################################################
+    # "chroma": a Chroma collection; "flat": a memory-mapped NumPy matrix searched exactly (see flat_index.py);
+    # "ivf": the same, searched approximately through an inverted-file index, for large corpora (see ivf_index.py)
+    vector_backend: Literal["chroma", "flat", "ivf"] = "chroma"
+    # ivf: lists the vectors are clustered into (0: about 4 * sqrt(vectors)), and lists searched per query; more
+    # probes trade latency for recall
+    ivf_nlist: int = 0
+    ivf_nprobe: int = 8
+    ivf_train_iterations: int = 10
+    # flat and ivf: compressed copy of the vectors kept in memory and searched instead of them (see quantization.py);
+    # "int8": 1 byte per dimension, "pq": pq_subspaces bytes per vector (0: dimensions / 8). The best
+    # quantization_rescore * k candidates are scored again exactly, from the memory-mapped vectors
+    vector_quantization: Literal["none", "int8", "pq"] = "none"
+    quantization_rescore: int = 50
+    pq_subspaces: int = 0
+
+    # Retrieval #######################################################################################################
+    # "vector": similarity search only
+    # "hybrid": similarity search fused with BM25 keyword search by reciprocal rank fusion (see retrieval.py);
+    # opt-in, as it changes what is retrieved. The keyword index is built either way, so switching needs no rebuild
+    retrieval_mode: Literal["vector", "hybrid"] = "vector"
+    # documents retrieved per question, and candidates taken from each search before fusing
+    retrieval_k: int = 4
+    retrieval_fetch_k: int = 20
+    retrieval_rrf_k: int = 60
+
+    # Context #########################################################################################################
+    # tokens of retrieved or searched text a generation, and the grading of it, is prompted with at most; documents
+    # are packed most relevant first, leaving out those this similar (word trigram Jaccard) to one packed already
+    context_max_tokens: int = 1500
+    context_dedupe_threshold: float = 0.8
+
+    # Models ##########################################################################################################
+    embedding_model: str = "text-embedding-ada-002"
+    # chunk embeddings are cached here across index builds
+    embedding_cache_dir: str = "data/embedding_cache"
+
+    # Grading #########################################################################################################
+    # "per_document": one grader call per retrieved document, at most grade_concurrency at a time
+    # "single_call": all retrieved documents graded by one structured-output call
+    grade_mode: Literal["per_document", "single_call"] = "per_document"
+    grade_concurrency: int = 4
+
+    # Reranking #######################################################################################################
+    # scores the retrieved documents locally before grading (see rerank.py): "lexical" by the share of question
+    # terms they contain, "cross_encoder" with rerank_model (needs sentence-transformers), "none" to grade them all
+    # with the LLM. Opt-in: documents scoring below rerank_reject are dropped without being graded, which changes
+    # answers, so evaluate the thresholds on your own questions first
+    rerank_mode: Literal["none", "lexical", "cross_encoder"] = "none"
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    # documents scoring at least rerank_accept are relevant, below rerank_reject irrelevant; only the ones in
+    # between are graded by the LLM
+    rerank_accept: float = 0.6
+    rerank_reject: float = 0.2
+
+    # Routing #########################################################################################################
+    # retrieve from the vectorstore while the question is being routed, instead of after
+    speculative_routing: bool = True
+    # run the web search speculatively as well; costs a search for every question routed to the vectorstore
+    speculative_web_search: bool = False
+    # "llm": every question is routed by the LLM
+    # "local": by comparing its embedding with those of example questions of each datasource (see router.py),
+    # falling back to the LLM when neither datasource's nearest example is closer by router_local_margin
+    router_mode: Literal["llm", "local"] = "llm"
+    router_local_margin: float = 0.05
+    # example questions for the vectorstore, on the topics of index_sources, and off-topic ones for web search
+    router_vectorstore_examples: list[str] = [
+        "What are the types of agent memory?",
+        "How do LLM agents plan and break a task into subgoals?",
+        "How do agents use tools and external APIs?",
+        "How does an agent reflect on and learn from its past actions?",
+        "What is chain of thought prompting?",
+        "How does few-shot prompting work?",
+        "What are adversarial attacks on large language models?",
+        "How do jailbreak prompts get around a model's safety training?",
+    ]
+    router_web_search_examples: list[str] = [
+        "Who will the Bears draft first in the NFL draft?",
+        "What is the weather forecast for tomorrow?",
+        "Who won the game last night?",
+        "What is the latest news on the stock market?",
+        "What is the current price of bitcoin?",
+        "Who is the president of France?",
+        "What movies are playing this weekend?",
+        "How many people live in Canada?",
+    ]
+
+    # Web search ######################################################################################################
+    # results per query; queries per search, the question and web_search_queries - 1 rewrites of it, searched at once
+    # and merged, the rewrites costing an LLM call
+    web_search_k: int = 3
+    web_search_queries: int = 1
+    # merged results kept, as separate documents of at most web_search_max_chars each, to keep prompts small
+    web_search_max_documents: int = 6
+    web_search_max_chars: int = 1500
+    # results reused for the same query within the ttl; "memory": per worker process, "sqlite": shared by the
+    # workers on a host through web_search_cache_path
+    web_search_cache_backend: Literal["none", "memory", "sqlite"] = "memory"
+    web_search_cache_path: str = "data/web_search_cache.sqlite"
+    web_search_cache_max_entries: int = 1024
+    web_search_cache_ttl: float = 900
+
+    # Semantic cache ##################################################################################################
+    # answers questions similar enough to an earlier one with its answer, up to semantic_cache_ttl old; opt-in:
+    # "memory": per worker process, "sqlite": shared by the workers on a host through semantic_cache_path
+    semantic_cache_backend: Literal["none", "memory", "sqlite"] = "none"
+    semantic_cache_path: str = "data/semantic_cache.sqlite"
+    # minimum cosine similarity between two questions for one to be answered with the other's answer
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_max_entries: int = 1024
+    semantic_cache_ttl: float = 3600
+
+    # Budget ##########################################################################################################
+    # per question: rounds of the self-correcting loops (re-generating, re-writing the question), LLM calls and
+    # seconds; when one runs out, the best answer so far is returned, marked as degraded. The deadline also
+    # cancels the node running when it passes
+    budget_max_iterations: int = 3
+    budget_max_llm_calls: int = 24
+    budget_deadline: float = 60
+
+    # Batches #########################################################################################################
+    # /rest/v1/questions:batch: questions answered at once; within a batch, routing and grading calls made within
+    # batch_window seconds of each other are grouped into one LLM call of at most batch_max_group (see batching.py)
+    batch_concurrency: int = 8
+    batch_max_questions: int = 1000
+    batch_window: float = 0.02
+    batch_max_group: int = 16
+
+    # HTTP clients ####################################################################################################
+    # one connection pool shared by the chat models, the embeddings and the web search (see clients.py)
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_timeout: float = 60
+    # budgets the requests to these hosts are scheduled within, questions before batches; a little under the
+    # organization's limits, each of the workers gets an equal share. 0: no limit
+    openai_rate_limited_hosts: list[str] = ["api.openai.com"]
+    openai_requests_per_minute: int = 3500
+    openai_tokens_per_minute: int = 160000
+    # how much of a minute's budget may be spent at once
+    rate_limit_burst_seconds: float = 5
+
+    # LLM memoization #################################################################################################
+    memo_enabled: bool = True
+    memo_max_entries: int = 4096
+    # when set, memoized outputs are also persisted to this SQLite file
+    memo_path: str = ""
+
+    # Offline stand-ins ###############################################################################################
+    # local, deterministic replacements (see fakes.py), for benchmarks and CI without network or API keys
+    llm_backend: Literal["openai", "fake"] = "openai"
+    # "hash" also approximates the splitter's token counts, as tiktoken downloads its encodings on first use
+    embedding_backend: Literal["openai", "hash"] = "openai"
+    web_search_backend: Literal["tavily", "fake"] = "tavily"
+    # seconds per fake LLM call and web search
+    fake_llm_latency: float = 0.05
+    fake_web_search_latency: float = 0.1
+    # share of the fake grades that are 'yes', and of the questions the fake router sends to web search
+    fake_llm_yes_rate: float = 1.0
+    fake_llm_web_search_rate: float = 0.0
+    fake_embedding_dim: int = 256
+
+
+settings = Settings()
@@ -0,0 +1,34 @@
+## Single-flight Coalescing ###########################################################################################
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from metrics import record_cache
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time: callers asking for a key while its call runs wait for that
+    call and share its result, or its exception, instead of making their own. Coalesced callers are
+    counted as hits of the "singleflight" cache named name, the others as misses.
+
+    A call keeps running when the caller that started it is cancelled, as others may be waiting for it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.calls.get(key)
+        record_cache("singleflight", self.name, future is not None)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self.done(key, f))
+        return await asyncio.shield(future)
+
+    def done(self, key: str, future: asyncio.Future):
+        self.calls.pop(key, None)
+        if not future.cancelled():
+            # retrieved, so it is not logged as never retrieved when every caller was cancelled
+            future.exception()
@@ -0,0 +1,91 @@
+## SQLite Cache Tables ################################################################################################
+### Entries by key in a SQLite file, shared by every worker process on the host, with the LRU and TTL bounds of
+### the in-memory caches; the SQLite backends of the web search cache and the semantic cache keep theirs in one.
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+@contextmanager
+def connect(path: str) -> Iterator[sqlite3.Connection]:
+    """A connection to the SQLite file at path, in a transaction committed when the block completes."""
+    conn = sqlite3.connect(path, timeout=5)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class SqliteTable:
+    """
+    A table of rows keyed by text, with the value columns given plus created_at and used_at, which the
+    table keeps. Rows older than ttl seconds are not read, and are dropped on write together with the
+    least recently used rows beyond max_entries.
+
+    Conditions (where, stale) are SQL expressions over the columns, with ? placeholders for their params.
+    """
+
+    def __init__(self, path: str, table: str, columns: list[str], max_entries: int, ttl: float):
+        self.path = path
+        self.table = table
+        self.width = len(columns)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f" key TEXT PRIMARY KEY, {', '.join(columns)}, created_at REAL, used_at REAL)"
+            )
+
+    def get(self, columns: str, where: str, params: tuple) -> tuple | None:
+        """columns of the live row matching where, marked used; None if there is none."""
+        with connect(self.path) as conn:
+            row = conn.execute(
+                f"SELECT key, {columns} FROM {self.table} WHERE {where} AND created_at >= ?",
+                (*params, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._use(conn, row[0])
+        return row[1:]
+
+    def live(self, columns: str, where: str, params: tuple) -> list[tuple]:
+        """columns of every live row matching where, not marked used; see use()."""
+        with connect(self.path) as conn:
+            return conn.execute(
+                f"SELECT {columns} FROM {self.table} WHERE {where} AND created_at >= ?",
+                (*params, time.time() - self.ttl),
+            ).fetchall()
+
+    def use(self, key: str):
+        with connect(self.path) as conn:
+            self._use(conn, key)
+
+    def _use(self, conn: sqlite3.Connection, key: str):
+        conn.execute(f"UPDATE {self.table} SET used_at = ? WHERE key = ?", (time.time(), key))
+
+    def put(self, key: str, values: tuple, stale: str = "", params: tuple = ()):
+        """Writes the row of key, then drops the expired rows, those matching stale, and the least recently used."""
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, {'?, ' * self.width}?, ?)", (key, *values, now, now)
+            )
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?" + (f" OR {stale}" if stale else ""),
+                (now - self.ttl, *params),
+            )
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN"
+                f" (SELECT key FROM {self.table} ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with connect(self.path) as conn:
+            conn.execute(f"DELETE FROM {self.table}")
@@ -0,0 +1,17 @@
+import os
+import sys
+
+# The offline stand-ins (see fakes.py), set before any module reads the settings
+os.environ.update(
+    {
+        "LLM_BACKEND": "fake",
+        "EMBEDDING_BACKEND": "hash",
+        "EMBEDDING_MODEL": "hashing",
+        "WEB_SEARCH_BACKEND": "fake",
+        "FAKE_LLM_LATENCY": "0",
+        "FAKE_WEB_SEARCH_LATENCY": "0",
+        "OPENAI_API_KEY": "unused",
+        "TAVILY_API_KEY": "unused",
+    }
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+import api
+
+
+@asynccontextmanager
+async def serving():
+    """A client of the app, with its lifespan running."""
+    transport = httpx.ASGITransport(app=api.fastapi_app)
+    async with api.lifespan(api.fastapi_app), httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def test_questions_wait_for_the_load_off_the_event_loop(monkeypatch):
+    def load():
+        # builds the index and the chains, blocking
+        time.sleep(0.3)
+
+    async def answer_question(question, trace):
+        return {"question": question, "answer": "answer"}
+
+    monkeypatch.setattr(api.tools, "load", load)
+    monkeypatch.setattr(api, "get_semantic_cache", lambda: None)
+    monkeypatch.setattr(api, "answer_question", answer_question)
+    monkeypatch.setattr(api, "startup", {"ready": False, "error": None, "seconds": None})
+    monkeypatch.setattr(api, "loading", None)
+
+    async def run():
+        async with serving() as client:
+            question = asyncio.ensure_future(client.post("/rest/v1/question", json={"question": "What is an agent?"}))
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            live = await client.get("/health/live")
+            live_seconds = time.perf_counter() - started
+            assert not question.done()
+            return live, live_seconds, await question
+
+    live, live_seconds, answer = asyncio.run(run())
+    assert live.status_code == 200 and live_seconds < 0.2
+    assert answer.status_code == 200 and answer.json()["answer"] == "answer"
+    assert api.startup["ready"]
+
+
+def test_questions_get_503_when_the_load_failed(monkeypatch):
+    def load():
+        raise RuntimeError("no index")
+
+    monkeypatch.setattr(api.tools, "load", load)
+    monkeypatch.setattr(api, "startup", {"ready": False, "error": None, "seconds": None})
+    monkeypatch.setattr(api, "loading", None)
+
+    async def run():
+        async with serving() as client:
+            return await client.post("/rest/v1/question", json={"question": "What is an agent?"})
+
+    response = asyncio.run(run())
+    assert response.status_code == 503
+    assert "no index" in response.json()["message"]
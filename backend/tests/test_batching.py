@@ -0,0 +1,76 @@
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+
+from batching import GroupedStage, counted_calls, grouping
+
+
+def stage(packed_calls: list, single_calls: list, fits: bool = True, max_size: int = 8) -> GroupedStage:
+    def single(input: dict) -> str:
+        single_calls.append(input["q"])
+        return input["q"].upper()
+
+    def packed(input: dict) -> list[str]:
+        packed_calls.append(input["qs"])
+        return [q.upper() for q in input["qs"]]
+
+    return GroupedStage(
+        "test",
+        RunnableLambda(single),
+        RunnableLambda(packed),
+        lambda inputs: {"qs": [i["q"] for i in inputs]},
+        lambda output, count: output if fits and len(output) == count else None,
+        window=0.01,
+        max_size=max_size,
+    )
+
+
+async def question(grouped: GroupedStage, q: str) -> tuple[str, int]:
+    grouping.set(True)
+    with counted_calls() as count:
+        output = await grouped.ainvoke({"q": q})
+    return output, count.calls
+
+
+def ask(grouped: GroupedStage, qs: list[str]) -> list[tuple[str, int]]:
+    async def run():
+        return await asyncio.gather(*(question(grouped, q) for q in qs))
+
+    return asyncio.run(run())
+
+
+def test_calls_within_the_window_are_packed_and_split_in_order():
+    packed, single = [], []
+    r = ask(stage(packed, single), ["a", "b", "c"])
+    assert packed == [["a", "b", "c"]] and not single
+    assert [output for output, _ in r] == ["A", "B", "C"]
+    # the one call is charged to the first question of the group only
+    assert [calls for _, calls in r] == [1, 0, 0]
+
+
+def test_groups_are_cut_at_max_size():
+    packed, single = [], []
+    r = ask(stage(packed, single, max_size=2), ["a", "b", "c", "d", "e"])
+    assert packed == [["a", "b"], ["c", "d"]] and single == ["e"]
+    assert [output for output, _ in r] == ["A", "B", "C", "D", "E"]
+    assert sum(calls for _, calls in r) == 3
+
+
+def test_output_that_does_not_fit_is_run_one_by_one():
+    packed, single = [], []
+    r = ask(stage(packed, single, fits=False), ["a", "b"])
+    assert packed == [["a", "b"]] and sorted(single) == ["a", "b"]
+    assert r == [("A", 2), ("B", 1)]
+
+
+def test_outside_a_batch_it_is_the_chain():
+    packed, single = [], []
+    grouped = stage(packed, single)
+
+    async def run():
+        with counted_calls() as count:
+            output = await grouped.ainvoke({"q": "a"})
+        return output, count.calls
+
+    assert asyncio.run(run()) == ("A", 1)
+    assert not packed and single == ["a"]
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from graph_budget import decide_after_grading, give_up, with_deadline
+from settings import settings
+
+
+def test_node_is_cut_short_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(settings, "budget_deadline", 0.05)
+
+    async def slow(state):
+        await asyncio.sleep(10)
+        return {"generation": "too late"}
+
+    started = time.perf_counter()
+    update = asyncio.run(with_deadline(slow)({"started_at": time.monotonic()}))
+    assert time.perf_counter() - started < 1
+    assert update == {"degraded": "deadline"}
+
+
+def test_node_within_the_deadline(monkeypatch):
+    monkeypatch.setattr(settings, "budget_deadline", 10)
+
+    async def fast(state):
+        await asyncio.sleep(0)
+        return {"generation": "in time"}
+
+    assert asyncio.run(with_deadline(fast)({"started_at": time.monotonic()})) == {"generation": "in time"}
+
+
+def test_own_timeouts_are_not_the_deadline(monkeypatch):
+    monkeypatch.setattr(settings, "budget_deadline", 10)
+
+    async def times_out(state):
+        async with asyncio.timeout(0.01):
+            await asyncio.sleep(1)
+
+    try:
+        asyncio.run(with_deadline(times_out)({"started_at": time.monotonic()}))
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("the node's own timeout was swallowed")
+
+
+def test_degraded_question_skips_nodes_and_gives_up(monkeypatch):
+    monkeypatch.setattr(settings, "budget_deadline", 10)
+    calls = []
+
+    async def node(state):
+        calls.append(state)
+        return {}
+
+    state = {"started_at": time.monotonic(), "degraded": "deadline", "best_generation": "best so far"}
+    assert asyncio.run(with_deadline(node)(state)) == {}
+    assert not calls
+    assert decide_after_grading(state) == "give_up"
+    assert give_up(state) == {"generation": "best so far", "degraded": "deadline"}
+
+
+def test_past_deadline_uses_on_deadline(monkeypatch):
+    monkeypatch.setattr(settings, "budget_deadline", 1)
+
+    async def node(state):
+        raise AssertionError("run past the deadline")
+
+    state = {"started_at": time.monotonic() - 2}
+    assert asyncio.run(with_deadline(node, lambda s: {"verdict": "unchecked"})(state)) == {"verdict": "unchecked"}
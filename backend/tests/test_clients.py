@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from clients import BATCH, INTERACTIVE, RateLimiter, TokenBucket, retry_after
+
+
+def test_token_bucket():
+    bucket = TokenBucket(per_minute=60, burst_seconds=2)
+    assert bucket.capacity == 2
+    now = bucket.updated
+    assert bucket.wait(2, now) == 0
+    bucket.take(2)
+    assert bucket.wait(1, now) == pytest.approx(1.0)
+    # refills at one a second, up to the capacity
+    assert bucket.wait(1, now + 1) == 0
+    assert bucket.wait(5, now + 10) == 0
+    assert bucket.level == 2
+    bucket.clamp(0.5)
+    assert bucket.wait(1, now + 10) == pytest.approx(0.5)
+
+
+def test_no_limit():
+    bucket = TokenBucket(per_minute=0, burst_seconds=1)
+    bucket.take(1000)
+    assert bucket.wait(1000, time.monotonic()) == 0
+
+
+def test_retry_after():
+    assert retry_after(httpx.Response(429, headers={"retry-after-ms": "250"})) == 0.25
+    assert retry_after(httpx.Response(429, headers={"retry-after": "3"})) == 3
+    assert retry_after(httpx.Response(429, headers={"retry-after": "soon"}), default=1.5) == 1.5
+
+
+def test_429_pauses_every_request():
+    limiter = RateLimiter("test", 6000, 0, 1)
+    now = time.monotonic()
+    assert limiter.wait(0, now) == 0
+    limiter.observe(httpx.Response(429, headers={"retry-after": "2"}))
+    assert limiter.wait(0, now) == pytest.approx(2, abs=0.1)
+    # a shorter pause does not cut the longer one short
+    limiter.observe(httpx.Response(429, headers={"retry-after": "1"}))
+    assert limiter.wait(0, now) == pytest.approx(2, abs=0.1)
+
+
+def test_remaining_headers_clamp_the_buckets():
+    limiter = RateLimiter("test", 600, 60000, 1)
+    limiter.observe(httpx.Response(200, headers={"x-ratelimit-remaining-requests": "0"}))
+    assert limiter.wait(0, time.monotonic()) > 0
+
+
+def test_interactive_overtakes_batch():
+    async def run():
+        # one request every 20ms, the first goes right away
+        limiter = RateLimiter("test", 3000, 0, 0.02)
+        order = []
+
+        async def request(name: str, prio: int):
+            await limiter.acquire(0, prio)
+            order.append(name)
+
+        await limiter.acquire(0)
+        tasks = [asyncio.ensure_future(request(f"batch{i}", BATCH)) for i in range(2)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(request("interactive", INTERACTIVE)))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "batch0", "batch1"]
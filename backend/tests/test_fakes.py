@@ -0,0 +1,54 @@
+import asyncio
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+from pydantic import BaseModel
+
+from fakes import FakeChatModel, HashingEmbeddings, build_fake_web_search
+
+
+class Grade(BaseModel):
+    binary_score: str
+
+
+class Grades(BaseModel):
+    binary_scores: list[str]
+
+
+def test_same_prompt_same_answer_streamed_or_not():
+    model = FakeChatModel(latency=0)
+    answer = model.invoke([HumanMessage(content="What is agent memory?")])
+    assert answer.content == model.invoke([HumanMessage(content="What is agent memory?")]).content
+    assert answer.content != model.invoke([HumanMessage(content="What is planning?")]).content
+    assert len(answer.content.split()) == model.answer_words
+    streamed = "".join(chunk.content for chunk in model.stream([HumanMessage(content="What is agent memory?")]))
+    assert streamed == answer.content
+
+
+def test_structured_outputs_follow_the_rates():
+    prompts = [f"Is document {i} relevant?" for i in range(400)]
+    half = FakeChatModel(latency=0, yes_rate=0.5).with_structured_output(Grade)
+    grades = [half.invoke(prompt).binary_score for prompt in prompts]
+    assert 0.4 < grades.count("yes") / len(grades) < 0.6
+    assert grades == [half.invoke(prompt).binary_score for prompt in prompts]
+
+    numbered = "\n\n".join(f"Document {i + 1}: text" for i in range(5))
+    assert len(FakeChatModel(latency=0).with_structured_output(Grades).invoke(numbered).binary_scores) == 5
+
+
+def test_hashing_embeddings_are_unit_length_and_share_words():
+    embeddings = HashingEmbeddings(256)
+    memory, memory_again, planning = np.array(
+        embeddings.embed_documents(["agent memory types", "types of agent memory", "task planning steps"])
+    )
+    assert np.allclose(np.linalg.norm([memory, planning], axis=1), 1)
+    assert memory @ memory_again > memory @ planning
+    assert embeddings.embed_query("agent memory types") == memory.tolist()
+
+
+def test_fake_web_search_is_deterministic():
+    search = build_fake_web_search(0, k=3)
+    results = asyncio.run(search.ainvoke({"query": "agent memory"}))
+    assert len(results) == 3 and results[0]["content"].startswith("Result 1 for agent memory: ")
+    assert results == asyncio.run(search.ainvoke({"query": "agent memory"}))
+    assert results != asyncio.run(search.ainvoke({"query": "planning"}))
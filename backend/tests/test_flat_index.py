@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from fakes import HashingEmbeddings
+from flat_index import FlatVectorStore
+
+TEXTS = [
+    "agents keep short-term memory in their context",
+    "long-term memory of agents lives in a vector store",
+    "prompt engineering steers a model without training",
+    "jailbreaks and prompt injection attack language models",
+    "planning breaks a task into subgoals",
+]
+
+
+def store(tmp_path) -> FlatVectorStore:
+    return FlatVectorStore.from_texts(TEXTS, HashingEmbeddings(64), path=str(tmp_path), ids=list("abcde"))
+
+
+def test_async_search_is_the_sync_one(tmp_path):
+    flat = FlatVectorStore(store(tmp_path).path, HashingEmbeddings(64))
+    for query in ("memory of agents", "prompt attacks", "subgoals"):
+        found = flat.similarity_search_with_score(query, 3)
+        assert asyncio.run(flat.asimilarity_search_with_score(query, k=3)) == found
+        assert [d.id for d in asyncio.run(flat.asimilarity_search(query, 3))] == [d.id for d, _ in found]
+
+
+def test_async_search_runs_off_the_loop(tmp_path):
+    flat = store(tmp_path)
+    threads = []
+    search_by_vectors = flat.search_by_vectors
+
+    def recording(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return search_by_vectors(*args, **kwargs)
+
+    flat.search_by_vectors = recording
+    asyncio.run(flat.asimilarity_search("memory", 2))
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_max_marginal_relevance(tmp_path):
+    flat = store(tmp_path)
+    picked = flat.max_marginal_relevance_search("memory of agents", k=2, fetch_k=5)
+    assert len({d.id for d in picked}) == 2
+    assert picked[0].id == flat.similarity_search("memory of agents", 1)[0].id
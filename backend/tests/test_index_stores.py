@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from index_stores import build_cached_embeddings, embedding_namespace
+from settings import settings
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "embedding_cache_dir", str(tmp_path))
+    return tmp_path
+
+
+def test_namespace_tells_backends_apart(monkeypatch):
+    monkeypatch.setattr(settings, "embedding_model", "text-embedding-3-small")
+    monkeypatch.setattr(settings, "embedding_backend", "openai")
+    openai = embedding_namespace()
+    monkeypatch.setattr(settings, "embedding_backend", "hash")
+    hashed = embedding_namespace()
+    monkeypatch.setattr(settings, "fake_embedding_dim", 64)
+    assert len({openai, hashed, embedding_namespace()}) == 3
+
+
+def test_cached_under_the_namespace(cache_dir):
+    embeddings = build_cached_embeddings()
+    first = embeddings.embed_documents(["agent memory", "prompt engineering"])
+    assert first == embeddings.embed_documents(["agent memory", "prompt engineering"])
+    files = [f for _, _, names in os.walk(cache_dir) for f in names]
+    assert len(files) == 2
+    assert all(f.startswith(embedding_namespace()) for f in files)
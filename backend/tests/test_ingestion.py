@@ -0,0 +1,85 @@
+import threading
+import time
+
+from langchain_core.documents import Document
+
+import index_sources
+from index_manifest import load_manifest
+from index_sources import fetch_sources
+from index_stores import BatchWriter, open_vectorstore
+from indexing import build_index
+from settings import settings
+
+
+def test_fetches_are_bounded_and_all_handed_out(monkeypatch):
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def load_source(source):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        if source == "broken":
+            raise OSError("unreachable")
+        return [Document(page_content=source)]
+
+    monkeypatch.setattr(index_sources, "load_source", load_source)
+    sources = [f"s{i}" for i in range(20)] + ["broken"]
+    fetched = dict(fetch_sources(sources, 3))
+    assert set(fetched) == set(sources) and fetched["broken"] is None
+    assert fetched["s7"] == [Document(page_content="s7")]
+    assert 1 < peak[0] <= 3
+
+
+class RecordingStore:
+    """A vectorstore recording the batches added to it, slowly, like an embedding API would."""
+
+    def __init__(self):
+        self.batches = []
+
+    def add_documents(self, docs, ids=None):
+        time.sleep(0.005)
+        self.batches.append(list(ids))
+
+    def delete(self, ids=None):
+        pass
+
+
+def test_writer_inserts_fixed_size_batches_in_order():
+    store = RecordingStore()
+    writer = BatchWriter(store, batch_size=4, max_pending_batches=2)
+    for i in range(0, 30, 3):
+        writer.add([str(j) for j in range(i, i + 3)], [Document(page_content=str(j)) for j in range(i, i + 3)])
+        # the producer waits for the writer rather than queueing everything
+        assert writer.queue.qsize() <= 2 and len(writer._ids) < 4
+    writer.close()
+    assert [len(batch) for batch in store.batches] == [4] * 7 + [2]
+    assert [i for batch in store.batches for i in batch] == [str(i) for i in range(30)]
+
+
+def test_local_directory_is_indexed_and_refreshed(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "index_batch_size", 3)
+    monkeypatch.setattr(settings, "index_max_pending_batches", 1)
+    monkeypatch.setattr(settings, "vector_backend", "flat")
+    corpus = tmp_path / "corpus"
+    (corpus / "sub").mkdir(parents=True)
+    for i in range(6):
+        (corpus / ("sub" if i % 2 else "") / f"doc{i}.txt").write_text(f"Document {i} is about agent memory.")
+    (corpus / "skipped.bin").write_text("not a document")
+
+    index_dir = str(tmp_path / "index")
+    first = build_index(index_dir, [str(corpus)])
+    assert len(first.sources) == 6
+    assert len(open_vectorstore(index_dir, build=first.build).get(include=[])["ids"]) == 6
+
+    (corpus / "doc0.txt").write_text("Document 0 is now about planning.")
+    (corpus / "sub" / "doc1.txt").unlink()
+    second = build_index(index_dir, [str(corpus)])
+    assert load_manifest(index_dir).version == second.version != first.version
+    assert len(second.sources) == 5
+    texts = open_vectorstore(index_dir, build=second.build).get()["documents"]
+    assert sorted(texts)[0] == "Document 0 is now about planning."
+    assert len(texts) == 5
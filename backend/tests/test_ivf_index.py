@@ -0,0 +1,68 @@
+import numpy as np
+
+from flat_index import FlatVectorStore, normalize_rows
+from ivf_index import IVFVectorStore
+
+
+def clustered(n: int, dim: int = 32, clusters: int = 16, seed: int = 0) -> np.ndarray:
+    rnd = np.random.default_rng(seed)
+    centers = rnd.normal(size=(clusters, dim))
+    return normalize_rows(centers[rnd.integers(clusters, size=n)] + 0.3 * rnd.normal(size=(n, dim)))
+
+
+def add(store, vectors: np.ndarray, start: int = 0):
+    ids = [str(start + i) for i in range(len(vectors))]
+    store.add_vectors(ids, [f"text {i}" for i in ids], [{} for _ in ids], vectors)
+
+
+def nearest_ids(store, queries: np.ndarray, k: int) -> list[set[str]]:
+    return [{store.ids[row] for row in rows} for rows, _ in store.search_rows(queries, k)]
+
+
+def recall(store, exact, queries: np.ndarray, k: int = 10) -> float:
+    found = nearest_ids(store, queries, k)
+    wanted = nearest_ids(exact, queries, k)
+    return float(np.mean([len(f & w) / k for f, w in zip(found, wanted)]))
+
+
+def test_recall_after_add_and_delete(tmp_path):
+    ivf = IVFVectorStore(str(tmp_path / "ivf"), None, nlist=16, nprobe=4)
+    flat = FlatVectorStore(str(tmp_path / "flat"), None)
+    vectors = clustered(3000)
+    for store in (ivf, flat):
+        add(store, vectors[:2000])
+    ivf.persist()
+
+    # changes to a trained store, searched before they are persisted
+    deleted = [str(i) for i in range(0, 2000, 3)]
+    for store in (ivf, flat):
+        add(store, vectors[2000:], start=2000)
+        store.delete(deleted)
+
+    queries = clustered(50, seed=1)
+    assert recall(ivf, flat, queries) >= 0.9
+    found = set().union(*nearest_ids(ivf, queries, 10))
+    assert not found.intersection(deleted)
+    assert any(int(i) >= 2000 for i in found)
+
+
+def test_added_vectors_are_found_before_persist(tmp_path):
+    ivf = IVFVectorStore(str(tmp_path / "ivf"), None, nlist=8, nprobe=1)
+    vectors = clustered(500)
+    add(ivf, vectors[:400])
+    ivf.persist()
+    add(ivf, vectors[400:], start=400)
+    for j in range(400, 500, 10):
+        rows, scores = ivf.search_rows(vectors[j : j + 1], 1)[0]
+        assert ivf.ids[rows[0]] == str(j)
+        assert scores[0] > 0.999
+
+
+def test_nprobe_nlist_is_exact(tmp_path):
+    ivf = IVFVectorStore(str(tmp_path / "ivf"), None, nlist=8, nprobe=8)
+    flat = FlatVectorStore(str(tmp_path / "flat"), None)
+    vectors = clustered(800)
+    for store in (ivf, flat):
+        add(store, vectors)
+    ivf.persist()
+    assert recall(ivf, flat, clustered(20, seed=2)) == 1.0
@@ -0,0 +1,43 @@
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+
+from memo import MemoizedRunnable, MemoStore, bypassed
+
+
+def counting():
+    calls = []
+
+    def model(prompt: str) -> str:
+        calls.append(prompt)
+        return f"answer {len(calls)}"
+
+    return RunnableLambda(model), calls
+
+
+def test_memoized_until_bypassed():
+    model, calls = counting()
+    memoized = MemoizedRunnable(model, "chain", "model", MemoStore(16))
+    assert memoized.invoke("prompt") == "answer 1"
+    assert memoized.invoke("  prompt ") == "answer 1"
+    with bypassed():
+        assert memoized.invoke("prompt") == "answer 2"
+    # the fresh output replaced the rejected one
+    assert memoized.invoke("prompt") == "answer 2"
+    assert len(calls) == 2
+
+
+def test_bypass_async():
+    model, calls = counting()
+    memoized = MemoizedRunnable(model, "chain", "model", MemoStore(16))
+
+    async def run():
+        first = await memoized.ainvoke("prompt")
+        with bypassed(False):
+            again = await memoized.ainvoke("prompt")
+        with bypassed(True):
+            fresh = await memoized.ainvoke("prompt")
+        return first, again, fresh
+
+    assert asyncio.run(run()) == ("answer 1", "answer 1", "answer 2")
+    assert len(calls) == 2
@@ -0,0 +1,79 @@
+import asyncio
+from uuid import uuid4
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+import metrics
+from metrics import Counter, Gauge, Histogram, RequestTrace, TraceHandler, render_metrics
+
+NODES = {"generate", "grade_generation", "transform_query"}
+
+
+def test_metrics_render_in_the_prometheus_text_format(monkeypatch):
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    calls = Counter("test_calls_total", "Calls", ("chain",))
+    depth = Gauge("test_depth", "Depth")
+    seconds = Histogram("test_seconds", "Seconds", ("node",), buckets=(0.1, 1.0))
+    calls.inc(chain="a")
+    calls.inc(2, chain='say "hi"')
+    depth.set(3)
+    seconds.observe(0.5, node="generate")
+    seconds.observe(2.0, node="generate")
+
+    assert render_metrics().splitlines() == [
+        "# HELP test_calls_total Calls",
+        "# TYPE test_calls_total counter",
+        'test_calls_total{chain="a"} 1',
+        'test_calls_total{chain="say \\"hi\\""} 2',
+        "# HELP test_depth Depth",
+        "# TYPE test_depth gauge",
+        "test_depth 3",
+        "# HELP test_seconds Seconds",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{node="generate",le="0.1"} 0',
+        'test_seconds_bucket{node="generate",le="1.0"} 1',
+        'test_seconds_bucket{node="generate",le="+Inf"} 2',
+        'test_seconds_sum{node="generate"} 2.5',
+        'test_seconds_count{node="generate"} 2',
+    ]
+
+
+def run_node(handler: TraceHandler, name: str, state: dict):
+    run_id = uuid4()
+    asyncio.run(handler.on_chain_start({}, state, run_id=run_id, name=name))
+    asyncio.run(handler.on_chain_end({}, run_id=run_id))
+
+
+def test_one_iteration_per_retry_edge():
+    trace = RequestTrace()
+    handler = TraceHandler(trace, NODES)
+    run_node(handler, "generate", {})
+    run_node(handler, "grade_generation", {})
+    # not supported: generated again
+    run_node(handler, "generate", {"verdict": "not supported"})
+    # not useful: the question is re-written, and then generated from, which is the same round
+    run_node(handler, "transform_query", {"verdict": "not useful"})
+    run_node(handler, "generate", {"verdict": "not useful"})
+    run_node(handler, "retrieve", {})
+
+    assert trace.iterations == 2
+    assert [node for node, _ in trace.nodes] == [
+        "generate", "grade_generation", "generate", "transform_query", "generate"
+    ]
+
+
+def test_llm_calls_and_tokens_are_counted_per_chain():
+    trace = RequestTrace()
+    handler = TraceHandler(trace, NODES)
+    calls_before = metrics.llm_calls_total.values.get(("rag_chain",), 0)
+    run_id = uuid4()
+    message = AIMessage(
+        content="answer", usage_metadata={"input_tokens": 120, "output_tokens": 30, "total_tokens": 150}
+    )
+    asyncio.run(handler.on_chat_model_start({}, [[]], run_id=run_id, metadata={"chain": "rag_chain"}))
+    asyncio.run(handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=run_id))
+
+    assert trace.summary()["llm_calls"] == 1
+    assert (trace.prompt_tokens, trace.completion_tokens) == (120, 30)
+    assert metrics.llm_calls_total.values[("rag_chain",)] == calls_before + 1
@@ -0,0 +1,47 @@
+from langchain_core.documents import Document
+
+from packing import SEPARATOR, count_tokens, pack_context
+
+
+def doc(text: str) -> Document:
+    return Document(page_content=text)
+
+
+AGENT = "agent memory is where an agent keeps what it observed and what it planned for later steps"
+PROMPT = "prompt engineering steers a model with instructions and examples instead of new weights"
+ATTACK = "adversarial attacks on language models craft inputs that make the model misbehave"
+
+
+def test_within_budget():
+    documents = [doc(AGENT), doc(PROMPT), doc(ATTACK)]
+    for budget in (10, 30, 50, 1000):
+        context = pack_context("agent memory", documents, budget)
+        assert count_tokens(context) <= budget
+
+
+def test_everything_fits():
+    context = pack_context("agent memory", [doc(AGENT), doc(PROMPT)], 1000)
+    assert context.split(SEPARATOR) == [AGENT, PROMPT]
+
+
+def test_near_duplicates_are_dropped():
+    near = AGENT + " too"
+    context = pack_context("agent memory", [doc(AGENT), doc(near), doc(AGENT), doc(PROMPT)], 1000)
+    assert context.split(SEPARATOR) == [AGENT, PROMPT]
+
+
+def test_smaller_document_fills_the_rest():
+    long = " ".join([PROMPT] * 4)
+    budget = count_tokens(AGENT) + count_tokens(SEPARATOR) + count_tokens(ATTACK)
+    context = pack_context("agent memory", [doc(AGENT), doc(long), doc(ATTACK)], budget)
+    assert context.split(SEPARATOR) == [AGENT, ATTACK]
+
+
+def test_most_relevant_is_cut_to_fit():
+    context = pack_context("agent memory", [doc(AGENT), doc(PROMPT)], 5)
+    assert AGENT.startswith(context)
+    assert count_tokens(context) <= 5
+
+
+def test_nothing_to_pack():
+    assert pack_context("agent memory", [], 100) == ""
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+import tools
+from graph_grading import grade_documents, rerank
+from rerank import LexicalReranker
+from settings import settings
+
+QUESTION = "What types of agent memory exist?"
+DOCUMENTS = [
+    Document(page_content="Prompt engineering without weight updates."),  # no question term: 0
+    Document(page_content="Agent memory types that exist: short-term and long-term."),  # 4 of 4: 1
+    Document(page_content="An agent plans its steps."),  # 1 of 4: 0.25
+    Document(page_content="Short-term memory is the context window."),  # 1 of 4: 0.25
+]
+
+
+class RecordingGrader:
+    """The retrieval grader, answering "yes" to every document it is asked about."""
+
+    def __init__(self):
+        self.graded = []
+
+    async def abatch(self, inputs, config=None):
+        self.graded.extend(i["document"] for i in inputs)
+        return [SimpleNamespace(binary_score="yes") for _ in inputs]
+
+
+def test_lexical_scores_are_the_share_of_question_terms():
+    scores = LexicalReranker().score(QUESTION, DOCUMENTS)
+    assert scores == [0.0, 1.0, 0.25, 0.25]
+    assert LexicalReranker().score("what is the", DOCUMENTS) == [0.0] * len(DOCUMENTS)
+
+
+def test_rerank_orders_and_drops_below_reject(monkeypatch):
+    monkeypatch.setattr(tools, "reranker", LexicalReranker(), raising=False)
+    monkeypatch.setattr(settings, "rerank_reject", 0.2)
+    r = asyncio.run(rerank({"question": QUESTION, "documents": DOCUMENTS}))
+    assert [d.page_content for d in r["documents"]] == [DOCUMENTS[i].page_content for i in (1, 2, 3)]
+    assert r["scores"] == [1.0, 0.25, 0.25]
+
+
+def test_only_borderline_documents_are_graded_by_the_llm(monkeypatch):
+    grader = RecordingGrader()
+    monkeypatch.setattr(tools, "retrieval_grader", grader, raising=False)
+    monkeypatch.setattr(settings, "grade_mode", "per_document")
+    monkeypatch.setattr(settings, "rerank_accept", 0.6)
+    documents = [DOCUMENTS[i] for i in (1, 2, 3)]
+    state = {"question": QUESTION, "documents": documents, "scores": [1.0, 0.25, 0.25], "llm_calls": 0}
+    r = asyncio.run(grade_documents(state))
+    assert grader.graded == [DOCUMENTS[2].page_content, DOCUMENTS[3].page_content]
+    assert r["documents"] == documents and r["llm_calls"] == 2
+
+
+def test_without_scores_every_document_is_graded(monkeypatch):
+    grader = RecordingGrader()
+    monkeypatch.setattr(tools, "retrieval_grader", grader, raising=False)
+    monkeypatch.setattr(settings, "grade_mode", "per_document")
+    r = asyncio.run(grade_documents({"question": QUESTION, "documents": DOCUMENTS, "llm_calls": 0}))
+    assert len(grader.graded) == len(DOCUMENTS) and r["llm_calls"] == len(DOCUMENTS)
+
+
+class OneCallGrader:
+    """The single-call grader, returning the grades it was given for the documents of one question."""
+
+    def __init__(self, grades):
+        self.grades = grades
+        self.prompts = []
+
+    async def ainvoke(self, input, config=None):
+        self.prompts.append(input["documents"])
+        return SimpleNamespace(binary_scores=self.grades)
+
+
+def test_single_call_grades_all_documents_at_once(monkeypatch):
+    grader, fallback = OneCallGrader(["no", " Yes ", "no", "yes"]), RecordingGrader()
+    monkeypatch.setattr(tools, "batch_retrieval_grader", grader, raising=False)
+    monkeypatch.setattr(tools, "retrieval_grader", fallback, raising=False)
+    monkeypatch.setattr(settings, "grade_mode", "single_call")
+    r = asyncio.run(grade_documents({"question": QUESTION, "documents": DOCUMENTS, "llm_calls": 0}))
+    assert len(grader.prompts) == 1 and "Document 4:" in grader.prompts[0] and not fallback.graded
+    assert r["documents"] == [DOCUMENTS[1], DOCUMENTS[3]] and r["llm_calls"] == 1
+
+
+def test_single_call_with_a_grade_missing_grades_one_by_one(monkeypatch):
+    fallback = RecordingGrader()
+    monkeypatch.setattr(tools, "batch_retrieval_grader", OneCallGrader(["yes"]), raising=False)
+    monkeypatch.setattr(tools, "retrieval_grader", fallback, raising=False)
+    monkeypatch.setattr(settings, "grade_mode", "single_call")
+    r = asyncio.run(grade_documents({"question": QUESTION, "documents": DOCUMENTS, "llm_calls": 0}))
+    assert len(fallback.graded) == len(DOCUMENTS)
+    assert r["documents"] == DOCUMENTS and r["llm_calls"] == 1 + len(DOCUMENTS)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from bm25 import ARRAYS, BM25Index
+from retrieval import reciprocal_rank_fusion
+
+CHUNKS = [
+    "Agents use short-term memory in their context and long-term memory in a vector store.",
+    "Prompt engineering steers a model without updating its weights.",
+    "Adversarial attacks on language models include jailbreaks and prompt injection.",
+    "Planning breaks a task into subgoals; reflection lets the agent learn from its mistakes.",
+    "",
+]
+
+
+def docs(*texts: str) -> list[Document]:
+    return [Document(page_content=t) for t in texts]
+
+
+def texts(documents: list[Document]) -> list[str]:
+    return [d.page_content for d in documents]
+
+
+def test_documents_in_both_rankings_come_first():
+    fused = reciprocal_rank_fusion([docs("a", "b", "c"), docs("d", "c", "b")], 4)
+    # b: 1/62 + 1/63, c: 1/63 + 1/62, then a and d at 1/61 each
+    assert set(texts(fused[:2])) == {"b", "c"}
+    assert set(texts(fused[2:])) == {"a", "d"}
+
+
+def test_ranks_not_scores_decide():
+    fused = reciprocal_rank_fusion([docs("a", "b"), docs("a", "c"), docs("b")], 3)
+    assert texts(fused) == ["a", "b", "c"]
+
+
+def test_k_and_duplicates():
+    fused = reciprocal_rank_fusion([docs("a", "b", "c"), docs("a")], 2)
+    assert texts(fused) == ["a", "b"]
+    assert texts(reciprocal_rank_fusion([docs("a", "a", "b")], 5)) == ["a", "b"]
+
+
+def test_first_copy_of_a_document_is_kept():
+    first = Document(page_content="a", metadata={"source": "vector"})
+    fused = reciprocal_rank_fusion([[first], [Document(page_content="a", metadata={"source": "bm25"})]], 1)
+    assert fused[0].metadata["source"] == "vector"
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 10])
+def test_streamed_keyword_index_is_the_built_one(tmp_path, batch_size):
+    documents = [Document(id=f"c{i}", page_content=t, metadata={"n": i}) for i, t in enumerate(CHUNKS)]
+    built = BM25Index.build([d.id for d in documents], documents)
+    batches = (documents[i : i + batch_size] for i in range(0, len(documents), batch_size))
+    BM25Index.write(str(tmp_path), batches)
+    written = BM25Index.load(str(tmp_path))
+
+    assert list(written.ids) == list(built.ids) and list(written.terms) == list(built.terms)
+    assert list(written.texts) == CHUNKS and list(written.metadatas) == [d.metadata for d in documents]
+    for name in ARRAYS:
+        assert np.array_equal(getattr(written, name), getattr(built, name)), name
+    hits = written.search("agent memory", 2)
+    assert [d.id for d, _ in hits] == [d.id for d, _ in built.search("agent memory", 2)]
+    assert hits[0][0].id == "c0"
+
+
+def test_empty_keyword_index(tmp_path):
+    BM25Index.write(str(tmp_path), [])
+    assert len(BM25Index.load(str(tmp_path))) == 0
+    assert not BM25Index.load(str(tmp_path)).search("agent", 3)
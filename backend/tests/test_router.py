@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+import tools
+from graph_routing import choose_datasource
+from index_derived import unit_vector
+from index_stores import build_embeddings
+from metrics import router_fast_path_rate
+from router import LocalRouter, build_local_router
+from settings import settings
+
+
+class CountingEmbeddings:
+    """build_embeddings(), counting the questions embedded."""
+
+    def __init__(self):
+        self.embeddings = build_embeddings()
+        self.queries = 0
+
+    async def aembed_query(self, text: str) -> list[float]:
+        self.queries += 1
+        return await self.embeddings.aembed_query(text)
+
+
+def examples(*questions: str) -> np.ndarray:
+    return np.stack([unit_vector(build_embeddings().embed_query(q)) for q in questions])
+
+
+def build_router(margin: float = 0.05) -> LocalRouter:
+    return LocalRouter(
+        CountingEmbeddings(),
+        {
+            "vectorstore": examples("What are the types of agent memory?", "What is chain of thought prompting?"),
+            "web_search": examples("Who won the game last night?", "What is the weather forecast for tomorrow?"),
+        },
+        margin,
+    )
+
+
+def test_questions_go_to_the_datasource_of_the_nearest_example():
+    router = build_router()
+    assert asyncio.run(router.route("What are the types of agent memory?")) == "vectorstore"
+    assert asyncio.run(router.route("Who won the game last night?")) == "web_search"
+    assert router.stats() == {"local": 2, "fallback": 0, "fast_path_rate": 1.0}
+
+
+def test_close_calls_fall_back_to_the_llm():
+    # no example is closer than the other by 2
+    router = build_router(margin=2.0)
+    assert asyncio.run(router.route("What are the types of agent memory?")) is None
+    assert asyncio.run(router.route("Who won the game last night?")) is None
+    router.local = 1
+    assert asyncio.run(router.route("anything")) is None
+    assert router.stats()["fast_path_rate"] == 0.25
+    assert router_fast_path_rate.values[()] == 0.25
+
+
+def test_an_embedding_computed_already_is_reused():
+    router = build_router()
+    embedding = unit_vector(build_embeddings().embed_query("What are the types of agent memory?"))
+    assert asyncio.run(router.route("What are the types of agent memory?", embedding)) == "vectorstore"
+    assert router.embeddings.queries == 0
+    asyncio.run(router.route("What are the types of agent memory?"))
+    assert router.embeddings.queries == 1
+
+
+def test_both_datasources_are_scored_against_example_questions(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "router_mode", "local")
+    monkeypatch.setattr(settings, "embedding_cache_dir", str(tmp_path))
+    router = build_local_router()
+    assert len(router.examples["vectorstore"]) == len(settings.router_vectorstore_examples)
+    assert len(router.examples["web_search"]) == len(settings.router_web_search_examples)
+    for question in settings.router_vectorstore_examples:
+        assert asyncio.run(router.route(question)) == "vectorstore"
+    for question in settings.router_web_search_examples:
+        assert asyncio.run(router.route(question)) == "web_search"
+
+
+class ScriptedRouter:
+    """The LLM question router, answering datasource to every question."""
+
+    def __init__(self, datasource: str):
+        self.datasource = datasource
+
+    async def ainvoke(self, input, config=None):
+        return SimpleNamespace(datasource=self.datasource)
+
+
+def test_llm_routes_anything_but_the_vectorstore_to_web_search(monkeypatch):
+    monkeypatch.setattr(tools, "local_router", None, raising=False)
+    routes = {}
+    for datasource in ("vectorstore", "web_search", "wikipedia"):
+        monkeypatch.setattr(tools, "question_router", ScriptedRouter(datasource), raising=False)
+        routes[datasource] = asyncio.run(choose_datasource("What is agent memory?"))
+    assert routes == {"vectorstore": ("vectorstore", 1), "web_search": ("web_search", 1), "wikipedia": ("web_search", 1)}
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from search_cache import InMemorySearchCacheBackend, SqliteSearchCacheBackend
+
+RESULTS = [{"url": "https://example.com/1", "content": "agent memory"}]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend_of(request, tmp_path):
+    def build(ttl: float = 60, max_entries: int = 8):
+        if request.param == "sqlite":
+            return SqliteSearchCacheBackend(str(tmp_path / "search.sqlite"), max_entries, ttl)
+        return InMemorySearchCacheBackend(max_entries, ttl)
+
+    return build
+
+
+def test_put_get_clear(backend_of):
+    backend = backend_of()
+    backend.put("agent memory", RESULTS)
+    assert backend.get("agent memory") == RESULTS
+    assert backend.get("prompt engineering") is None
+    backend.clear()
+    assert backend.get("agent memory") is None
+
+
+def test_least_recently_used_is_dropped(backend_of):
+    backend = backend_of(max_entries=2)
+    backend.put("a", RESULTS)
+    time.sleep(0.01)
+    backend.put("b", RESULTS)
+    time.sleep(0.01)
+    assert backend.get("a") == RESULTS
+    time.sleep(0.01)
+    backend.put("c", RESULTS)
+    assert backend.get("b") is None
+    assert backend.get("a") == RESULTS and backend.get("c") == RESULTS
+
+
+def test_expired_entries_miss(backend_of):
+    backend = backend_of(ttl=0.05)
+    backend.put("a", RESULTS)
+    time.sleep(0.1)
+    assert backend.get("a") is None
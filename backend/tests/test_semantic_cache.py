@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+import pytest
+
+from semantic_cache import InMemorySemanticCacheBackend, SqliteSemanticCacheBackend, normalize_question
+
+
+def unit(*values: float) -> np.ndarray:
+    v = np.array(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend_of(request, tmp_path):
+    def build(ttl: float = 60, max_entries: int = 8):
+        if request.param == "sqlite":
+            return SqliteSemanticCacheBackend(str(tmp_path / "cache.sqlite"), max_entries, ttl)
+        return InMemorySemanticCacheBackend(max_entries, ttl)
+
+    return build
+
+
+def put(backend, question: str, embedding: np.ndarray, version: str = "v1"):
+    backend.put(normalize_question(question), question, f"answer to {question}", embedding, version)
+
+
+def test_exact_and_similar(backend_of):
+    backend = backend_of()
+    put(backend, "What is agent memory?", unit(1, 0, 0))
+    assert backend.get(normalize_question("what is  agent memory?"), "v1").answer == "answer to What is agent memory?"
+    hit = backend.search(unit(1, 0.1, 0), 0.95, "v1")
+    assert hit.question == "What is agent memory?"
+    assert hit.similarity == pytest.approx(float(unit(1, 0.1, 0)[0]), abs=1e-6)
+    assert backend.search(unit(0, 1, 0), 0.95, "v1") is None
+
+
+def test_other_version_misses(backend_of):
+    backend = backend_of()
+    put(backend, "What is agent memory?", unit(1, 0, 0), "v1")
+    assert backend.get(normalize_question("What is agent memory?"), "v2") is None
+    assert backend.search(unit(1, 0, 0), 0.95, "v2") is None
+
+
+def test_expired_misses(backend_of):
+    backend = backend_of(ttl=0.05)
+    put(backend, "What is agent memory?", unit(1, 0, 0))
+    assert backend.search(unit(1, 0, 0), 0.95, "v1") is not None
+    time.sleep(0.1)
+    assert backend.get(normalize_question("What is agent memory?"), "v1") is None
+    assert backend.search(unit(1, 0, 0), 0.95, "v1") is None
+
+
+def test_least_recently_used_is_evicted(backend_of):
+    backend = backend_of(max_entries=2)
+    put(backend, "a", unit(1, 0, 0))
+    put(backend, "b", unit(0, 1, 0))
+    time.sleep(0.01)
+    assert backend.get("a", "v1") is not None
+    time.sleep(0.01)
+    put(backend, "c", unit(0, 0, 1))
+    assert backend.get("a", "v1") is not None
+    assert backend.get("b", "v1") is None
+    assert backend.get("c", "v1") is not None
+
+
+def test_stale_rows_do_not_hide_a_match(backend_of):
+    backend = backend_of()
+    put(backend, "What is agent memory?", unit(1, 0, 0), "v1")
+    put(backend, "What is an agent's memory?", unit(1, 0.2, 0), "v2")
+    # the v1 row is the more similar one, but of another version
+    hit = backend.search(unit(1, 0, 0), 0.95, "v2")
+    assert hit is not None and hit.question == "What is an agent's memory?"
+
+
+def test_expired_rows_do_not_hide_a_match():
+    backend = InMemorySemanticCacheBackend(8, 0.05)
+    put(backend, "What is agent memory?", unit(1, 0, 0))
+    backend.ttl = 60
+    put(backend, "What is an agent's memory?", unit(1, 0.2, 0))
+    time.sleep(0.1)
+    hit = backend.search(unit(1, 0, 0), 0.95, "v1")
+    assert hit is not None and hit.question == "What is an agent's memory?"
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from columns import StringColumn
+from index_stores import open_vectorstore
+from indexing import build_index, open_index
+from settings import settings
+
+
+@pytest.fixture
+def corpus(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "vector_backend", "flat")
+    monkeypatch.setattr(settings, "retrieval_mode", "vector")
+    monkeypatch.setattr(settings, "retrieval_k", 1)
+    path = tmp_path / "corpus"
+    path.mkdir()
+    (path / "memory.txt").write_text("Agents keep short-term memory in their context window.")
+    (path / "planning.txt").write_text("Planning breaks a task into subgoals.")
+    return path
+
+
+def test_opened_build_is_memory_mapped_read_only(corpus, tmp_path):
+    index_dir = str(tmp_path / "index")
+    manifest = build_index(index_dir, [str(corpus)])
+    store = open_vectorstore(index_dir, build=manifest.build)
+    assert isinstance(store.matrix, np.memmap) and not store.matrix.flags.writeable
+    assert isinstance(store.texts, StringColumn) and isinstance(store.texts.blob, np.memmap)
+    assert sorted(store.texts) == sorted(p.read_text() for p in corpus.iterdir())
+
+
+def test_queries_switch_to_a_published_build_as_a_whole(corpus, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "index_sources", [str(corpus)])
+    index_dir = str(tmp_path / "index")
+    build_index(index_dir, [str(corpus)])
+    retriever = open_index(index_dir)
+    first = retriever.published()
+    assert retriever.invoke("short-term memory")[0].page_content.startswith("Agents keep short-term memory")
+
+    (corpus / "memory.txt").write_text("Agents keep long-term memory in a vector store.")
+    build_index(index_dir, [str(corpus)])
+    assert retriever.invoke("memory")[0].page_content == "Agents keep long-term memory in a vector store."
+    assert retriever.published() is not first
+    # a query already running on the previous build finishes on it
+    assert first.invoke("memory")[0].page_content.startswith("Agents keep short-term memory")
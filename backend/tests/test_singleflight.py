@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    calls = []
+
+    async def fetch(key: str) -> str:
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"result {key}"
+
+    async def run():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do(k, lambda k=k: fetch(k)) for k in ["a", "a", "b", "a"]))
+        # done, so the next call runs again
+        results.append(await flight.do("a", lambda: fetch("a")))
+        return results, flight.calls
+
+    results, in_flight = asyncio.run(run())
+    assert results == ["result a", "result a", "result b", "result a", "result a"]
+    assert calls == ["a", "b", "a"]
+    assert not in_flight
+
+
+def test_exception_is_shared():
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        flight = SingleFlight("test")
+        return await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_call_outlives_a_cancelled_caller():
+    async def fetch() -> str:
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        flight = SingleFlight("test")
+        leader = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_questions_coalesce_only_at_the_same_priority(monkeypatch):
+    import answering
+    from batching import grouping
+    from clients import BATCH, INTERACTIVE, priority
+    from metrics import RequestTrace
+
+    contexts = []
+
+    async def run_workflow(question, trace, embedding):
+        contexts.append((priority.get(), grouping.get()))
+        await asyncio.sleep(0.01)
+        trace.llm_calls += 1
+        return {"answer": "answer", "degraded": None}
+
+    monkeypatch.setattr(answering, "run_workflow", run_workflow)
+    monkeypatch.setattr(answering, "aget_semantic_cache", lambda: asyncio.sleep(0))
+
+    async def ask(prio: int) -> RequestTrace:
+        priority.set(prio)
+        grouping.set(prio == BATCH)
+        trace = RequestTrace()
+        await answering.answer_question("What is an agent?", trace)
+        return trace
+
+    async def run():
+        return await asyncio.gather(ask(BATCH), ask(INTERACTIVE), ask(INTERACTIVE))
+
+    batch, leader, follower = asyncio.run(run())
+    assert contexts == [(BATCH, True), (INTERACTIVE, False)]
+    assert (batch.coalesced, leader.coalesced, follower.coalesced) == (False, False, True)
+    assert follower.llm_calls == 0 and [node for node, _ in follower.nodes] == ["coalesced"]
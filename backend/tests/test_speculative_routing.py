@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import graph_routing
+import tools
+from graph_routing import speculative_route
+from settings import settings
+
+
+class Branches:
+    """The retriever, web search and LLM router; routing finishes only once retrieval started, so they overlap."""
+
+    def __init__(self, datasource: str):
+        self.datasource = datasource
+        self.retrieving = asyncio.Event()
+        self.cancelled = []
+
+    async def ainvoke(self, input, config=None):
+        if isinstance(input, dict):
+            # the router
+            await asyncio.wait_for(self.retrieving.wait(), 1)
+            return SimpleNamespace(datasource=self.datasource)
+        return await self.branch("vectorstore", ["vector doc"])
+
+    async def search_web(self, question):
+        return await self.branch("web_search", (["web doc"], 1))
+
+    async def branch(self, name, result):
+        self.retrieving.set()
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        return result
+
+
+def route(monkeypatch, datasource: str, web: bool) -> tuple[dict, Branches]:
+    async def run():
+        branches = Branches(datasource)
+        # into the namespace of tools, as getting the attributes would build the real ones
+        monkeypatch.setitem(vars(tools), "retriever", branches)
+        monkeypatch.setitem(vars(tools), "question_router", branches)
+        monkeypatch.setattr(graph_routing, "search_web", branches.search_web)
+        r = await speculative_route({"question": "What is agent memory?", "llm_calls": 2})
+        await asyncio.sleep(0)
+        return r, branches
+
+    monkeypatch.setitem(vars(tools), "local_router", None)
+    monkeypatch.setattr(settings, "speculative_web_search", web)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("web", [False, True])
+def test_vectorstore_keeps_the_prefetched_documents(monkeypatch, web):
+    r, branches = route(monkeypatch, "vectorstore", web)
+    assert r["datasource"] == "vectorstore" and r["prefetched_documents"] == ["vector doc"]
+    assert r["llm_calls"] == 3
+    assert branches.cancelled == (["web_search"] if web else [])
+
+
+def test_web_search_cancels_retrieval(monkeypatch):
+    r, branches = route(monkeypatch, "web_search", True)
+    assert r["datasource"] == "web_search" and r["prefetched_documents"] == ["web doc"]
+    assert r["llm_calls"] == 4
+    assert branches.cancelled == ["vectorstore"]
+
+
+def test_web_search_without_speculation_is_not_prefetched(monkeypatch):
+    r, branches = route(monkeypatch, "web_search", False)
+    assert r == {"datasource": "web_search", "question": "What is agent memory?", "llm_calls": 3}
+    assert branches.cancelled == ["vectorstore"]
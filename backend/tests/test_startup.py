@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+# Run in a fresh interpreter, so nothing is imported already
+PROBE = """
+import json, sys
+import api, tools
+print(json.dumps({
+    "built": [name for name in tools.attributes.builders if name in vars(tools)],
+    "imported": [m for m in ("chromadb", "tiktoken", "langchain_openai") if m in sys.modules],
+}))
+"""
+
+
+def test_importing_the_app_builds_nothing(tmp_path):
+    index_dir = tmp_path / "index"
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "INDEX_DIR": str(index_dir)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    probe = json.loads(out.stdout.strip().splitlines()[-1])
+    # the index, the chains and the heavy clients wait for load(), in the background
+    assert probe == {"built": [], "imported": []}
+    assert not index_dir.exists()
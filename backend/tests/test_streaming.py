@@ -0,0 +1,76 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import answering
+from tools import RAG_CHAIN_TAG
+
+
+def start(name: str) -> dict:
+    return {"event": "on_chain_start", "name": name, "parent_ids": ["run"]}
+
+
+def end(name: str, output: dict, parent_ids: tuple = ("run",)) -> dict:
+    return {"event": "on_chain_end", "name": name, "data": {"output": output}, "parent_ids": list(parent_ids)}
+
+
+class ScriptedWorkflow:
+    """Stands in for the compiled workflow, replaying the events of a run that regenerated its answer once."""
+
+    def __init__(self):
+        self.inputs = None
+
+    async def astream_events(self, inputs, config=None, version="v2"):
+        self.inputs = inputs
+        chunk = {"event": "on_chat_model_stream", "name": "llm", "tags": [RAG_CHAIN_TAG], "parent_ids": ["run"]}
+        yield start("retrieve")
+        yield start("generate")
+        yield {**chunk, "data": {"chunk": SimpleNamespace(content="First")}}
+        yield end("grade_generation", {"verdict": "not supported"})
+        yield start("generate")
+        yield {**chunk, "data": {"chunk": SimpleNamespace(content="Agents ")}}
+        yield {**chunk, "data": {"chunk": SimpleNamespace(content="")}}
+        yield {**chunk, "data": {"chunk": SimpleNamespace(content="remember.")}}
+        # not the answer chain: not streamed
+        yield {**chunk, "tags": [], "data": {"chunk": SimpleNamespace(content="yes")}}
+        yield end("grade_generation", {"verdict": "useful"})
+        yield end("LangGraph", {"generation": "Agents remember."}, parent_ids=())
+
+
+def events(question: str) -> list[tuple[str, dict]]:
+    async def run():
+        return [chunk async for chunk in answering.stream_answer(question)]
+
+    parsed = []
+    for chunk in asyncio.run(run()):
+        event, data = chunk.strip().split("\n")
+        parsed.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return parsed
+
+
+def test_stream_answer_events(monkeypatch):
+    workflow = ScriptedWorkflow()
+    monkeypatch.setattr(answering, "compiled_workflow", workflow)
+    monkeypatch.setattr(answering, "semantic_cache", None)
+    monkeypatch.setattr(answering, "semantic_cache_loaded", True)
+
+    r = events("What do agents do?")
+    assert [event for event, _ in r] == [
+        "node", "node", "token", "verdict", "node", "token", "token", "verdict", "answer", "trace"
+    ]
+    assert [data["token"] for event, data in r if event == "token"] == ["First", "Agents ", "remember."]
+    assert [data["verdict"] for event, data in r if event == "verdict"] == ["not supported", "useful"]
+    assert r[-2][1] == {"question": "What do agents do?", "answer": "Agents remember.", "cached": False, "degraded": None}
+    assert workflow.inputs["question"] == "What do agents do?"
+
+
+def test_stream_answer_reports_a_failure(monkeypatch):
+    class FailingWorkflow:
+        async def astream_events(self, inputs, config=None, version="v2"):
+            yield start("retrieve")
+            raise RuntimeError("index gone")
+
+    monkeypatch.setattr(answering, "compiled_workflow", FailingWorkflow())
+    monkeypatch.setattr(answering, "semantic_cache", None)
+    monkeypatch.setattr(answering, "semantic_cache_loaded", True)
+    assert events("What do agents do?") == [("node", {"node": "retrieve"}), ("error", {"message": "index gone"})]
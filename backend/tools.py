@@ -1,72 +1,66 @@
+### Chains and tools of the workflow. Each is built on first use, by the module __getattr__ below, so
+### importing this module is cheap; api.py builds them all while starting up, see load().
 from typing import Literal
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
 
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_community.tools.tavily_search import TavilySearchResults
 from pydantic import BaseModel, Field
-### from langchain_cohere import CohereEmbeddings
 
+from batching import GroupedStage
+from grouped_chains import (
+    GradeDocumentsBatch,
+    RouteQueries,
+    build_batch_question_router,
+    build_batch_retrieval_grader,
+    build_grouped_retrieval_grader,
+    pack_documents,
+    pack_questions,
+)
+from lazy import LazyAttributes
+from llms import build_llm
+from memo import memoize
+from prompts import RAG_PROMPT
+from rerank import build_reranker
+from router import build_local_router
+from settings import settings
+from web_search import build_query_expander, build_web_search_tool
+### from langchain_cohere import CohereEmbeddings
 
 
-# create index ########################################################################################################
-### Build Index
-from langchain_core.vectorstores import VectorStoreRetriever;
+attributes = LazyAttributes(globals())
+lazy = attributes.register
+__getattr__ = attributes.get
+load = attributes.load
 
-def build_index() -> VectorStoreRetriever:
 
-    # Set embeddings
-    embd = OpenAIEmbeddings()
+# open index ##########################################################################################################
+### Built offline by build_index.py, see indexing.py
+from indexing import open_index
 
-    # Docs to index
-    urls = [
-        "https://lilianweng.github.io/posts/2023-06-23-agent/",
-        "https://lilianweng.github.io/posts/2023-03-15-prompt-engineering/",
-        "https://lilianweng.github.io/posts/2023-10-25-adv-attack-llm/",
-    ]
+lazy("retriever", open_index)
 
-    # Load
-    docs = [WebBaseLoader(url).load() for url in urls]
-    docs_list = [item for sublist in docs for item in sublist]
-
-    # Split
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=500, chunk_overlap=0
-    )
-    doc_splits = text_splitter.split_documents(docs_list)
-
-    # Add to vectorstore
-    vectorstore = Chroma.from_documents(
-        documents=doc_splits,
-        collection_name="rag-chroma",
-        embedding=embd,
-    )
-    return vectorstore.as_retriever()
-
-retriever = build_index()
+# Scores retrieved documents locally before the LLM grades them, None unless settings.rerank_mode is set
+lazy("reranker", build_reranker)
 
 
 # LLMs ###################################################################################################################
+### The model step of every chain is memoized (see memo.py); data models live at module level so
+### memoized outputs can be persisted.
 
-def build_question_router():
-    # Data model
-    class RouteQuery(BaseModel):
-        """Route a user query to the most relevant datasource."""
+# Data model
+class RouteQuery(BaseModel):
+    """Route a user query to the most relevant datasource."""
 
-        datasource: Literal["vectorstore", "web_search"] = Field(
-            ...,
-            description="Given a user question choose to route it to web search or a vectorstore.",
-        )
+    datasource: Literal["vectorstore", "web_search"] = Field(
+        ...,
+        description="Given a user question choose to route it to web search or a vectorstore.",
+    )
 
 
+def build_question_router():
     # LLM with function call
-    llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
-    structured_llm_router = llm.with_structured_output(RouteQuery)
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_router = memoize(llm.with_structured_output(RouteQuery), "question_router", llm.model_name)
 
     # Prompt
     system = """You are an expert at routing a user question to a vectorstore or web search.
@@ -88,23 +82,43 @@ def build_question_router():
     # print(question_router.invoke({"question": "What are the types of agent memory?"}))
     return question_router
 
-question_router = build_question_router()
 
-### Retrieval Grader ##################################################################################################
-def build_retrieval_grader():
+def unpack_routes(output: RouteQueries, count: int) -> list[RouteQuery] | None:
+    if len(output.datasources) != count:
+        return None
+    return [RouteQuery(datasource=datasource) for datasource in output.datasources]
 
-    # Data model
-    class GradeDocuments(BaseModel):
-        """Binary score for relevance check on retrieved documents."""
 
-        binary_score: str = Field(
-            description="Documents are relevant to the question, 'yes' or 'no'"
-        )
+def build_grouped_question_router():
+    return GroupedStage(
+        "question_router",
+        build_question_router(),
+        build_batch_question_router(),
+        pack_questions,
+        unpack_routes,
+        settings.batch_window,
+        settings.batch_max_group,
+    )
+
+lazy("question_router", build_grouped_question_router)
 
+# Routes most questions without an LLM call, None unless settings.router_mode is "local"
+lazy("local_router", build_local_router)
+
+### Retrieval Grader ##################################################################################################
+# Data model
+class GradeDocuments(BaseModel):
+    """Binary score for relevance check on retrieved documents."""
+
+    binary_score: str = Field(
+        description="Documents are relevant to the question, 'yes' or 'no'"
+    )
 
+
+def build_retrieval_grader():
     # LLM with function call
-    llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
-    structured_llm_grader = llm.with_structured_output(GradeDocuments)
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_grader = memoize(llm.with_structured_output(GradeDocuments), "retrieval_grader", llm.model_name)
 
     # Prompt
     system = """You are a grader assessing relevance of a retrieved document to a user question. \n 
@@ -122,7 +136,29 @@ def build_retrieval_grader():
     
     return retrieval_grader
 
-retrieval_grader = build_retrieval_grader()
+
+lazy("batch_retrieval_grader", build_batch_retrieval_grader)
+
+
+def unpack_grades(output: GradeDocumentsBatch, count: int) -> list[GradeDocuments] | None:
+    grades = [grade.strip().lower() for grade in output.binary_scores]
+    if len(grades) != count:
+        return None
+    return [GradeDocuments(binary_score=grade) for grade in grades]
+
+
+lazy(
+    "retrieval_grader",
+    lambda: GroupedStage(
+        "retrieval_grader",
+        build_retrieval_grader(),
+        build_grouped_retrieval_grader(),
+        pack_documents,
+        unpack_grades,
+        settings.batch_window,
+        settings.batch_max_group,
+    ),
+)
 
 # question = "agent memory"
 # docs = retriever.invoke(question)
@@ -131,12 +167,14 @@ retrieval_grader = build_retrieval_grader()
     
 
 ### Generate ##########################################################################################################
+RAG_CHAIN_TAG = "rag_chain"
+
 def build_rag_chain():
     # Prompt
-    prompt = hub.pull("rlm/rag-prompt")
+    prompt = RAG_PROMPT
 
     # LLM
-    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+    llm = build_llm("gpt-3.5-turbo", stream_usage=True)
 
 
     # Post-processing
@@ -144,30 +182,34 @@ def build_rag_chain():
         return "\n\n".join(doc.page_content for doc in docs)
 
 
-    # Chain
-    rag_chain = prompt | llm | StrOutputParser()
+    # Chain, tagged so its tokens can be picked out of the streamed workflow events
+    rag_chain = (prompt | memoize(llm, "rag_chain", llm.model_name) | StrOutputParser()).with_config(
+        tags=[RAG_CHAIN_TAG]
+    )
     return rag_chain
 
-rag_chain = build_rag_chain()
+lazy("rag_chain", build_rag_chain)
 # # Run
 # generation = rag_chain.invoke({"context": docs, "question": question})
 # print(generation)
 
 ### Hallucination Grader ################################################################################################
 
-def build_hallucination_grader():
-    # Data model
-    class GradeHallucinations(BaseModel):
-        """Binary score for hallucination present in generation answer."""
+# Data model
+class GradeHallucinations(BaseModel):
+    """Binary score for hallucination present in generation answer."""
 
-        binary_score: str = Field(
-            description="Answer is grounded in the facts, 'yes' or 'no'"
-        )
+    binary_score: str = Field(
+        description="Answer is grounded in the facts, 'yes' or 'no'"
+    )
 
 
+def build_hallucination_grader():
     # LLM with function call
-    llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
-    structured_llm_grader = llm.with_structured_output(GradeHallucinations)
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_grader = memoize(
+        llm.with_structured_output(GradeHallucinations), "hallucination_grader", llm.model_name
+    )
 
     # Prompt
     system = """You are a grader assessing whether an LLM generation is grounded in / supported by a set of retrieved facts. \n 
@@ -182,26 +224,25 @@ def build_hallucination_grader():
     hallucination_grader = hallucination_prompt | structured_llm_grader
     return hallucination_grader
 
-hallucination_grader = build_hallucination_grader()
+lazy("hallucination_grader", build_hallucination_grader)
 #hallucination = hallucination_grader.invoke({"documents": docs, "generation": generation})
 #print(hallucination)
 ## GradeHallucinations(binary_score='yes')
 
 ### Answer Grader ######################################################################################################
-def build_answer_grader():
-
-    # Data model
-    class GradeAnswer(BaseModel):
-        """Binary score to assess answer addresses question."""
+# Data model
+class GradeAnswer(BaseModel):
+    """Binary score to assess answer addresses question."""
 
-        binary_score: str = Field(
-            description="Answer addresses the question, 'yes' or 'no'"
-        )
+    binary_score: str = Field(
+        description="Answer addresses the question, 'yes' or 'no'"
+    )
 
 
+def build_answer_grader():
     # LLM with function call
-    llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
-    structured_llm_grader = llm.with_structured_output(GradeAnswer)
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm_grader = memoize(llm.with_structured_output(GradeAnswer), "answer_grader", llm.model_name)
 
     # Prompt
     system = """You are a grader assessing whether an answer addresses / resolves a question \n 
@@ -216,7 +257,7 @@ def build_answer_grader():
     answer_grader = answer_prompt | structured_llm_grader
     return answer_grader
 
-answer_grader = build_answer_grader()
+lazy("answer_grader", build_answer_grader)
 #answer_grader.invoke({"question": question, "generation": generation})
 
 ## GradeAnswer(binary_score='yes')
@@ -224,7 +265,7 @@ answer_grader = build_answer_grader()
 ### Question Re-writer ################################################################################################
 def build_question_rewriter():
     # LLM
-    llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+    llm = build_llm("gpt-3.5-turbo-0125")
 
     # Prompt
     system = """You a question re-writer that converts an input question to a better version that is optimized \n 
@@ -239,14 +280,16 @@ def build_question_rewriter():
         ]
     )
 
-    question_rewriter = re_write_prompt | llm | StrOutputParser()
+    question_rewriter = re_write_prompt | memoize(llm, "question_rewriter", llm.model_name) | StrOutputParser()
     return question_rewriter
 
-question_rewriter = build_question_rewriter()
+lazy("question_rewriter", build_question_rewriter)
 #question_rewriter.invoke({"question": question})
 
 ## "What is the role of memory in an agent's functioning?"
 
 ### Search #############################################################################################################
+lazy("web_search_tool", build_web_search_tool)
 
-web_search_tool = TavilySearchResults(k=3)
+lazy("query_expander", build_query_expander)
+#query_expander.invoke({"question": question, "n": 2})
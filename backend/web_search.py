@@ -0,0 +1,118 @@
+## Web Search #########################################################################################################
+import os
+
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel, Field
+
+from clients import async_http_client, http_client
+from fakes import build_fake_web_search
+from llms import build_llm
+from memo import memoize
+from search_cache import build_search_cache
+from settings import settings
+
+TAVILY_URL = "https://api.tavily.com/search"
+
+
+def build_tavily_search(k: int = 3) -> Runnable:
+    """
+    Does what TavilySearchResults does, through the shared HTTP clients rather than a session of its
+    own per call: the k results for {"query": ...}, as [{"url": ..., "content": ...}, ...].
+    """
+
+    def body(input: dict) -> dict:  # pylint: disable=redefined-builtin
+        return {
+            "api_key": os.environ["TAVILY_API_KEY"],
+            "query": input["query"],
+            "max_results": k,
+            "search_depth": "advanced",
+        }
+
+    def results(response) -> list[dict]:
+        response.raise_for_status()
+        return [{"url": r["url"], "content": r["content"]} for r in response.json().get("results", [])]
+
+    def search(input: dict) -> list[dict]:  # pylint: disable=redefined-builtin
+        return results(http_client.post(TAVILY_URL, json=body(input)))
+
+    async def asearch(input: dict) -> list[dict]:  # pylint: disable=redefined-builtin
+        return results(await async_http_client.post(TAVILY_URL, json=body(input)))
+
+    return RunnableLambda(search, afunc=asearch, name="tavily_search")
+
+
+def merge_results(result_lists: list[list[dict]], limit: int) -> list[dict]:
+    """
+    The results of several queries as one list of at most limit: the first result of every query, then
+    the second ones and so on, leaving out results whose URL or content came up already.
+    """
+    merged, seen = [], set()
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank >= len(results):
+                continue
+            r = results[rank]
+            keys = {("url", r["url"].rstrip("/").lower()), ("content", " ".join(r["content"].split()).lower())}
+            if keys & seen:
+                continue
+            seen |= keys
+            merged.append(r)
+            if len(merged) == limit:
+                return merged
+    return merged
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """text cut to at most max_chars, at a word boundary when there is one."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[: max(0, max_chars - 4)]
+    if not text[len(cut)].isspace() and len(cut.split()) > 1:
+        # the last word was cut in two
+        cut = cut.rsplit(maxsplit=1)[0]
+    return cut.rstrip() + " ..."
+
+
+def to_documents(results: list[dict], max_chars: int) -> list[Document]:
+    """A document per search result, its content cut to max_chars, so prompts made of them stay small."""
+    return [Document(page_content=truncate(r["content"], max_chars), metadata={"source": r["url"]}) for r in results]
+
+
+def build_web_search_tool():
+    if settings.web_search_backend == "fake":
+        search = build_fake_web_search(settings.fake_web_search_latency, k=settings.web_search_k)
+    else:
+        search = build_tavily_search(k=settings.web_search_k)
+    # repeated queries are answered from the cache, see search_cache.py
+    cache = build_search_cache()
+    return search if cache is None else cache.wrap(search)
+
+
+# Data model
+class SearchQueries(BaseModel):
+    """Web search queries for a question."""
+
+    queries: list[str] = Field(
+        description="Different web search queries, each on its own finding what the question asks"
+    )
+
+
+def build_query_expander():
+    # LLM with function call
+    llm = build_llm("gpt-3.5-turbo-0125")
+    structured_llm = memoize(llm.with_structured_output(SearchQueries), "query_expander", llm.model_name)
+
+    # Prompt
+    system = """You write web search queries for a user question. Each query should find what the question asks \n
+        on its own, worded differently from the question and from the other queries, so together they cover more."""
+    query_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            ("human", "User question: \n\n {question} \n\n Number of queries: {n}"),
+        ]
+    )
+
+    query_expander = query_prompt | structured_llm
+    return query_expander
@@ -2,7 +2,11 @@
 from langgraph.graph import END, StateGraph, START
 ### from langchain_cohere import CohereEmbeddings
 
-from graph import GraphState,web_search, retrieve, grade_documents, generate, transform_query, route_question, decide_to_generate, grade_generation_v_documents_and_question
+from graph import GraphState,web_search, retrieve, generate, transform_query, route_question, decide_to_generate, grade_generation_v_documents_and_question, unchecked
+from graph_budget import start, decide_after_grading, give_up, with_deadline
+from graph_grading import grade_documents, rerank
+from graph_routing import speculative_route, decide_route
+from settings import settings
 
 
 
@@ -11,39 +15,62 @@ from graph import GraphState,web_search, retrieve, grade_documents, generate, tr
 
 workflow = StateGraph(GraphState)
 
-# Define the nodes
-workflow.add_node("web_search", web_search)  # web search
-workflow.add_node("retrieve", retrieve)  # retrieve
-workflow.add_node("grade_documents", grade_documents)  # grade documents
-workflow.add_node("generate", generate)  # generatae
-workflow.add_node("transform_query", transform_query)  # transform_query
+# Define the nodes, each cut short when the deadline of the question passes while it runs
+workflow.add_node("web_search", with_deadline(web_search))  # web search
+workflow.add_node("retrieve", with_deadline(retrieve))  # retrieve
+workflow.add_node("grade_documents", with_deadline(grade_documents))  # grade documents
+workflow.add_node("generate", with_deadline(generate))  # generatae
+workflow.add_node("transform_query", with_deadline(transform_query))  # transform_query
+workflow.add_node("start", start)  # start the budget
+workflow.add_node(
+    "grade_generation", with_deadline(grade_generation_v_documents_and_question, unchecked)
+)  # grade generation, or leave it unchecked
+workflow.add_node("give_up", give_up)  # return the best answer so far, out of budget
+if settings.rerank_mode != "none":
+    workflow.add_node("rerank", with_deadline(rerank))  # score documents locally
 
 # Build graph
+workflow.add_edge(START, "start")
+if settings.speculative_routing:
+    # retrieve while routing, see speculative_route
+    workflow.add_node("route", with_deadline(speculative_route))
+else:
+    workflow.add_node("route", with_deadline(route_question))
+workflow.add_edge("start", "route")
 workflow.add_conditional_edges(
-    START,
-    route_question,
+    "route",
+    decide_route,
     {
         "web_search": "web_search",
         "vectorstore": "retrieve",
+        "give_up": "give_up",
     },
 )
 workflow.add_edge("web_search", "generate")
-workflow.add_edge("retrieve", "grade_documents")
+if settings.rerank_mode != "none":
+    workflow.add_edge("retrieve", "rerank")
+    workflow.add_edge("rerank", "grade_documents")
+else:
+    workflow.add_edge("retrieve", "grade_documents")
 workflow.add_conditional_edges(
     "grade_documents",
     decide_to_generate,
     {
         "transform_query": "transform_query",
         "generate": "generate",
+        "give_up": "give_up",
     },
 )
 workflow.add_edge("transform_query", "retrieve")
+workflow.add_edge("generate", "grade_generation")
 workflow.add_conditional_edges(
-    "generate",
-    grade_generation_v_documents_and_question,
+    "grade_generation",
+    decide_after_grading,
     {
         "not supported": "generate",
         "useful": END,
         "not useful": "transform_query",
+        "give_up": "give_up",
     },
 )
+workflow.add_edge("give_up", END)
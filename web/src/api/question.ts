@@ -7,4 +7,54 @@ export async function submitQuestion(ui: UIContextType, question: QuestionReques
     const resp = await withAxios(ui).post('/question', question);
     return AnswerResponse.with(resp);
   }
-  
\ No newline at end of file
+  
+export type AnswerStreamHandler = (event: string, data: any) => void;
+
+/**
+ * Posts the question to the streaming endpoint and calls onEvent for every server-sent event
+ * (node, token, verdict, answer, trace, error) as it arrives.
+ */
+export async function streamQuestion(ui: UIContextType, question: QuestionRequest, onEvent: AnswerStreamHandler): Promise<void> {
+    const resp = await fetch('/rest/v1/question:stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(question),
+        credentials: 'include',
+    });
+    if (!resp.ok || !resp.body) {
+        const msg = `${resp.status} ${resp.statusText}`;
+        ui.setError(msg);
+        throw new Error(msg);
+    }
+
+    const reader = resp.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buf = '';
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buf += value;
+
+        let end: number;
+        while ((end = buf.indexOf('\n\n')) >= 0) {
+            const raw = buf.slice(0, end);
+            buf = buf.slice(end + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of raw.split('\n')) {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            }
+            const payload = data ? JSON.parse(data) : null;
+            if (event === 'error') {
+                ui.setError(payload?.message);
+            }
+            onEvent(event, payload);
+        }
+    }
+}
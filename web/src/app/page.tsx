@@ -1,17 +1,45 @@
 "use client";
 import { useState } from "react";
 import { TextField, Button, Container, Typography, Box } from "@mui/material";
-import { submitQuestion } from "../api"
+import { streamQuestion } from "../api"
 import { useUIContext } from "@/lib";
 
 export default function Home() {
   const [question, setQuestion] = useState("What player at the Bears expected to draft first in the 2024 NFL draft?");
   const [answer, setAnswer] = useState("");
+  const [status, setStatus] = useState("");
+  const [busy, setBusy] = useState(false);
   const ui = useUIContext();
 
   const handleSubmit = async () => {
-    const resp = await submitQuestion(ui, { question });
-    setAnswer(resp.answer);
+    setAnswer("");
+    setStatus("");
+    setBusy(true);
+    try {
+      await streamQuestion(ui, { question }, (event, data) => {
+        switch (event) {
+          case "node":
+            setStatus(data.node);
+            if (data.node === "generate") {
+              // a re-generation starts over
+              setAnswer("");
+            }
+            break;
+          case "token":
+            setAnswer((prev) => prev + data.token);
+            break;
+          case "verdict":
+            setStatus(data.verdict);
+            break;
+          case "answer":
+            setAnswer(data.answer);
+            setStatus(data.degraded ? `best effort answer, ${data.degraded} budget exhausted` : "");
+            break;
+        }
+      });
+    } finally {
+      setBusy(false);
+    }
   };
 
   return (
@@ -36,12 +64,18 @@ export default function Home() {
           variant="contained"
           color="primary"
           onClick={handleSubmit}
-          disabled={!question.trim()}
+          disabled={busy || !question.trim()}
         >
           Submit
         </Button>
       </Box>
 
+      {status && (
+        <Box mt={2} textAlign="center">
+          <Typography variant="caption" color="text.secondary">{status}</Typography>
+        </Box>
+      )}
+
       {answer && (
         <Box mt={4} p={2} border={1} borderRadius={2} borderColor="grey.300">
           <Typography variant="h6">Response:</Typography>
@@ -7,6 +7,8 @@ export class QuestionRequest {
 export class AnswerResponse {
     question: string;
     answer: string;
+    cached?: boolean;
+    degraded?: string | null;
 
     static with(obj: any): AnswerResponse {
         if (!obj) return;